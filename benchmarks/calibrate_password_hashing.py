@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Benchmarks password hashing on this machine and suggests settings that hit a target verify latency.
+
+With no options, measures the default crypt context of the password column and then calibrates argon2, bcrypt,
+and pbkdf2_sha256 for the target.  Paste the `crypt_context_string` of the one you like into your password column.
+
+Usage: ./benchmarks/calibrate_password_hashing.py [--target-ms 250] [--concurrency 1] [--scheme argon2 ...]
+                                                  [--memory-cost KiB] [--crypt-context-string "..."]
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+from passlib.context import CryptContext
+from clearskies_auth_server.hashing import calibrate, calibration_schemes, measure
+
+# the default crypt context of the password column
+default_crypt_context = {"schemes": ["argon2"], "argon2__rounds": 5}
+
+
+def show(label, result):
+    print(
+        f"{label:<28} verify {result['verify_seconds'] * 1000:8.1f} ms"
+        + (f" (max {result['max_verify_seconds'] * 1000:.1f} ms)" if "max_verify_seconds" in result else "")
+        + f" at concurrency {result['concurrency']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate password hashing for a target verify latency")
+    parser.add_argument("--target-ms", type=float, default=250, help="the target verify latency, in milliseconds")
+    parser.add_argument("--concurrency", type=int, default=1, help="how many logins to verify at the same time")
+    parser.add_argument("--scheme", action="append", choices=calibration_schemes, help="the scheme(s) to calibrate")
+    parser.add_argument("--memory-cost", type=int, default=None, help="the argon2 memory cost, in KiB")
+    parser.add_argument("--crypt-context-string", default=None, help="the crypt context to measure")
+    args = parser.parse_args()
+
+    if args.crypt_context_string:
+        current = CryptContext.from_string(args.crypt_context_string)
+    else:
+        current = CryptContext(**default_crypt_context)
+    show("current settings", measure(current, concurrency=args.concurrency))
+
+    for scheme in args.scheme or ["argon2", "bcrypt", "pbkdf2_sha256"]:
+        result = calibrate(scheme, args.target_ms / 1000, concurrency=args.concurrency, memory_cost=args.memory_cost)
+        print()
+        show(f"calibrated {scheme}", result)
+        if result["verify_seconds"] > args.target_ms / 1000:
+            hint = "try a lower --memory-cost" if scheme == "argon2" else "this machine can't do better"
+            print(f"(even the cheapest settings are over the target: {hint})")
+        print(result["crypt_context_string"].strip())
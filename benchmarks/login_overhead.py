@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measures the per-request overhead of the PasswordLogin handler itself.
+
+Password hashing and JWT signing dwarf everything else in a login, so both are stubbed out here (the password
+column uses passlib's plaintext "hash", and signing returns a constant), which leaves the work that the handler
+does per request: mapping the input, checking it, finding the user, and building the claims.  Users are kept in
+the memory backend.
+
+Usage: ./benchmarks/login_overhead.py [number_of_requests]
+"""
+import os
+import sys
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+import clearskies
+from clearskies.column_types import audit, created, email, json, string, updated
+from clearskies.input_requirements import required
+from clearskies.mocks import InputOutput
+from clearskies_auth_server.column_types import password
+from clearskies_auth_server.handlers import PasswordLogin
+
+
+class AuditRecord(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("class"),
+                string("resource_id"),
+                string("action"),
+                string("email"),
+                string("user_id"),
+                json("data"),
+                created("created_at"),
+                updated("updated_at"),
+            ]
+        )
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email", input_requirements=[required()]),
+                string("name"),
+                password("password", input_requirements=[required()], crypt_context={"schemes": ["plaintext"]}),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class StubbedPasswordLogin(PasswordLogin):
+    def create_signed_jwt(self, claims, path=None, use_cache=True):
+        return "not-a-real-token"
+
+
+def build_handler(**handler_config):
+    secrets = SimpleNamespace(get=lambda path, silent_if_not_found=False: "{}")
+    di = clearskies.di.StandardDependencies(bindings={"secrets": secrets})
+    users = di.build(User)
+    for i in range(100):
+        users.create({"email": f"user{i}@example.com", "name": f"User {i}", "password": "password"})
+    handler = di.build(StubbedPasswordLogin)
+    handler.configure(
+        {
+            "authentication": clearskies.authentication.public(),
+            "path_to_private_keys": "/private",
+            "path_to_public_keys": "/public",
+            "user_model_class": User,
+            "issuer": "https://example.com",
+            "audience": "example.com",
+            "claims_column_names": ["email", "name"],
+            **handler_config,
+        }
+    )
+    return handler
+
+
+def run(label, handler, number_of_requests):
+    body = {"email": "user50@example.com", "password": "password"}
+    start = time.perf_counter()
+    for i in range(number_of_requests):
+        (response, status_code) = handler(InputOutput(body=body))
+    elapsed = time.perf_counter() - start
+    if status_code != 200:
+        raise ValueError(f"Login failed: {response}")
+    print(f"{label:<28} {elapsed / number_of_requests * 1000000:10.1f} microseconds/request")
+
+
+if __name__ == "__main__":
+    number_of_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run("no audit, no lockout", build_handler(audit=False, account_lockout=False), number_of_requests)
+    run("audit and lockout", build_handler(), number_of_requests)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Measures how many tokens per second we can sign.
+
+Compares re-building the signing key out of the key data for every token (the old behavior of
+`KeyBase.get_youngest_private_key(..., as_json=False)`) with the parsed key cache in `KeyBase`, and then
+signing through jwcrypto's `jwt.JWT` with the pre-encoded signing path in `KeyBase.create_signed_jwt`.
+
+Usage: ./benchmarks/signing.py [number_of_tokens]
+"""
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+import clearskies
+from jwcrypto import jwk, jwt
+from clearskies_auth_server.handlers import Jwks
+
+
+def build_handler(key_size):
+    key = jwk.JWK.generate(kty="RSA", size=key_size, kid="benchmark", alg="RSA256", use="sig")
+    private_keys = {"benchmark": {**json.loads(key.export_private()), "issue_date": "1"}}
+    secrets = SimpleNamespace(get=lambda path, silent_if_not_found=False: json.dumps(private_keys))
+    handler = clearskies.di.StandardDependencies(bindings={"secrets": secrets}).build(Jwks)
+    handler.configure(
+        {
+            "path_to_private_keys": "/private",
+            "path_to_public_keys": "/public",
+            "key_size": key_size,
+            "authentication": clearskies.authentication.public(),
+        }
+    )
+    return handler
+
+
+def claims():
+    now = int(time.time())
+    return {"aud": "example.com", "iss": "https://example.com", "exp": now + 86400, "email": "a@b.com", "iat": now}
+
+
+def sign(signing_key):
+    token = jwt.JWT(header={"alg": "RS256", "typ": "JWT", "kid": signing_key["kid"]}, claims=claims())
+    token.make_signed_token(signing_key)
+    return token.serialize()
+
+
+def uncached(handler):
+    keys = handler.fetch_and_check_keys("/private")
+    return sign(jwk.JWK(**keys[max(keys, key=lambda key_id: keys[key_id]["issue_date"])]))
+
+
+def cached(handler):
+    return sign(handler.get_signing_key("/private"))
+
+
+def pre_encoded(handler):
+    return handler.create_signed_jwt(claims(), path="/private")
+
+
+def run(label, sign_one, handler, number_of_tokens):
+    start = time.perf_counter()
+    for i in range(number_of_tokens):
+        sign_one(handler)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {number_of_tokens / elapsed:10.1f} tokens/second")
+    return elapsed
+
+
+if __name__ == "__main__":
+    number_of_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    handler = build_handler(2048)
+    before = run("rebuild key per token", uncached, handler, number_of_tokens)
+    after = run("parsed key cache", cached, handler, number_of_tokens)
+    fastest = run("pre-encoded signing", pre_encoded, handler, number_of_tokens)
+    print(f"parsed key cache speedup: {before / after:.2f}x")
+    print(f"pre-encoded signing speedup over jwcrypto: {after / fastest:.2f}x")
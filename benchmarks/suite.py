@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Runs the handlers end-to-end and checks the results against a stored baseline.
+
+Every scenario gets its own application: models in the memory backend, a fake secret manager, and a clock that
+only moves when we tell it to.  Password hashing uses argon2 with the cheapest settings it allows (the hash cost
+is something you calibrate, see calibrate_password_hashing.py, while this is about what we do around it) and
+signing uses a real 2048 bit RSA key.  For each scenario we report the p50 and p99 latency, the throughput, and
+how much memory a request allocates (the peak, as traced by tracemalloc, in a separate pass).
+
+The thresholds live in benchmarks/baseline.json, and if any scenario goes over one of its thresholds we exit
+with a non-zero status, so this can run in CI.  After an intentional change, re-record the baseline with
+`--update-baseline`, which stores the current results times `--headroom`.
+
+Usage: ./benchmarks/suite.py [--requests 200] [--scenario password_login ...] [--update-baseline] [--headroom 2]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+import clearskies
+from clearskies.column_types import audit, created, datetime as datetime_column, email, json as json_column
+from clearskies.column_types import string, updated
+from clearskies.input_requirements import required
+from clearskies.mocks import InputOutput
+from jwcrypto import jwk
+from clearskies_auth_server import applications, handlers
+from clearskies_auth_server.authentication import JwksDirect
+from clearskies_auth_server.column_types import password
+
+baseline_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baseline.json")
+minimum_thresholds = {"p50_ms": 0.1, "p99_ms": 0.5, "alloc_kib": 4}
+
+
+class AuditRecord(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("class"),
+                string("resource_id"),
+                string("action"),
+                string("email"),
+                string("user_id"),
+                json_column("data"),
+                created("created_at"),
+                updated("updated_at"),
+            ]
+        )
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email", input_requirements=[required()]),
+                password(
+                    "password",
+                    input_requirements=[required()],
+                    crypt_context={
+                        "schemes": ["argon2"],
+                        "argon2__rounds": 1,
+                        "argon2__memory_cost": 8,
+                        "argon2__parallelism": 1,
+                    },
+                ),
+                string("tenant_id"),
+                string("login_key"),
+                datetime_column("login_key_expiration"),
+                string("reset_key"),
+                datetime_column("reset_key_expiration"),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class FakeSecrets:
+    """
+    A secret manager that lives in a dictionary.
+    """
+
+    def __init__(self, secrets):
+        self.secrets = {**secrets}
+
+    def get(self, path, silent_if_not_found=False):
+        if path not in self.secrets and not silent_if_not_found:
+            raise KeyError(f"No secret at '{path}'")
+        return self.secrets.get(path)
+
+    def upsert(self, path, value):
+        self.secrets[path] = value
+
+
+class FakeClock:
+    """
+    Stands in for the datetime module: time stands still until you call `tick()`.
+    """
+
+    def __init__(self, now):
+        self.now = now
+        self.timezone = datetime.timezone
+        self.timedelta = datetime.timedelta
+        clock = self
+
+        class FrozenDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now.astimezone(tz) if tz else clock.now.replace(tzinfo=None)
+
+        self.datetime = FrozenDatetime
+
+    def tick(self, seconds):
+        self.now = self.now + datetime.timedelta(seconds=seconds)
+
+
+class Environment:
+    """
+    Everything that one scenario runs against.
+    """
+
+    number_of_users = 100
+
+    def __init__(self, key_data):
+        self.clock = FakeClock(datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0))
+        self.secrets = FakeSecrets(
+            {
+                "/keys/private": json.dumps(key_data["private"]),
+                "/keys/public": json.dumps(key_data["public"]),
+            }
+        )
+        self.di = clearskies.di.StandardDependencies(bindings={"secrets": self.secrets, "datetime": self.clock})
+        self.users = self.di.build(User)
+        for i in range(self.number_of_users):
+            self.users.create(
+                {
+                    "email": f"user{i}@example.com",
+                    "password": "password",
+                    "tenant_id": f"tenant-{i % 2}",
+                }
+            )
+        self.user = self.users.find("email=user50@example.com")
+
+    def handler(self, handler_class, **handler_config):
+        handler = self.di.build(handler_class, cache=False)
+        handler.configure({"authentication": clearskies.authentication.public(), **handler_config})
+        return handler
+
+    def login_config(self, **handler_config):
+        return {
+            "user_model_class": User,
+            "path_to_private_keys": "/keys/private",
+            "path_to_public_keys": "/keys/public",
+            "issuer": "https://example.com",
+            "audience": "example.com",
+            "claims_column_names": ["email", "tenant_id"],
+            **handler_config,
+        }
+
+
+def check_status(response, expected_status=200):
+    (body, status_code) = response
+    if status_code != expected_status:
+        raise ValueError(f"Expected a {expected_status} but got a {status_code}: {body}")
+    return body
+
+
+def password_login(environment):
+    handler = environment.handler(handlers.PasswordLogin, **environment.login_config())
+    body = {"email": "user50@example.com", "password": "password"}
+    return (None, lambda i: check_status(handler(InputOutput(body=body))))
+
+
+def password_less_link_login(environment):
+    handler = environment.handler(
+        handlers.PasswordLessLinkLogin,
+        **environment.login_config(
+            username_column_name="email",
+            key_column_name="login_key",
+            key_expiration_column_name="login_key_expiration",
+        ),
+    )
+
+    def setup(i):
+        expiration = environment.clock.now + datetime.timedelta(hours=1)
+        environment.user.save({"login_key": f"login-key-{i}", "login_key_expiration": expiration})
+
+    def request(i):
+        check_status(handler(InputOutput(query_parameters={"login_key": f"login-key-{i}"})))
+
+    return (setup, request)
+
+
+def switch_tenant(environment):
+    config = environment.login_config(
+        tenant_id_column_name="tenant_id",
+        tenant_id_source="routing_data",
+        tenant_id_source_key_name="tenant_id",
+    )
+    handler = environment.handler(handlers.SwitchTenant, **config)
+    exp = int((environment.clock.now + datetime.timedelta(hours=1)).timestamp())
+
+    def request(i):
+        input_output = InputOutput(authorization_data={"email": "user50@example.com", "exp": exp})
+        input_output.set_routing_data({"tenant_id": "tenant-0"})
+        check_status(handler(input_output))
+
+    return (None, request)
+
+
+def password_reset(environment):
+    handler = environment.handler(handlers.PasswordReset, user_model_class=User, readable_columns=["email"])
+
+    def setup(i):
+        expiration = environment.clock.now + datetime.timedelta(hours=1)
+        environment.user.save({"reset_key": f"reset-key-{i}", "reset_key_expiration": expiration})
+
+    def request(i):
+        input_output = InputOutput(body={"password": "password"})
+        input_output.set_routing_data({"reset_key": f"reset-key-{i}"})
+        check_status(handler(input_output))
+
+    return (setup, request)
+
+
+def jwks(environment):
+    handler = environment.handler(
+        handlers.Jwks, path_to_private_keys="/keys/private", path_to_public_keys="/keys/public"
+    )
+    return (None, lambda i: check_status(handler(InputOutput())))
+
+
+def jwks_direct(environment):
+    login = environment.handler(handlers.PasswordLogin, **environment.login_config())
+    token = check_status(login(InputOutput(body={"email": "user50@example.com", "password": "password"})))["token"]
+    authentication = environment.di.build(JwksDirect, cache=False)
+    authentication.configure(path_to_public_keys="/keys/public", audience="example.com", issuer="https://example.com")
+    return (None, lambda i: authentication.validate_jwt(token))
+
+
+def key_manager_list(environment):
+    router = build_key_manager(environment)
+    return (None, lambda i: check_status(router(InputOutput(request_method="GET"))))
+
+
+def key_manager_rotate(environment):
+    """
+    Creates a key and then deletes the oldest one, so the key set stays the same size.
+    """
+    router = build_key_manager(environment)
+
+    def request(i):
+        check_status(router(InputOutput(request_method="POST")))
+        environment.clock.tick(1)
+        check_status(router(InputOutput(request_method="DELETE")))
+
+    return (None, request)
+
+
+def build_key_manager(environment):
+    # EdDSA keys, since generating RSA keys would drown out everything else
+    application = applications.key_manager(
+        path_to_public_keys="/keys/public",
+        path_to_private_keys="/keys/private",
+        algorithm="EdDSA",
+        authentication=clearskies.authentication.public(),
+    )
+    router = environment.di.build(application.handler_class, cache=False)
+    router.configure(application.handler_config)
+    return router
+
+
+scenarios = OrderedDict(
+    [
+        ("password_login", password_login),
+        ("password_less_link_login", password_less_link_login),
+        ("switch_tenant", switch_tenant),
+        ("password_reset", password_reset),
+        ("jwks", jwks),
+        ("jwks_direct", jwks_direct),
+        ("key_manager_list", key_manager_list),
+        ("key_manager_rotate", key_manager_rotate),
+    ]
+)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def run_scenario(name, key_data, number_of_requests, warmup, allocation_requests):
+    environment = Environment(key_data)
+    (setup, request) = scenarios[name](environment)
+    i = 0
+
+    def next_request():
+        nonlocal i
+        i += 1
+        if setup:
+            setup(i)
+        return i
+
+    for _ in range(warmup):
+        request(next_request())
+
+    latencies = []
+    for _ in range(number_of_requests):
+        request_number = next_request()
+        start = time.perf_counter()
+        request(request_number)
+        latencies.append(time.perf_counter() - start)
+
+    # tracing slows everything down, so allocations get their own pass
+    allocations = []
+    tracemalloc.start()
+    try:
+        for _ in range(allocation_requests):
+            request_number = next_request()
+            tracemalloc.reset_peak()
+            (before, peak) = tracemalloc.get_traced_memory()
+            request(request_number)
+            allocations.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    allocations.sort()
+    return {
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "requests_per_second": len(latencies) / sum(latencies),
+        "alloc_kib": percentile(allocations, 0.5) / 1024,
+    }
+
+
+def generate_key_data():
+    key = jwk.JWK.generate(kty="RSA", size=2048, kid="benchmark", alg="RSA256", use="sig")
+    issue_date = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    return {
+        "private": {"benchmark": {**json.loads(key.export_private()), "issue_date": issue_date}},
+        "public": {"benchmark": {**json.loads(key.export_public()), "issue_date": issue_date}},
+    }
+
+
+def check_baseline(results, baseline):
+    """
+    Returns a list of the thresholds that the results went over.
+    """
+    failures = []
+    for name, result in results.items():
+        thresholds = baseline.get(name)
+        if not thresholds:
+            continue
+        for metric, threshold in thresholds.items():
+            if result[metric] > threshold:
+                failures.append(f"{name}: {metric} is {result[metric]:.2f}, which is over the threshold of {threshold}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the auth server handlers against a stored baseline.")
+    parser.add_argument("--requests", type=int, default=200, help="How many requests to time for each scenario.")
+    parser.add_argument("--warmup", type=int, default=20, help="How many requests to make before timing.")
+    parser.add_argument("--allocation-requests", type=int, default=20, help="How many requests to trace.")
+    parser.add_argument("--scenario", action="append", choices=list(scenarios.keys()), help="Only run these.")
+    parser.add_argument("--baseline", default=baseline_path, help="The file with the thresholds.")
+    parser.add_argument("--update-baseline", action="store_true", help="Record new thresholds from this run.")
+    parser.add_argument("--headroom", type=float, default=2.0, help="Thresholds are the results times this.")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    key_data = generate_key_data()
+    results = OrderedDict()
+    for name in args.scenario or scenarios.keys():
+        results[name] = run_scenario(name, key_data, args.requests, args.warmup, args.allocation_requests)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scenario':<26} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'KiB/req':>9}")
+        for name, result in results.items():
+            print(
+                f"{name:<26} {result['p50_ms']:9.2f} {result['p99_ms']:9.2f} "
+                + f"{result['requests_per_second']:9.1f} {result['alloc_kib']:9.1f}"
+            )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if args.update_baseline:
+        for name, result in results.items():
+            # very fast requests get a floor, since otherwise timer noise alone would go over the threshold
+            baseline[name] = {
+                metric: round(max(result[metric] * args.headroom, minimum_thresholds[metric]), 2)
+                for metric in ["p50_ms", "p99_ms", "alloc_kib"]
+            }
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=4)
+            baseline_file.write("\n")
+        print(f"Updated the baseline in {args.baseline}")
+        return 0
+
+    failures = check_baseline(results, baseline)
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,33 @@
 from . import applications
+from . import audits
 from . import authentication
 from . import column_types
 from . import di
 from . import handlers
+from . import hashing
+from . import imports
 from . import input_requirements
+from . import keys
+from . import lockouts
+from . import metrics
+from . import rate_limits
+from . import refresh_tokens
+from . import timings
 
 __all__ = [
     "applications",
+    "audits",
     "authentication",
     "column_types",
     "di",
     "handlers",
+    "hashing",
+    "imports",
     "input_requirements",
+    "keys",
+    "lockouts",
+    "metrics",
+    "rate_limits",
+    "refresh_tokens",
+    "timings",
 ]
@@ -8,6 +8,9 @@ def key_manager(
     algorithm: str = None,
     key_type: str = None,
     key_size: int = None,
+    key_generation: str = None,
+    key_pool_size: int = None,
+    key_storage_layout: str = None,
     authentication: clearskies.BindingConfig = None,
 ) -> clearskies.Application:
     if not path_to_public_keys:
@@ -24,15 +27,23 @@ def key_manager(
         "algorithm": algorithm,
         "key_type": key_type,
         "key_size": key_size,
+        "key_storage_layout": key_storage_layout,
     }
     handler_config = {key: value for (key, value) in handler_config.items() if value}
+    # only the CreateKey handler knows how to generate keys
+    create_key_config = {
+        **handler_config,
+        "key_generation": key_generation,
+        "key_pool_size": key_pool_size,
+    }
+    create_key_config = {key: value for (key, value) in create_key_config.items() if value is not None}
 
     routing_config = {
         "routes": [
             {
                 "path": "",
                 "handler_class": handlers.CreateKey,
-                "handler_config": handler_config,
+                "handler_config": create_key_config,
                 "methods": ["POST"],
             },
             {
@@ -46,6 +57,12 @@ def key_manager(
                 "handler_class": handlers.ListKeys,
                 "handler_config": handler_config,
             },
+            {
+                "path": "migrate",
+                "handler_class": handlers.MigrateKeys,
+                "handler_config": handler_config,
+                "methods": ["POST"],
+            },
             {
                 "path": "{key_id}",
                 "handler_class": handlers.DeleteKey,
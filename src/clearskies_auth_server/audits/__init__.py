@@ -0,0 +1,5 @@
+from .audit_writer import AuditWriter
+
+__all__ = [
+    "AuditWriter",
+]
@@ -0,0 +1,207 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+
+class AuditWriter:
+    """
+    Queues up audit records and writes them in batches, off of the request path.
+
+    Handlers with `buffered_audit` turned on hand their audit records to this instead of writing them
+    immediately.  We put them in a queue and a background thread writes them out whenever `max_batch_size`
+    records are waiting, or `flush_interval` seconds after the first one arrived, whichever comes first.  If the
+    queue fills up (`max_pending` records) then callers wait up to `block_timeout` seconds for room, and after
+    that the record is written right away by the caller instead.  Audit records are never dropped: records that
+    skipped the queue and writes that failed are logged and counted (see `stats()`, which also ends up in the
+    `auth_server_audit_records_total` metric).  Whatever is still queued is written when the process exits (or
+    when you call `close()`).
+
+    Note that the login handlers always write failed logins immediately when the account lockout counts them from
+    the audit table, so delays here don't affect lockouts.
+
+    Model objects aren't safe to share between threads, so each thread that writes batches builds its own audit
+    model from the dependency injection container, rather than using the one from the request that recorded the
+    audit.  The backend still comes from the container though, so with a database backend, make sure that it's
+    safe to use from more than one thread (or leave `buffered_audit` off).  Clearskies models don't have a bulk
+    insert, so a batch is written one record at a time: override `write_batch` if your backend can do better.
+
+    This is built via the dependency injection container (`di.build(AuditWriter, cache=True)`), so there is one
+    per application.  To change the settings, configure your own and bind it to `audit_writer`.
+    """
+
+    max_batch_size = 100
+    flush_interval = 1.0
+    max_pending = 10000
+    block_timeout = 0.1
+
+    _queue = None
+    _condition = None
+    _thread = None
+    _closed = False
+    _counters = None
+    _thread_models = None
+
+    logger = logging.getLogger("clearskies_auth_server.audits")
+
+    def __init__(self):
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._counters = {"flushed": 0, "overflowed": 0, "failed": 0}
+        self._thread_models = threading.local()
+
+    def configure(self, max_batch_size=None, flush_interval=None, max_pending=None, block_timeout=None):
+        if max_batch_size is not None:
+            self.max_batch_size = max_batch_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if block_timeout is not None:
+            self.block_timeout = block_timeout
+        return self
+
+    def record(self, audit_column, model, action, data=None, record_data=None):
+        """
+        Queues up an audit record, exactly as `audit_column.record(model, action, ...)` would have written it.
+
+        Returns False if the queue was full, in which case the record was written right away.
+        """
+        # build the record now, since the model may change before we get around to writing it.
+        audit_data = {
+            "class": audit_column.config("parent_class_name"),
+            "resource_id": model.get(audit_column.config("parent_id_column_name")),
+            "action": action,
+        }
+        if data is not None:
+            audit_data["data"] = data
+        if record_data is not None:
+            audit_data = {**audit_data, **record_data}
+        return self.enqueue(audit_column, audit_data)
+
+    def enqueue(self, audit_column, audit_data):
+        """
+        Queues up the data for a new record in the audit models of the given audit column.
+        """
+        with self._condition:
+            if self._closed:
+                raise ValueError("Cannot record audits after the audit writer has been closed")
+            deadline = time.monotonic() + self.block_timeout
+            is_full = False
+            while len(self._queue) >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    is_full = True
+                    break
+                self._condition.notify_all()
+                self._condition.wait(remaining)
+            if not is_full:
+                self._queue.append((audit_column, audit_data, time.monotonic()))
+            self._start()
+            # the writer sleeps indefinitely while the queue is empty, so it needs a nudge for the first record
+            # (to start the flush timer) and when a batch fills up.
+            if len(self._queue) == 1 or len(self._queue) >= self.max_batch_size:
+                self._condition.notify_all()
+        if not is_full:
+            return True
+
+        # the caller is already in the middle of a request with these models, so they're safe to use here
+        self.logger.warning("The audit queue is full, so an audit record is being written immediately")
+        self._write([(audit_column.child_models, audit_data)], counter="overflowed")
+        return False
+
+    def flush(self):
+        """
+        Writes everything in the queue right now (in the calling thread).
+        """
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            return {**self._counters, "pending": len(self._queue)}
+
+    def write_batch(self, batch):
+        """
+        Writes a batch of audit records: a list of (audit_models, audit_data) tuples.
+
+        The audit models belong to the calling thread, so this can be called from more than one thread at once.
+        """
+        for audit_models, audit_data in batch:
+            audit_models.create(audit_data)
+
+    def _start(self):
+        # the condition must be held when calling this
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._batch_is_due():
+                    timeout = None
+                    if self._queue:
+                        timeout = max(0, self._queue[0][2] + self.flush_interval - time.monotonic())
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+            self._write(self._take_batch())
+
+    def _audit_models(self, audit_column):
+        # each thread gets its own audit models (see the class docstring)
+        if not hasattr(self._thread_models, "models"):
+            self._thread_models.models = {}
+        models_class = audit_column.config("child_models_class")
+        key = (models_class, audit_column.di)
+        if key not in self._thread_models.models:
+            self._thread_models.models[key] = audit_column.di.build(models_class, cache=False)
+        return self._thread_models.models[key]
+
+    def _batch_is_due(self):
+        if not self._queue:
+            return False
+        if len(self._queue) >= self.max_batch_size:
+            return True
+        return time.monotonic() - self._queue[0][2] >= self.flush_interval
+
+    def _take_batch(self):
+        with self._condition:
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                (audit_column, audit_data, queued_at) = self._queue.popleft()
+                batch.append((audit_column, audit_data))
+            # there's room in the queue again
+            self._condition.notify_all()
+            return batch
+
+    def _write(self, batch, counter="flushed"):
+        if not batch:
+            return
+        try:
+            # batches from the queue have audit columns, which we swap for this thread's audit models
+            if counter == "flushed":
+                batch = [(self._audit_models(audit_column), audit_data) for (audit_column, audit_data) in batch]
+            self.write_batch(batch)
+        except Exception:
+            # audits are a best-effort record, so a failing database shouldn't take the writer down with it
+            self.logger.exception(f"Failed to write {len(batch)} audit record(s)")
+            counter = "failed"
+        with self._condition:
+            self._counters[counter] += len(batch)
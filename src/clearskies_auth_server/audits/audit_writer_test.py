@@ -0,0 +1,119 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+from .audit_writer import AuditWriter
+
+
+class AuditWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.audit_models = SimpleNamespace(create=MagicMock())
+        self.audit_column = self.make_audit_column(self.audit_models)
+        self.audit_writer = AuditWriter()
+
+    def tearDown(self):
+        self.audit_writer.close()
+
+    def make_audit_column(self, audit_models):
+        # the request has its own audit models, and the writer builds more (one per thread) with the same class
+        return SimpleNamespace(
+            config=lambda name: {
+                "parent_class_name": "User",
+                "parent_id_column_name": "id",
+                "child_models_class": SimpleNamespace,
+            }[name],
+            child_models=SimpleNamespace(create=MagicMock()),
+            di=MagicMock(build=MagicMock(return_value=audit_models)),
+        )
+
+    def wait_for(self, check):
+        deadline = time.monotonic() + 5
+        while not check() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_record(self):
+        user = {"id": "5"}
+        self.audit_writer.record(
+            self.audit_column, user, "login", data={"why": "because"}, record_data={"email": "a@b.c"}
+        )
+        self.audit_writer.flush()
+        self.audit_models.create.assert_called_once_with(
+            {"class": "User", "resource_id": "5", "action": "login", "data": {"why": "because"}, "email": "a@b.c"}
+        )
+
+    def test_models_per_thread(self):
+        self.audit_writer.configure(flush_interval=0)
+        self.audit_writer.enqueue(self.audit_column, {"i": 0})
+        self.wait_for(lambda: self.audit_writer.stats()["flushed"] == 1)
+        # and now one from this thread
+        self.audit_writer.configure(flush_interval=60)
+        self.audit_writer.enqueue(self.audit_column, {"i": 1})
+        self.audit_writer.flush()
+
+        # the request's models are never used, and each thread builds its own once
+        self.audit_column.child_models.create.assert_not_called()
+        self.assertEqual(2, self.audit_models.create.call_count)
+        self.assertEqual(2, self.audit_column.di.build.call_count)
+        self.audit_column.di.build.assert_called_with(SimpleNamespace, cache=False)
+
+    def test_flush_on_size(self):
+        self.audit_writer.configure(max_batch_size=3, flush_interval=60)
+        for i in range(2):
+            self.audit_writer.enqueue(self.audit_column, {"i": i})
+        time.sleep(0.05)
+        self.assertEqual({"flushed": 0, "overflowed": 0, "failed": 0, "pending": 2}, self.audit_writer.stats())
+
+        self.audit_writer.enqueue(self.audit_column, {"i": 2})
+        self.wait_for(lambda: self.audit_writer.stats()["flushed"] == 3)
+        self.assertEqual({"flushed": 3, "overflowed": 0, "failed": 0, "pending": 0}, self.audit_writer.stats())
+        self.assertEqual(
+            [{"i": 0}, {"i": 1}, {"i": 2}], [call.args[0] for call in self.audit_models.create.call_args_list]
+        )
+
+    def test_flush_on_time(self):
+        self.audit_writer.configure(max_batch_size=100, flush_interval=0.05)
+        self.audit_writer.enqueue(self.audit_column, {"i": 0})
+        self.wait_for(lambda: self.audit_writer.stats()["flushed"] == 1)
+        self.assertEqual(1, self.audit_writer.stats()["flushed"])
+
+    def test_backpressure(self):
+        writing = threading.Event()
+        finish_writing = threading.Event()
+
+        def slow_create(audit_data):
+            writing.set()
+            finish_writing.wait()
+
+        audit_column = self.make_audit_column(SimpleNamespace(create=slow_create))
+        self.audit_writer.configure(max_batch_size=1, flush_interval=0, max_pending=2, block_timeout=0.01)
+        self.audit_writer.enqueue(audit_column, {"i": 0})
+        writing.wait(5)
+        self.assertTrue(self.audit_writer.enqueue(audit_column, {"i": 1}))
+        self.assertTrue(self.audit_writer.enqueue(audit_column, {"i": 2}))
+
+        # with the queue full, the record is written by the caller, with the caller's models
+        with self.assertLogs("clearskies_auth_server.audits", level="WARNING"):
+            self.assertFalse(self.audit_writer.enqueue(audit_column, {"i": 3}))
+        audit_column.child_models.create.assert_called_once_with({"i": 3})
+        self.assertEqual({"flushed": 0, "overflowed": 1, "failed": 0, "pending": 2}, self.audit_writer.stats())
+
+        finish_writing.set()
+        self.audit_writer.close()
+        self.assertEqual({"flushed": 3, "overflowed": 1, "failed": 0, "pending": 0}, self.audit_writer.stats())
+
+    def test_close_flushes(self):
+        self.audit_writer.configure(flush_interval=60)
+        for i in range(5):
+            self.audit_writer.enqueue(self.audit_column, {"i": i})
+        self.audit_writer.close()
+        self.assertEqual(5, self.audit_models.create.call_count)
+        with self.assertRaises(ValueError):
+            self.audit_writer.enqueue(self.audit_column, {"i": 5})
+
+    def test_failed_writes_are_counted(self):
+        self.audit_models.create.side_effect = ConnectionError("database is down")
+        self.audit_writer.enqueue(self.audit_column, {"i": 0})
+        with self.assertLogs("clearskies_auth_server.audits", level="ERROR"):
+            self.audit_writer.flush()
+        self.assertEqual({"flushed": 0, "overflowed": 0, "failed": 1, "pending": 0}, self.audit_writer.stats())
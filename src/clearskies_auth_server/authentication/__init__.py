@@ -1,5 +1,6 @@
 from clearskies import BindingConfig
 from .jwks_direct import JwksDirect
+from .verified_token_cache import VerifiedTokenCache
 
 
 def jwks_direct(path_to_public_keys, **kwargs):
@@ -9,4 +10,5 @@ def jwks_direct(path_to_public_keys, **kwargs):
 __all__ = [
     "JwksDirect",
     "jwks_direct",
+    "VerifiedTokenCache",
 ]
@@ -1,18 +1,34 @@
 import clearskies
+from clearskies.handlers.exceptions import ClientError
 import datetime
+import hashlib
 import json
+import threading
+from collections import OrderedDict
+from jwcrypto import jwk, jws
+from ..keys import KeyStore, jws_algorithm, public_jwk
+from ..metrics import MetricsRegistry, auth_server_metrics
+from .verified_token_cache import VerifiedTokenCache
 
 
 class JwksDirect(clearskies.authentication.JWKS):
     _path_to_public_keys = None
+    _key_store = None
+    _unknown_kid_refresh_interval = None
+    _verified_token_cache_size = None
+    _verified_token_cache_max_age = None
 
-    def __init__(self, environment, secrets, jose_jwt):
+    # how many bogus key ids we remember (per key set) before we start forgetting the oldest ones
+    max_unknown_kids = 1000
+
+    def __init__(self, environment, secrets, jose_jwt, di):
         # our base requires the requests library but we're going to replace all usages of it,
         # so we're going to inject in some gibberish instead, which will cause things to crash
         # if the base tries to use the requests library (which is actually good, because it
         # shouldn't, so we want any attempted usage to just fail).
         super().__init__(environment, "not-requests", jose_jwt)
         self._secrets = secrets
+        self._di = di
 
     def configure(
         self,
@@ -22,6 +38,10 @@ class JwksDirect(clearskies.authentication.JWKS):
         issuer=None,
         documentation_security_name=None,
         jwks_cache_time=86400,
+        key_refresh_mode="synchronous",
+        unknown_kid_refresh_interval=60,
+        verified_token_cache_size=0,
+        verified_token_cache_max_age=300,
     ):
         self._path_to_public_keys = path_to_public_keys
         self._audience = audience
@@ -29,26 +49,187 @@ class JwksDirect(clearskies.authentication.JWKS):
         self._jwks_cache_time = jwks_cache_time
         if not self._path_to_public_keys:
             raise ValueError("Must provide 'path_to_public_keys' when using JWKS authentication")
-        self._algorithms = ["RS256"] if algorithms is None else algorithms
+        if key_refresh_mode not in ["synchronous", "background"]:
+            raise ValueError(
+                f"'key_refresh_mode' must be either 'synchronous' or 'background', but instead it is '{key_refresh_mode}'"
+            )
+        self._background_refresh = key_refresh_mode == "background"
+        self._unknown_kid_refresh_interval = unknown_kid_refresh_interval
+        # the verified token cache is off unless you give it a size
+        self._verified_token_cache_size = verified_token_cache_size
+        self._verified_token_cache_max_age = verified_token_cache_max_age
+        # if the algorithms aren't specified then we accept whichever algorithm matches the key that signed the JWT.
+        # This way the key set can contain (for instance) both RSA and EdDSA keys while migrating between the two.
+        self._algorithms = algorithms
         self._documentation_security_name = documentation_security_name
 
+    def validate_jwt(self, raw_jwt):
+        verified_tokens = self._get_verified_tokens()
+        if not verified_tokens:
+            self.jwt_claims = self._verify_jwt(raw_jwt)
+            return True
+
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        cache_key = self._verified_token_cache_key(raw_jwt)
+        jwt_claims = verified_tokens.get(cache_key, now)
+        if jwt_claims is None:
+            jwt_claims = self._verify_jwt(raw_jwt)
+            verified_tokens.set(cache_key, jwt_claims, now)
+        # everyone who gets the token gets their own copy of the claims
+        self.jwt_claims = {**jwt_claims}
+        return True
+
+    def verified_token_cache_stats(self):
+        verified_tokens = self._get_verified_tokens()
+        return verified_tokens.stats() if verified_tokens else None
+
+    def _verify_jwt(self, raw_jwt):
+        try:
+            unverified_header = self._jose_jwt.get_unverified_header(raw_jwt)
+        except self._jose_jwt.JWTError as e:
+            raise ClientError(str(e))
+        verification_key = self._get_verification_key(unverified_header.get("kid"))
+        if not verification_key:
+            raise ClientError("No matching keys found")
+
+        # python-jose doesn't support EdDSA, so we verify the signature with jwcrypto (for all key types, so that
+        # there's just one code path) and then check the standard claims ourselves.
+        try:
+            algorithm = verification_key["algorithm"]
+            if self._algorithms is not None and algorithm not in self._algorithms:
+                raise ValueError(f"Algorithm '{algorithm}' is not allowed")
+            if unverified_header.get("alg") != algorithm:
+                raise ValueError("The algorithm in the JWT header does not match the key")
+            token = jws.JWS()
+            token.deserialize(raw_jwt)
+            token.verify(verification_key["key"], alg=algorithm)
+            jwt_claims = json.loads(token.payload)
+            if not isinstance(jwt_claims, dict):
+                raise ValueError("The JWT claims are not a JSON object")
+        except Exception:
+            raise ClientError("Unable to parse JWT")
+
+        return self._validate_claims(jwt_claims)
+
+    def _validate_claims(self, jwt_claims):
+        """
+        Checks the registered claims in the same way that python-jose does (with no leeway).
+        """
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        try:
+            for claim_name in ["exp", "nbf", "iat"]:
+                if claim_name in jwt_claims:
+                    int(jwt_claims[claim_name])
+        except (TypeError, ValueError):
+            raise ClientError("JWT has incorrect claims: double check the audience and issuer")
+        if "exp" in jwt_claims and int(jwt_claims["exp"]) < now:
+            raise ClientError("JWT is expired")
+        if "nbf" in jwt_claims and int(jwt_claims["nbf"]) > now:
+            raise ClientError("JWT has incorrect claims: double check the audience and issuer")
+        if "aud" in jwt_claims:
+            audiences = jwt_claims["aud"]
+            if isinstance(audiences, str):
+                audiences = [audiences]
+            if not isinstance(audiences, list) or self._audience not in audiences:
+                raise ClientError("JWT has incorrect claims: double check the audience and issuer")
+        if self._issuer is not None and jwt_claims.get("iss") != self._issuer:
+            raise ClientError("JWT has incorrect claims: double check the audience and issuer")
+        return jwt_claims
+
+    @property
+    def key_store(self):
+        # the same key store that the auth server handlers use, so if they live in the same application
+        # then the keys are only fetched (and parsed) once.
+        if self._key_store is None:
+            self._key_store = self._di.build(KeyStore, cache=True)
+            metrics_registry = self._di.build(MetricsRegistry, cache=True)
+            auth_server_metrics.watch_key_store(metrics_registry, self._key_store)
+        return self._key_store
+
+    def _get_verification_key(self, key_id):
+        """
+        Returns the parsed public key (and its algorithm) for the given key id, or None if there is no such key.
+
+        If we don't recognize the key id then it may be a key that was created since we last loaded the key set,
+        so we reload the keys, but at most once every `unknown_kid_refresh_interval` seconds (the key store makes
+        sure concurrent requests share one reload).  Key ids that still aren't in the key set after a reload are
+        remembered as bogus until the key set changes, so a flood of garbage tokens can't keep us busy.
+        """
+        if not isinstance(key_id, str):
+            return None
+        key_set = self._get_verification_keys()
+        if key_id in key_set["keys"]:
+            return key_set["keys"][key_id]
+        if key_id in key_set["unknown_kids"]:
+            return None
+
+        # if we're not allowed to reload the keys right now then we don't remember the key id as bogus, since we
+        # haven't actually looked for it.
+        if not self.key_store.refresh(self._path_to_public_keys, self._unknown_kid_refresh_interval):
+            return None
+        key_set = self._get_verification_keys()
+        if key_id in key_set["keys"]:
+            return key_set["keys"][key_id]
+        with key_set["lock"]:
+            unknown_kids = key_set["unknown_kids"]
+            unknown_kids[key_id] = True
+            while len(unknown_kids) > self.max_unknown_kids:
+                unknown_kids.popitem(last=False)
+        return None
+
+    def _get_verification_keys(self):
+        return self.key_store.get_derived(
+            self._path_to_public_keys,
+            "verification_keys",
+            self._build_verification_keys,
+            self._jwks_cache_time,
+            background=self._background_refresh,
+        )
+
+    def _build_verification_keys(self, key_data):
+        keys = {}
+        for key in key_data.values():
+            public_key = public_jwk(key)
+            keys[public_key["kid"]] = {"key": jwk.JWK(**public_key), "algorithm": jws_algorithm(public_key)}
+        return {"keys": keys, "unknown_kids": OrderedDict(), "lock": threading.Lock()}
+
+    def _get_verified_tokens(self):
+        """
+        Returns the cache of verified tokens, or None if it's disabled.
+
+        The cache is stored with the key set, so it's thrown away (and we start verifying everything from scratch)
+        whenever the key set changes.
+        """
+        if not self._verified_token_cache_size:
+            return None
+        size = self._verified_token_cache_size
+        max_age = self._verified_token_cache_max_age
+        return self.key_store.get_derived(
+            self._path_to_public_keys,
+            f"verified_tokens_{size}_{max_age}",
+            lambda key_data: VerifiedTokenCache(size, max_age),
+            self._jwks_cache_time,
+            background=self._background_refresh,
+        )
+
+    def _verified_token_cache_key(self, raw_jwt):
+        # the same token can get a different answer depending on what we're checking for, so that's part of the key
+        if isinstance(raw_jwt, str):
+            raw_jwt = raw_jwt.encode("utf-8")
+        settings = json.dumps([self._audience, self._issuer, self._algorithms]).encode("utf-8")
+        return hashlib.sha256(settings + b"\0" + raw_jwt).hexdigest()
+
     def _get_jwks(self):
-        now = datetime.datetime.now()
-        if self._jwks is None or ((now - self._jwks_fetched).total_seconds() > self._jwks_cache_time):
-            key_data = json.loads(self._secrets.get(self._path_to_public_keys))
-            self._jwks = {
-                "keys": [
-                    {
-                        "kid": key["kid"],
-                        "use": key["use"],
-                        "e": key["e"],
-                        "n": key["n"],
-                        "kty": key["kty"],
-                        "alg": key["alg"],
-                    }
-                    for key in key_data.values()
-                ]
-            }
-            self._jwks_fetched = now
-
-        return self._jwks
+        return self.key_store.get_derived(
+            self._path_to_public_keys,
+            "jwks",
+            lambda key_data: {"keys": [public_jwk(key) for key in key_data.values()]},
+            self._jwks_cache_time,
+            background=self._background_refresh,
+        )
+
+    def key_set_age(self):
+        """
+        Returns how long ago (in seconds) the public keys were last loaded from the secret manager.
+        """
+        return self.key_store.get_age(self._path_to_public_keys)
@@ -0,0 +1,189 @@
+import datetime
+import json
+import clearskies
+import unittest
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+from jose import jwt as jose_jwt
+from jwcrypto import jwk, jwt
+from clearskies.handlers.exceptions import ClientError
+from .jwks_direct import JwksDirect
+
+
+class JwksDirectTest(unittest.TestCase):
+    def setUp(self):
+        self.rsa_key = jwk.JWK.generate(kty="RSA", size=2048, kid="rsa_key", alg="RSA256", use="sig")
+        self.ed25519_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="ed25519_key", alg="EdDSA", use="sig")
+        self.public_keys = {
+            "rsa_key": {**json.loads(self.rsa_key.export_public()), "issue_date": "1"},
+            "ed25519_key": {**json.loads(self.ed25519_key.export_public()), "issue_date": "2"},
+        }
+        self.secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(self.public_keys)))
+        di = clearskies.di.StandardDependencies(bindings={"secrets": self.secrets})
+        self.jwks_direct = JwksDirect("environment", self.secrets, jose_jwt, di)
+        self.jwks_direct.configure(
+            path_to_public_keys="/path/to/public",
+            audience="example.com",
+            issuer="https://example.com",
+        )
+
+    def make_jwt(self, key, algorithm, **claims):
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        token = jwt.JWT(
+            header={"alg": algorithm, "typ": "JWT", "kid": key["kid"]},
+            claims={"aud": "example.com", "iss": "https://example.com", "exp": now + 60, "iat": now, **claims},
+        )
+        token.make_signed_token(key)
+        return token.serialize()
+
+    def test_mixed_key_set(self):
+        self.assertTrue(self.jwks_direct.validate_jwt(self.make_jwt(self.rsa_key, "RS256", email="a@example.com")))
+        self.assertEqual("a@example.com", self.jwks_direct.jwt_claims["email"])
+        self.assertTrue(self.jwks_direct.validate_jwt(self.make_jwt(self.ed25519_key, "EdDSA", email="b@example.com")))
+        self.assertEqual("b@example.com", self.jwks_direct.jwt_claims["email"])
+
+    def test_publishes_public_keys(self):
+        keys = {key["kid"]: key for key in self.jwks_direct._get_jwks()["keys"]}
+        self.assertEqual(["crv", "x"], sorted(set(keys["ed25519_key"].keys()) - {"kid", "use", "kty", "alg"}))
+        self.assertEqual(["e", "n"], sorted(set(keys["rsa_key"].keys()) - {"kid", "use", "kty", "alg"}))
+
+    def test_restricted_algorithms(self):
+        self.jwks_direct.configure(path_to_public_keys="/path/to/public", algorithms=["RS256"])
+        with self.assertRaises(ClientError) as context:
+            self.jwks_direct.validate_jwt(self.make_jwt(self.ed25519_key, "EdDSA"))
+        self.assertEqual("Unable to parse JWT", str(context.exception))
+
+    def test_wrong_key(self):
+        other_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="ed25519_key", alg="EdDSA", use="sig")
+        with self.assertRaises(ClientError) as context:
+            self.jwks_direct.validate_jwt(self.make_jwt(other_key, "EdDSA"))
+        self.assertEqual("Unable to parse JWT", str(context.exception))
+
+    def test_unknown_key(self):
+        other_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="who_knows", alg="EdDSA", use="sig")
+        with self.assertRaises(ClientError) as context:
+            self.jwks_direct.validate_jwt(self.make_jwt(other_key, "EdDSA"))
+        self.assertEqual("No matching keys found", str(context.exception))
+
+    def test_expired(self):
+        with self.assertRaises(ClientError) as context:
+            self.jwks_direct.validate_jwt(self.make_jwt(self.ed25519_key, "EdDSA", exp=1))
+        self.assertEqual("JWT is expired", str(context.exception))
+
+    def test_wrong_audience(self):
+        with self.assertRaises(ClientError) as context:
+            self.jwks_direct.validate_jwt(self.make_jwt(self.rsa_key, "RS256", aud="somewhere-else.com"))
+        self.assertEqual("JWT has incorrect claims: double check the audience and issuer", str(context.exception))
+
+    def build_with_clock(self):
+        self.now = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        clock = SimpleNamespace(datetime=SimpleNamespace(now=lambda: self.now), timedelta=datetime.timedelta)
+        di = clearskies.di.StandardDependencies(bindings={"secrets": self.secrets, "datetime": clock})
+        jwks_direct = JwksDirect("environment", self.secrets, jose_jwt, di)
+        jwks_direct.configure(path_to_public_keys="/path/to/public", audience="example.com")
+        return jwks_direct
+
+    def tick(self, seconds):
+        self.now = self.now + datetime.timedelta(seconds=seconds)
+
+    def test_keys_are_parsed_once(self):
+        self.jwks_direct.validate_jwt(self.make_jwt(self.rsa_key, "RS256"))
+        key = self.jwks_direct._get_verification_key("rsa_key")
+        self.jwks_direct.validate_jwt(self.make_jwt(self.rsa_key, "RS256"))
+        self.assertIs(key, self.jwks_direct._get_verification_key("rsa_key"))
+        self.assertEqual("RS256", key["algorithm"])
+        self.assertEqual(1, self.secrets.get.call_count)
+
+    def test_unknown_kid_refreshes_keys(self):
+        jwks_direct = self.build_with_clock()
+        jwks_direct.validate_jwt(self.make_jwt(self.rsa_key, "RS256"))
+
+        new_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="new_key", alg="EdDSA", use="sig")
+        self.secrets.get.return_value = json.dumps(
+            {**self.public_keys, "new_key": {**json.loads(new_key.export_public()), "issue_date": "3"}}
+        )
+        self.tick(61)
+        self.assertTrue(jwks_direct.validate_jwt(self.make_jwt(new_key, "EdDSA")))
+        self.assertEqual(2, self.secrets.get.call_count)
+
+    def test_unknown_kid_refreshes_are_limited(self):
+        jwks_direct = self.build_with_clock()
+        bogus_keys = [
+            jwk.JWK.generate(kty="OKP", crv="Ed25519", kid=f"bogus_{i}", alg="EdDSA", use="sig") for i in range(3)
+        ]
+
+        # the keys were just loaded, so there's no point in reloading them
+        jwks_direct.validate_jwt(self.make_jwt(self.rsa_key, "RS256"))
+        with self.assertRaises(ClientError):
+            jwks_direct.validate_jwt(self.make_jwt(bogus_keys[0], "EdDSA"))
+        self.assertEqual(1, self.secrets.get.call_count)
+
+        # now we'll look, but only once
+        self.tick(61)
+        with self.assertRaises(ClientError):
+            jwks_direct.validate_jwt(self.make_jwt(bogus_keys[1], "EdDSA"))
+        with self.assertRaises(ClientError):
+            jwks_direct.validate_jwt(self.make_jwt(bogus_keys[2], "EdDSA"))
+        self.assertEqual(2, self.secrets.get.call_count)
+
+        # the first key id was never actually looked for, so it still gets a reload
+        self.tick(61)
+        with self.assertRaises(ClientError):
+            jwks_direct.validate_jwt(self.make_jwt(bogus_keys[0], "EdDSA"))
+        self.assertEqual(3, self.secrets.get.call_count)
+
+        # and once we've looked for a key id and not found it, we stop looking
+        self.tick(61)
+        with self.assertRaises(ClientError) as context:
+            jwks_direct.validate_jwt(self.make_jwt(bogus_keys[1], "EdDSA"))
+        self.assertEqual("No matching keys found", str(context.exception))
+        self.assertEqual(3, self.secrets.get.call_count)
+
+    def test_verified_token_cache(self):
+        self.jwks_direct.configure(
+            path_to_public_keys="/path/to/public",
+            audience="example.com",
+            jwks_cache_time=0,
+            verified_token_cache_size=10,
+        )
+        token = self.make_jwt(self.rsa_key, "RS256", email="a@example.com")
+        self.jwks_direct.validate_jwt(token)
+        claims = self.jwks_direct.jwt_claims
+        self.jwks_direct.validate_jwt(token)
+        self.assertEqual(claims, self.jwks_direct.jwt_claims)
+        self.assertIsNot(claims, self.jwks_direct.jwt_claims)
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "evictions": 0, "size": 1, "hit_rate": 0.5},
+            self.jwks_direct.verified_token_cache_stats(),
+        )
+
+        # failures are never cached
+        expired_token = self.make_jwt(self.rsa_key, "RS256", exp=1)
+        for i in range(2):
+            with self.assertRaises(ClientError):
+                self.jwks_direct.validate_jwt(expired_token)
+
+        # the answer depends on the audience, so the cache does too
+        self.jwks_direct.configure(
+            path_to_public_keys="/path/to/public",
+            audience="somewhere-else.com",
+            jwks_cache_time=0,
+            verified_token_cache_size=10,
+        )
+        with self.assertRaises(ClientError):
+            self.jwks_direct.validate_jwt(token)
+
+    def test_verified_token_cache_dropped_with_key_set(self):
+        self.jwks_direct.configure(
+            path_to_public_keys="/path/to/public",
+            audience="example.com",
+            jwks_cache_time=0,
+            verified_token_cache_size=10,
+        )
+        token = self.make_jwt(self.ed25519_key, "EdDSA")
+        self.jwks_direct.validate_jwt(token)
+
+        self.secrets.get.return_value = json.dumps({"rsa_key": self.public_keys["rsa_key"]})
+        with self.assertRaises(ClientError) as context:
+            self.jwks_direct.validate_jwt(token)
+        self.assertEqual("No matching keys found", str(context.exception))
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    """
+    A bounded LRU of tokens that have already passed a full verification, mapped to their claims.
+
+    JwksDirect keeps one of these per key set (in the key store), so it's thrown away whenever the key set
+    changes.  Entries are keyed by a digest of the token (plus whatever else the verification depended on),
+    and are only good until the token expires or `max_age` seconds after they were stored, whichever comes
+    first.
+    """
+
+    _max_size = None
+    _max_age = None
+    _entries = None
+    _lock = None
+    _counters = None
+
+    def __init__(self, max_size, max_age):
+        self._max_size = max_size
+        self._max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, cache_key, now):
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if now > entry["expires_at"]:
+                del self._entries[cache_key]
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self._counters["hits"] += 1
+            return entry["claims"]
+
+    def set(self, cache_key, claims, now):
+        expires_at = now + self._max_age
+        # the claims have already been validated, so if exp is present, it's an integer.
+        if "exp" in claims:
+            expires_at = min(expires_at, int(claims["exp"]))
+        with self._lock:
+            self._entries[cache_key] = {"claims": claims, "expires_at": expires_at}
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "size": len(self._entries),
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,28 @@
+import unittest
+from .verified_token_cache import VerifiedTokenCache
+
+
+class VerifiedTokenCacheTest(unittest.TestCase):
+    def test_expiration(self):
+        cache = VerifiedTokenCache(10, 300)
+        cache.set("short", {"exp": 1010}, 1000)
+        cache.set("long", {"exp": 5000}, 1000)
+        cache.set("forever", {}, 1000)
+
+        self.assertEqual({"exp": 1010}, cache.get("short", 1010))
+        self.assertEqual(None, cache.get("short", 1011))
+        self.assertEqual({"exp": 5000}, cache.get("long", 1300))
+        self.assertEqual(None, cache.get("long", 1301))
+        self.assertEqual(None, cache.get("forever", 1301))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = VerifiedTokenCache(2, 300)
+        cache.set("a", {"sub": "a"}, 1000)
+        cache.set("b", {"sub": "b"}, 1000)
+        cache.get("a", 1000)
+        cache.set("c", {"sub": "c"}, 1000)
+
+        self.assertEqual(None, cache.get("b", 1000))
+        self.assertEqual({"sub": "a"}, cache.get("a", 1000))
+        self.assertEqual({"sub": "c"}, cache.get("c", 1000))
+        self.assertEqual({"hits": 3, "misses": 1, "evictions": 1, "size": 2, "hit_rate": 0.75}, cache.stats())
@@ -1,5 +1,5 @@
 from clearskies.column_types import build_column_config
-from .password import Password
+from .password import HashedPassword, Password
 from .tenant_id import TenantId
 
 
@@ -12,6 +12,7 @@ def tenant_id(name, **kwargs):
 
 
 __all__ = [
+    "HashedPassword",
     "password",
     "Password",
     "tenant_id",
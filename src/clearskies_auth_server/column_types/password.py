@@ -1,10 +1,27 @@
+import time
 from clearskies.column_types import String
 from clearskies.input_requirements import required
 from passlib.context import CryptContext
+from ..hashing import HashingExecutor, RehashQueue, check_verify_latency
+from ..metrics import MetricsRegistry, auth_server_metrics
+
+
+class HashedPassword(str):
+    """
+    A password that has already been hashed, so the password column saves it as-is.
+
+    `user.save({"password": HashedPassword(hashed_password)})` stores the hash without hashing it again, which is
+    what you need to upgrade a hash or to import users from another system.
+    """
+
+    pass
 
 
 class Password(String):
     _crypt_context = None
+    _hashing_executor = None
+    _rehash_queue = None
+    _password_hash_seconds = None
 
     my_configs = [
         "crypt_context",
@@ -13,6 +30,10 @@ class Password(String):
         "require_repeat_password",
         "repeat_password_column_name",
         "for_login",
+        "use_hashing_executor",
+        "verify_latency_budget",
+        "verify_latency_concurrency",
+        "rehash_mode",
     ]
 
     crypt_config_names = [
@@ -40,6 +61,12 @@ class Password(String):
                 + "you can only provide one of 'crypt_context', 'crypt_context_string', and 'crypt_context_path', "
                 + "but more than one was found"
             )
+        rehash_mode = configuration.get("rehash_mode", "synchronous")
+        if rehash_mode not in ["synchronous", "deferred"]:
+            raise ValueError(
+                f"Error for column '{self.name}' in model '{self.model_class.__name__}': "
+                + f"rehash_mode should be either 'synchronous' or 'deferred', but instead it is '{rehash_mode}'"
+            )
         repeat_password_column_name = configuration.get("repeat_password_column_name", "repeat_password")
         if not isinstance(repeat_password_column_name, str):
             raise ValueError(
@@ -54,6 +81,10 @@ class Password(String):
                 "require_repeat_password": True,
                 "repeat_password_column_name": "repeat_password",
                 "for_login": False,
+                "use_hashing_executor": False,
+                "verify_latency_budget": None,
+                "verify_latency_concurrency": 1,
+                "rehash_mode": "synchronous",
                 **configuration,
             }
         )
@@ -92,8 +123,10 @@ class Password(String):
         # if the password is being set to a non-value, then unset it
         if self.name in data and not data[self.name]:
             del data[self.name]
+        elif isinstance(data.get(self.name), HashedPassword):
+            data[self.name] = str(data[self.name])
         elif data.get(self.name):
-            data[self.name] = self._crypt_context.hash(data[self.name])
+            data[self.name] = self.hash(data[self.name])
         if self.config("require_repeat_password") and not self.config("for_login") and "repeat_password" in data:
             del data["repeat_password"]
         return data
@@ -103,17 +136,101 @@ class Password(String):
         if not hashed_password:
             return False
 
-        if not self._crypt_context.verify(password, hashed_password):
+        # if the hash needs an upgrade then we can do it now, since this is the only time we have the password.
+        # passlib hands back the new hash along with the verification, so it doesn't cost an extra hash.
+        if self.config("rehash_mode") == "synchronous":
+            (is_valid, new_hashed_password) = self.verify_and_update(password, hashed_password)
+            if is_valid and new_hashed_password:
+                self.save_hashed_password(user, new_hashed_password)
+            return is_valid
+
+        # otherwise the new hash is calculated in the background, so this login doesn't pay for it.  The write
+        # happens here though, in the request, since the backend may not be safe to share with another thread.
+        rehash_queue = self.rehash_queue
+        rehash_queue.write_completed(self, user)
+        if not self.verify(password, hashed_password):
             return False
-
-        # yes, I understand that the crypt context has a `verify_and_update` flow for this, but
-        # re-organizing the code to support that isn't worth the relatively minor efficiency gains.
-        # The save process will automatically hash the password, so there isn't a flow to pass in
-        # an already-hashed password.
         if self._crypt_context.needs_update(hashed_password):
-            user.save({self.name: password})
+            rehash_queue.submit(self, user, password, hashed_password)
+        return True
+
+    def rehash(self, users, user_id, hashed_password, new_hashed_password):
+        """
+        Upgrades the stored hash for the user, unless it has changed since we verified the password against it.
+
+        This is called by the rehash queue, with a model from the current request to save through.  Returns True if
+        the hash was upgraded.
+        """
+        current_user = users.blank().find(f"{users.id_column_name}={user_id}")
+        if not current_user.exists or current_user.get(self.name) != hashed_password:
+            return False
+        self.save_hashed_password(current_user, new_hashed_password)
         return True
 
+    def save_hashed_password(self, user, hashed_password):
+        """
+        Saves an already-hashed password for the user (see HashedPassword).
+        """
+        user.save({self.name: HashedPassword(hashed_password)})
+
+    def check_verify_latency(self):
+        """
+        Measures how long verifying a password takes, and warns if it's over the `verify_latency_budget`.
+
+        This takes a few password hashes, so it isn't done when the column is configured: call it at startup (or
+        see `clearskies_auth_server.hashing.check_model_verify_latency`).  It only measures once per process (per
+        crypt context).  Returns the measurement, or None if the column doesn't have a budget.
+        """
+        if not self.config("verify_latency_budget"):
+            return None
+        return check_verify_latency(
+            self._crypt_context,
+            self.config("verify_latency_budget"),
+            concurrency=self.config("verify_latency_concurrency"),
+        )
+
+    @property
+    def crypt_context(self):
+        return self._crypt_context
+
+    @property
+    def hashing_executor(self):
+        if self._hashing_executor is None:
+            self._hashing_executor = self.di.build(HashingExecutor, cache=True)
+        return self._hashing_executor
+
+    @property
+    def rehash_queue(self):
+        if self._rehash_queue is None:
+            self._rehash_queue = self.di.build(RehashQueue, cache=True)
+        return self._rehash_queue
+
+    @property
+    def password_hash_seconds(self):
+        if self._password_hash_seconds is None:
+            metrics_registry = self.di.build(MetricsRegistry, cache=True)
+            self._password_hash_seconds = auth_server_metrics.password_hash_seconds(metrics_registry)
+        return self._password_hash_seconds
+
+    def hash(self, password):
+        return self._hash_operation("hash", password)
+
+    def verify(self, password, hashed_password):
+        return self._hash_operation("verify", password, hashed_password)
+
+    def verify_and_update(self, password, hashed_password):
+        return self._hash_operation("verify_and_update", password, hashed_password)
+
+    def _hash_operation(self, operation, *args):
+        # with the hashing executor, the time spent waiting for a turn counts too, since the request waits for it
+        start = time.perf_counter()
+        if self.config("use_hashing_executor"):
+            result = getattr(self.hashing_executor, operation)(self._crypt_context, *args)
+        else:
+            result = getattr(self._crypt_context, operation)(*args)
+        self.password_hash_seconds.observe(time.perf_counter() - start, labels=(operation,))
+        return result
+
     def additional_write_columns(self, is_create=False):
         if self.config("for_login"):
             return {}
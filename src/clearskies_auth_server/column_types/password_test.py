@@ -1,6 +1,8 @@
 import unittest
-from unittest.mock import MagicMock
-from .password import Password
+import clearskies
+from unittest.mock import MagicMock, patch
+from .password import HashedPassword, Password
+from ..metrics import MetricsRegistry
 import datetime
 from passlib.context import CryptContext
 
@@ -14,29 +16,46 @@ class PasswordTest(unittest.TestCase):
 
         self.user = MagicMock()
         self.user.exists = False
+        self.di = clearskies.di.StandardDependencies()
 
     def test_pre_save_defaults(self):
-        password = Password("di")
+        password = Password(self.di)
         password.configure("password", {}, self.user)
         data = password.pre_save({"password": "notastrongpassword"}, self.user)
         self.assertTrue(self.default_crypt_context.verify("notastrongpassword", data["password"]))
 
     def test_pre_save_nothing(self):
-        password = Password("di")
+        password = Password(self.di)
         password.configure("password", {}, self.user)
         data = password.pre_save({"password": ""}, self.user)
         self.assertTrue("password" not in data)
 
+    def test_pre_save_hashed(self):
+        password = Password(self.di)
+        password.configure("password", {}, self.user)
+        hashed = self.default_crypt_context.hash("notastrongpassword")
+        data = password.pre_save({"password": HashedPassword(hashed)}, self.user)
+        self.assertEqual(hashed, data["password"])
+        self.assertIs(str, type(data["password"]))
+
     def test_validate(self):
-        password = Password("di")
+        password = Password(self.di)
         password.configure("password", {}, self.user)
         hashed = self.default_crypt_context.hash("notastrongpassword")
 
         self.user.get = MagicMock(return_value=hashed)
         self.assertTrue(password.validate_password(self.user, "notastrongpassword"))
 
+        # the time it took ends up in the metrics
+        metrics_registry = self.di.build(MetricsRegistry, cache=True)
+        [bucket_counts, total] = metrics_registry.histogram("auth_server_password_hash_seconds", "").value(
+            ("verify_and_update",)
+        )
+        self.assertEqual(1, sum(bucket_counts))
+        self.assertGreater(total, 0)
+
     def test_validate_and_upgrade(self):
-        password = Password("di")
+        password = Password(self.di)
         password.configure(
             "password",
             {
@@ -53,4 +72,85 @@ class PasswordTest(unittest.TestCase):
         self.user.get = MagicMock(return_value=hashed)
         self.user.save = MagicMock()
         self.assertTrue(password.validate_password(self.user, "notastrongpassword"))
-        self.user.save.assert_called_with({"password": "notastrongpassword"})
+
+        # the new hash comes straight from the verification, and is saved without being hashed again
+        self.user.save.assert_called_once()
+        new_hash = self.user.save.call_args.args[0]["password"]
+        self.assertIsInstance(new_hash, HashedPassword)
+        self.assertTrue(new_hash.startswith("$argon2"))
+        self.assertTrue(self.default_crypt_context.verify("notastrongpassword", new_hash))
+
+    def test_hashing_executor(self):
+        hashing_executor = MagicMock()
+        hashing_executor.hash = MagicMock(return_value="hashed")
+        hashing_executor.verify_and_update = MagicMock(return_value=(True, None))
+        di = MagicMock()
+        di.build = MagicMock(return_value=hashing_executor)
+        password = Password(di)
+        password.configure("password", {"use_hashing_executor": True}, self.user)
+
+        data = password.pre_save({"password": "notastrongpassword"}, self.user)
+        self.assertEqual("hashed", data["password"])
+        hashing_executor.hash.assert_called_once_with(password._crypt_context, "notastrongpassword")
+
+        hashed = self.default_crypt_context.hash("notastrongpassword")
+        self.user.get = MagicMock(return_value=hashed)
+        self.assertTrue(password.validate_password(self.user, "notastrongpassword"))
+        hashing_executor.verify_and_update.assert_called_once_with(
+            password._crypt_context, "notastrongpassword", hashed
+        )
+
+    def test_validate_wrong_password_does_not_upgrade(self):
+        password = Password(self.di)
+        password.configure(
+            "password",
+            {"crypt_context": {"schemes": ["argon2", "sha256_crypt"], "deprecated": ["sha256_crypt"]}},
+            self.user,
+        )
+        self.user.get = MagicMock(return_value=CryptContext(schemes=["sha256_crypt"]).hash("notastrongpassword"))
+        self.user.save = MagicMock()
+        self.assertFalse(password.validate_password(self.user, "wrongpassword"))
+        self.user.save.assert_not_called()
+
+    def test_deferred_rehash(self):
+        rehash_queue = MagicMock()
+        di = MagicMock()
+        di.build = MagicMock(return_value=rehash_queue)
+        password = Password(di)
+        password.configure(
+            "password",
+            {
+                "crypt_context": {"schemes": ["argon2", "sha256_crypt"], "deprecated": ["sha256_crypt"]},
+                "rehash_mode": "deferred",
+            },
+            self.user,
+        )
+        hashed = CryptContext(schemes=["sha256_crypt"]).hash("notastrongpassword")
+        self.user.get = MagicMock(return_value=hashed)
+        self.user.save = MagicMock()
+        self.assertTrue(password.validate_password(self.user, "notastrongpassword"))
+        self.user.save.assert_not_called()
+        rehash_queue.submit.assert_called_once_with(password, self.user, "notastrongpassword", hashed)
+        # earlier upgrades are saved by the request, not the background thread
+        rehash_queue.write_completed.assert_called_once_with(password, self.user)
+
+    def test_verify_latency_check(self):
+        password = Password(self.di)
+        with patch("clearskies_auth_server.column_types.password.check_verify_latency") as check_verify_latency:
+            password.configure("password", {"verify_latency_budget": 0.5, "verify_latency_concurrency": 4}, self.user)
+            # configuring the column doesn't measure anything
+            check_verify_latency.assert_not_called()
+            password.check_verify_latency()
+            check_verify_latency.assert_called_once_with(password.crypt_context, 0.5, concurrency=4)
+
+            other_password = Password(self.di)
+            other_password.configure("password", {}, self.user)
+            self.assertIsNone(other_password.check_verify_latency())
+            self.assertEqual(1, check_verify_latency.call_count)
+
+    def test_rehash_mode_check(self):
+        password = Password(self.di)
+        self.user.__name__ = "User"
+        with self.assertRaises(ValueError) as context:
+            password.configure("password", {"rehash_mode": "later"}, self.user)
+        self.assertIn("rehash_mode", str(context.exception))
@@ -6,11 +6,14 @@ from .jwks import Jwks
 from .key_base import KeyBase
 from .key_base_test_helper import KeyBaseTestHelper
 from .list_keys import ListKeys
+from .metrics import Metrics
+from .migrate_keys import MigrateKeys
 from .password_less_link_login import PasswordLessLinkLogin
 from .password_login import PasswordLogin
 from .password_reset import PasswordReset
 from .password_reset_request import PasswordResetRequest
 from .profile import Profile
+from .refresh_token_login import RefreshTokenLogin
 from .switch_tenant import SwitchTenant
 
 __all__ = [
@@ -19,13 +22,16 @@ __all__ = [
     "DeleteNotSelf",
     "DeleteOldestKey",
     "ListKeys",
+    "MigrateKeys",
     "KeyBase",
     "KeyBaseTestHelper",
     "Jwks",
+    "Metrics",
     "PasswordLessLinkLogin",
     "PasswordLogin",
     "PasswordReset",
     "PasswordResetRequest",
     "Profile",
+    "RefreshTokenLogin",
     "SwitchTenant",
 ]
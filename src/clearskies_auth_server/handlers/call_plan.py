@@ -0,0 +1,61 @@
+import inspect
+
+
+class CallPlan:
+    """
+    A developer-provided callable (e.g. `claims_callable`), along with the arguments it takes.
+
+    Calling it gives the same result as `di.call_function(callable, **kwargs)`, but the signature is inspected once
+    (when the handler is configured) rather than on every request.  Like `call_function`:
+
+     1. Arguments without a default come out of the kwargs if they're there, and otherwise out of the dependency
+        injection container.
+     2. Arguments with a default are only set if they're in the kwargs.
+     3. Kwargs that the callable doesn't take are ignored.
+
+    Since we know what the callable takes, we can also skip work for the kwargs it doesn't: use `takes()` before
+    building an expensive kwarg, and pass `input_output` to `__call__` instead of spreading the routing data and
+    context specifics into the kwargs, so that they're only fetched if the callable wants something out of them.
+    """
+
+    def __init__(self, di, callable_to_execute):
+        self._di = di
+        self.callable = callable_to_execute
+        self.context = getattr(callable_to_execute, "__name__", str(callable_to_execute))
+
+        # see di.call_function: bound methods don't get their first argument (aka `self`)
+        args_data = inspect.getfullargspec(callable_to_execute)
+        call_arguments = args_data.args
+        if hasattr(callable_to_execute, "__self__"):
+            call_arguments = call_arguments[1:]
+        number_of_kwargs = len(args_data.defaults) if args_data.defaults else 0
+        self.arg_names = tuple(call_arguments[: len(call_arguments) - number_of_kwargs])
+        self.kwarg_names = tuple(call_arguments[len(call_arguments) - number_of_kwargs :])
+        self.names = frozenset(call_arguments)
+
+    def takes(self, name):
+        return name in self.names
+
+    def __call__(self, kwargs, input_output=None):
+        """
+        Calls the callable with whatever it takes out of `kwargs`.
+
+        If `input_output` is provided, then anything it takes that isn't in the kwargs comes out of the routing
+        data or the context specifics (which is the same as adding them to the kwargs, but they're only fetched
+        if needed).
+        """
+        if input_output is not None and not self.names.issubset(kwargs.keys()):
+            kwargs = {**input_output.routing_data(), **input_output.context_specifics(), **kwargs}
+        callable_args = [
+            kwargs[arg] if arg in kwargs else self._di.build_from_name(arg, context=self.context, cache=True)
+            for arg in self.arg_names
+        ]
+        callable_kwargs = {name: kwargs[name] for name in self.kwarg_names if name in kwargs}
+        return self.callable(*callable_args, **callable_kwargs)
+
+
+def call_plan(di, callable_to_execute):
+    """
+    Returns the call plan for the callable, or None if there isn't one.
+    """
+    return CallPlan(di, callable_to_execute) if callable_to_execute else None
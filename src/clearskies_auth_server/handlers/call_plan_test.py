@@ -0,0 +1,50 @@
+import unittest
+from unittest.mock import MagicMock
+import clearskies
+from .call_plan import CallPlan, call_plan
+
+
+class Greeter:
+    def greet(self, name, greeting="hello"):
+        return f"{greeting} {name}"
+
+
+class CallPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.di = clearskies.di.StandardDependencies()
+        self.di.bind("name", "bob")
+
+    def test_arguments(self):
+        plan = CallPlan(self.di, lambda user, name, greeting="hello", punctuation="!": [user, name, greeting])
+        self.assertEquals(("user", "name"), plan.arg_names)
+        self.assertEquals(("greeting", "punctuation"), plan.kwarg_names)
+        self.assertTrue(plan.takes("greeting"))
+        self.assertFalse(plan.takes("input_output"))
+
+        # args come from the kwargs or the DI container, and kwargs only come from the kwargs
+        self.assertEquals(["me", "bob", "hello"], plan({"user": "me", "unused": "ignored"}))
+        self.assertEquals(["me", "sally", "hi"], plan({"user": "me", "name": "sally", "greeting": "hi"}))
+
+    def test_bound_method(self):
+        plan = CallPlan(self.di, Greeter().greet)
+        self.assertEquals(("name",), plan.arg_names)
+        self.assertEquals("hello bob", plan({}))
+        self.assertEquals("hi sally", plan({"name": "sally", "greeting": "hi"}))
+
+    def test_input_output(self):
+        input_output = MagicMock()
+        input_output.routing_data.return_value = {"tenant_id": "tenant-1", "user": "not me"}
+        input_output.context_specifics.return_value = {}
+
+        # the routing data is only fetched when the callable wants something that we didn't provide
+        plan = CallPlan(self.di, lambda user: user)
+        self.assertEquals("me", plan({"user": "me"}, input_output=input_output))
+        input_output.routing_data.assert_not_called()
+
+        plan = CallPlan(self.di, lambda user, tenant_id: [user, tenant_id])
+        self.assertEquals(["me", "tenant-1"], plan({"user": "me"}, input_output=input_output))
+        input_output.routing_data.assert_called_once()
+
+    def test_call_plan(self):
+        self.assertIsNone(call_plan(self.di, None))
+        self.assertEquals("bob", call_plan(self.di, lambda name: name)({}))
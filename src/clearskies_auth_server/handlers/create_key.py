@@ -1,43 +1,111 @@
-from jwcrypto import jwk
 import json
 
 from .key_base import KeyBase
+from ..keys import signing_algorithms
 
 
 class CreateKey(KeyBase):
+    """
+    Creates a new signing key.
+
+    By default the key is generated during the request, which is fine for elliptic curve keys (and small RSA
+    keys) but can take seconds for large RSA keys.  The `key_generation` setting changes that:
+
+     1. `synchronous` (the default): generate the key during the request.
+     2. `pool`: take a key from a pool of `key_pool_size` keys that are generated ahead of time in the background.
+     3. `background`: respond right away (with a 202) and generate and save the key in the background.  Until it's
+        ready, the key shows up in the ListKeys handler with a status of `pending`.
+    """
+
     _uuid = None
 
+    _configuration_defaults = {
+        **KeyBase._configuration_defaults,
+        "key_generation": "synchronous",
+        "key_pool_size": 2,
+    }
+
+    _key_generation_modes = ["synchronous", "pool", "background"]
+
     def __init__(self, di, secrets, datetime, uuid):
         super().__init__(di, secrets, datetime)
         self._uuid = uuid
 
+    def _check_configuration(self, configuration):
+        super()._check_configuration(configuration)
+        error_prefix = "Configuration error for %s:" % (self.__class__.__name__)
+        key_generation = configuration.get("key_generation")
+        if key_generation and key_generation not in self._key_generation_modes:
+            raise ValueError(
+                f"{error_prefix} 'key_generation' must be one of '"
+                + "', '".join(self._key_generation_modes)
+                + f"', but instead it is '{key_generation}'"
+            )
+        key_pool_size = configuration.get("key_pool_size")
+        if key_pool_size is not None and (type(key_pool_size) != int or key_pool_size < 0):
+            raise ValueError(f"{error_prefix} 'key_pool_size' must be a non-negative integer")
+
     def handle(self, input_output):
         # fetch the old keys
         private_keys = self.fetch_and_check_keys(self.configuration("path_to_private_keys"))
         public_keys = self.fetch_and_check_keys(self.configuration("path_to_public_keys"))
         self.check_for_inconsistencies(private_keys, public_keys)
 
-        # make a new key
         key_id = str(self._uuid.uuid4())
-        key = jwk.JWK.generate(
-            kty=self.configuration("key_type"),
-            size=self.configuration("key_size"),
-            kid=key_id,
-            alg=self.configuration("algorithm"),
-            use="sig",
-        )
+        key_generation = self.configuration("key_generation")
+        if key_generation == "background":
+            pool_size = self.configuration("key_pool_size")
+            self.key_generator.submit(key_id, self.key_spec(), pool_size, self.add_key)
+            return self.respond(
+                input_output, {"status": "success", "data": {"id": key_id, "status": "pending"}, "pagination": {}}, 202
+            )
 
-        # and add it to our dictionaries
-        private_keys[key_id] = {
-            **json.loads(key.export_private()),
-            "issue_date": self._datetime.datetime.now(self._datetime.timezone.utc).isoformat(),
+        # make a new key
+        key = self.generate_key(key_id)
+        self.add_key(key, private_keys=private_keys, public_keys=public_keys)
+
+        return self.success(input_output, {"id": key_id})
+
+    def add_key(self, key, private_keys=None, public_keys=None):
+        # when we're called from a background job, we have to fetch the latest keys ourselves
+        if private_keys is None:
+            private_keys = self.fetch_and_check_keys(self.configuration("path_to_private_keys"), use_cache=False)
+            public_keys = self.fetch_and_check_keys(self.configuration("path_to_public_keys"), use_cache=False)
+            self.check_for_inconsistencies(private_keys, public_keys)
+
+        # add the key to our dictionaries.  Note that we make new dictionaries because the ones we fetched
+        # are shared via the key store.
+        key_id = key["kid"]
+        private_keys = {
+            **private_keys,
+            key_id: {
+                **json.loads(key.export_private()),
+                "issue_date": self._datetime.datetime.now(self._datetime.timezone.utc).isoformat(),
+            },
         }
-        public_keys[key_id] = {
-            **json.loads(key.export_public()),
-            "issue_date": self._datetime.datetime.now(self._datetime.timezone.utc).isoformat(),
+        public_keys = {
+            **public_keys,
+            key_id: {
+                **json.loads(key.export_public()),
+                "issue_date": self._datetime.datetime.now(self._datetime.timezone.utc).isoformat(),
+            },
         }
 
         self.save_keys(self.configuration("path_to_private_keys"), private_keys)
         self.save_keys(self.configuration("path_to_public_keys"), public_keys)
 
-        return self.success(input_output, {"id": key_id})
+    def key_spec(self):
+        algorithm = self.configuration("algorithm")
+        key_type = self.configuration("key_type")
+        # RSA keys have a size, while elliptic curve (EC) and Edwards curve (OKP) keys are defined by their curve
+        size_or_curve = (
+            {"size": self.configuration("key_size")}
+            if key_type == "RSA"
+            else {"crv": signing_algorithms[algorithm]["curve"]}
+        )
+        return {"kty": key_type, "alg": algorithm, **size_or_curve}
+
+    def generate_key(self, key_id):
+        if self.configuration("key_generation") == "pool":
+            return self.key_generator.take(key_id, self.key_spec(), self.configuration("key_pool_size"))
+        return self.key_generator.generate(key_id, self.key_spec())
@@ -1,10 +1,13 @@
 import json
+import threading
 import unittest
 from unittest.mock import MagicMock, call
 from types import SimpleNamespace
 from jwcrypto import jwk
 from .key_base_test_helper import KeyBaseTestHelper
 from .create_key import CreateKey
+from .list_keys import ListKeys
+from ..keys import KeyGenerator, KeyStore
 from clearskies.contexts import test
 import datetime
 
@@ -52,7 +55,7 @@ class CreateKeyTest(KeyBaseTestHelper):
         self.assertEquals([self.key_id, key_id], saved_keys)
 
     def test_fetch_and_check_keys_success(self):
-        test = CreateKey("di", self.secrets, datetime, "uuid")
+        test = self.build_handler(CreateKey, self.secrets)
         keys = test.fetch_and_check_keys("/path/to/private")
 
         self.assertDictEqual(
@@ -66,7 +69,7 @@ class CreateKeyTest(KeyBaseTestHelper):
         secrets = SimpleNamespace(
             get=MagicMock(return_value=None),
         )
-        test = CreateKey("di", secrets, "datetime", "uuid")
+        test = self.build_handler(CreateKey, secrets)
         keys = test.fetch_and_check_keys("/path/to/private")
 
         self.assertDictEqual(
@@ -78,7 +81,7 @@ class CreateKeyTest(KeyBaseTestHelper):
         secrets = SimpleNamespace(
             get=MagicMock(return_value="sup"),
         )
-        test = CreateKey("di", secrets, "datetime", "uuid")
+        test = self.build_handler(CreateKey, secrets)
 
         with self.assertRaises(ValueError) as context:
             keys = test.fetch_and_check_keys("/path/to/private")
@@ -91,7 +94,7 @@ class CreateKeyTest(KeyBaseTestHelper):
         secrets = SimpleNamespace(
             get=MagicMock(return_value="[]"),
         )
-        test = CreateKey("di", secrets, "datetime", "uuid")
+        test = self.build_handler(CreateKey, secrets)
 
         with self.assertRaises(ValueError) as context:
             keys = test.fetch_and_check_keys("/path/to/private")
@@ -119,3 +122,143 @@ class CreateKeyTest(KeyBaseTestHelper):
             "There are some public keys that don't have corresponding private keys.  Those are: 'key_id_2'.  You'll have to manually restore the missing key or delete the extra key.",
             str(context.exception),
         )
+
+    def test_create_ed25519_key(self):
+        create_key = test(
+            {
+                "handler_class": CreateKey,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "algorithm": "EdDSA",
+                },
+            },
+            bindings={"secrets": self.secrets},
+        )
+        result = create_key()
+        self.assertEquals(200, result[1])
+        key_id = result[0]["data"]["id"]
+
+        upsert_calls = self.secrets.upsert.call_args_list
+        private_key = json.loads(upsert_calls[0].args[1])[key_id]
+        public_key = json.loads(upsert_calls[1].args[1])[key_id]
+        self.assertEquals(["OKP", "Ed25519", "EdDSA"], [private_key["kty"], private_key["crv"], private_key["alg"]])
+        self.assertIn("d", private_key)
+        self.assertNotIn("d", public_key)
+
+    def test_create_es256_key(self):
+        create_key = test(
+            {
+                "handler_class": CreateKey,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "key_type": "EC",
+                },
+            },
+            bindings={"secrets": self.secrets},
+        )
+        result = create_key()
+        key_id = result[0]["data"]["id"]
+
+        public_key = json.loads(self.secrets.upsert.call_args_list[1].args[1])[key_id]
+        self.assertEquals(["EC", "P-256", "ES256"], [public_key["kty"], public_key["crv"], public_key["alg"]])
+
+    def test_mismatched_algorithm_and_key_type(self):
+        with self.assertRaises(ValueError) as context:
+            test(
+                {
+                    "handler_class": CreateKey,
+                    "handler_config": {
+                        "path_to_private_keys": "/path/to/private",
+                        "path_to_public_keys": "/path/to/public",
+                        "algorithm": "EdDSA",
+                        "key_type": "RSA",
+                    },
+                },
+                bindings={"secrets": self.secrets},
+            )()
+        self.assertIn("requires a key type of 'OKP'", str(context.exception))
+
+    def test_create_key_in_background(self):
+        stored = {"/path/to/private": json.dumps(self.private_keys), "/path/to/public": json.dumps(self.public_keys)}
+        secrets = SimpleNamespace(
+            get=lambda path, silent_if_not_found=False: stored.get(path),
+            upsert=lambda path, value: stored.update({path: value}),
+        )
+        key_generator = KeyGenerator()
+        key_generation_started = threading.Event()
+        finish_key_generation = threading.Event()
+        generate = key_generator.generate
+
+        def slow_generate(key_id, key_spec):
+            key_generation_started.set()
+            finish_key_generation.wait()
+            return generate(key_id, key_spec)
+
+        key_generator.generate = slow_generate
+        handler_config = {
+            "path_to_private_keys": "/path/to/private",
+            "path_to_public_keys": "/path/to/public",
+            "algorithm": "EdDSA",
+        }
+        # in a real application these handlers would share one key store and key generator
+        bindings = {
+            "secrets": secrets,
+            "key_generator": key_generator,
+            "key_store": KeyStore(secrets, datetime),
+        }
+        create_key = test(
+            {
+                "handler_class": CreateKey,
+                "handler_config": {**handler_config, "key_generation": "background", "key_pool_size": 0},
+            },
+            bindings=bindings,
+        )
+        list_keys = test({"handler_class": ListKeys, "handler_config": handler_config}, bindings=bindings)
+
+        result = create_key()
+        self.assertEquals(202, result[1])
+        key_id = result[0]["data"]["id"]
+        self.assertEquals("pending", result[0]["data"]["status"])
+        key_generation_started.wait(5)
+        self.assertEquals(
+            {"id": key_id, "algorithm": "EdDSA", "issue_date": None, "status": "pending"},
+            list_keys()[0]["data"][1],
+        )
+
+        finish_key_generation.set()
+        key_generator.wait()
+        self.assertEquals([self.key_id, key_id], list(json.loads(stored["/path/to/private"]).keys()))
+        self.assertEquals([self.key_id, key_id], list(json.loads(stored["/path/to/public"]).keys()))
+        self.assertEquals([self.key_id, key_id], [key["id"] for key in list_keys()[0]["data"] if "status" not in key])
+
+    def test_create_key_from_pool(self):
+        key_generator = KeyGenerator()
+        key_spec = {"kty": "OKP", "alg": "EdDSA", "crv": "Ed25519"}
+        key_generator.fill_pool(key_spec, 2)
+        key_generator.wait()
+        self.assertEquals(2, key_generator.pool_size(key_spec))
+
+        create_key = test(
+            {
+                "handler_class": CreateKey,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "algorithm": "EdDSA",
+                    "key_generation": "pool",
+                },
+            },
+            bindings={"secrets": self.secrets, "key_generator": key_generator},
+        )
+        result = create_key()
+        self.assertEquals(200, result[1])
+        key_id = result[0]["data"]["id"]
+        saved_key = json.loads(self.secrets.upsert.call_args_list[0].args[1])[key_id]
+        self.assertEquals(key_id, saved_key["kid"])
+        self.assertEquals("Ed25519", saved_key["crv"])
+
+        # and the pool gets topped back up
+        key_generator.wait()
+        self.assertEquals(2, key_generator.pool_size(key_spec))
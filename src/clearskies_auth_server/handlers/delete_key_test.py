@@ -32,7 +32,8 @@ class DeleteKeyTest(KeyBaseTestHelper):
         public_keys = {**self.public_keys, "another_key_id": {"kid": "another_key_id", "issue_date": "0"}}
 
         fetch_keys = MagicMock()
-        fetch_keys.side_effect = [json.dumps(private_keys), json.dumps(public_keys)]
+        stored_keys = {"/path/to/private": json.dumps(private_keys), "/path/to/public": json.dumps(public_keys)}
+        fetch_keys.side_effect = lambda path, silent_if_not_found=False: stored_keys[path]
         secrets = SimpleNamespace(
             get=fetch_keys,
             upsert=MagicMock(),
@@ -1,23 +1,73 @@
-from jwcrypto import jwk
+import hashlib
 import json
 
 from .key_base import KeyBase
+from ..keys import public_jwk
+from ..metrics import auth_server_metrics
 
 
 class Jwks(KeyBase):
+    """
+    Serves the public keys as a JWKS.
+
+    Everyone who verifies our JWTs polls this endpoint, so we do as little work per request as possible: the
+    JSON document (and a strong ETag for it) is built once each time the key set changes, and then we just hand
+    out the same string over and over.  Clients that send back the ETag in an `If-None-Match` header get a 304,
+    and the `Cache-Control` header tells them not to bother asking again for `key_cache_duration` seconds, since
+    that's how long it can take for us to notice a new key anyway.
+
+    Clients that only need one key can ask for it with the `kid` query parameter.
+    """
+
     def handle(self, input_output):
-        public_keys = self.fetch_and_check_keys(self.configuration("path_to_public_keys"))
-
-        keys = [
-            {
-                "kid": key["kid"],
-                "use": key["use"],
-                "e": key["e"],
-                "n": key["n"],
-                "kty": key["kty"],
-                "alg": key["alg"],
-            }
-            for key in public_keys.values()
-        ]
-
-        return self.respond_unstructured(input_output, {"keys": keys}, 200)
+        documents = self.key_store.get_derived(
+            self.configuration("path_to_public_keys"),
+            "jwks_documents",
+            self.build_documents,
+            self.configuration("key_cache_duration"),
+            **self.key_cache_options(),
+        )
+        key_id = input_output.get_query_parameter("kid")
+        if key_id:
+            document = documents["by_kid"].get(key_id, documents["empty"])
+        else:
+            document = documents["all"]
+
+        input_output.set_header("etag", document["etag"])
+        input_output.set_header("cache-control", f"public, max-age={self.configuration('key_cache_duration')}")
+        jwks_requests = auth_server_metrics.jwks_requests(self.metrics_registry)
+        if self.etag_matches(input_output.get_request_header("if-none-match", True), document["etag"]):
+            jwks_requests.inc(labels=("304",))
+            return self.respond_unstructured(input_output, "", 304)
+        jwks_requests.inc(labels=("200",))
+        input_output.set_header("content-type", "application/json; charset=UTF-8")
+        return self.respond_unstructured(input_output, document["body"], 200)
+
+    def build_documents(self, public_keys):
+        keys = [public_jwk(key) for key in public_keys.values()]
+        return {
+            "all": self.build_document(keys),
+            "by_kid": {key["kid"]: self.build_document([key]) for key in keys},
+            "empty": self.build_document([]),
+        }
+
+    def build_document(self, keys):
+        body = json.dumps({"keys": keys})
+        return {
+            "body": body,
+            "etag": '"' + hashlib.sha256(body.encode("utf-8")).hexdigest() + '"',
+        }
+
+    def etag_matches(self, if_none_match, etag):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # If-None-Match uses the weak comparison, so a W/ prefix doesn't matter
+        for candidate in if_none_match.split(","):
+            candidate = candidate.strip()
+            if candidate.startswith("W/"):
+                candidate = candidate[2:]
+            if candidate == etag:
+                return True
+        return False
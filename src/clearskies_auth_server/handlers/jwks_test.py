@@ -6,6 +6,7 @@ from jwcrypto import jwk
 from .key_base_test_helper import KeyBaseTestHelper
 from .jwks import Jwks
 from clearskies.contexts import test
+from clearskies.mocks import InputOutput
 
 
 class JwksTest(KeyBaseTestHelper):
@@ -22,6 +23,7 @@ class JwksTest(KeyBaseTestHelper):
         )
         result = jwks()
         self.assertEquals(200, result[1])
+        response = json.loads(result[0])
         self.assertEquals(
             [
                 {
@@ -33,5 +35,103 @@ class JwksTest(KeyBaseTestHelper):
                     "use": "sig",
                 }
             ],
-            result[0]["keys"],
+            response["keys"],
         )
+
+    def test_jwks_mixed_key_types(self):
+        ed25519_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="my_test_key_2", alg="EdDSA", use="sig")
+        public_keys = {
+            **self.public_keys,
+            "my_test_key_2": {**json.loads(ed25519_key.export_public()), "issue_date": "2"},
+        }
+        secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(public_keys)))
+        jwks = test(
+            {
+                "handler_class": Jwks,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                },
+            },
+            bindings={"secrets": secrets},
+        )
+        result = jwks()
+        self.assertEquals(
+            {
+                "kid": "my_test_key_2",
+                "alg": "EdDSA",
+                "crv": "Ed25519",
+                "x": public_keys["my_test_key_2"]["x"],
+                "kty": "OKP",
+                "use": "sig",
+            },
+            json.loads(result[0])["keys"][1],
+        )
+
+    def test_etag_and_cache_control(self):
+        jwks = test(
+            {
+                "handler_class": Jwks,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "key_cache_duration": 600,
+                },
+            },
+            bindings={"secrets": self.secrets},
+        )
+        input_output = InputOutput()
+        body = jwks(input_output=input_output)[0]
+        etag = input_output.response["headers"]["ETAG"]
+        self.assertEquals("public, max-age=600", input_output.response["headers"]["CACHE-CONTROL"])
+
+        # same key set, same document (it isn't even re-serialized)
+        self.assertIs(body, jwks()[0])
+
+        input_output = InputOutput(request_headers={"If-None-Match": f'"nope", W/{etag}'})
+        self.assertEquals(("", 304), jwks(input_output=input_output))
+        self.assertEquals(etag, input_output.response["headers"]["ETAG"])
+
+        self.assertEquals(200, jwks(headers={"If-None-Match": '"nope"'})[1])
+
+    def test_etag_changes_with_key_set(self):
+        secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(self.public_keys)))
+        jwks = test(
+            {
+                "handler_class": Jwks,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "key_cache_duration": 0,
+                },
+            },
+            bindings={"secrets": secrets},
+        )
+        input_output = InputOutput()
+        jwks(input_output=input_output)
+        etag = input_output.response["headers"]["ETAG"]
+
+        ed25519_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="my_test_key_2", alg="EdDSA", use="sig")
+        secrets.get.return_value = json.dumps(
+            {**self.public_keys, "my_test_key_2": {**json.loads(ed25519_key.export_public()), "issue_date": "2"}}
+        )
+        input_output = InputOutput(request_headers={"If-None-Match": etag})
+        result = jwks(input_output=input_output)
+        self.assertEquals(200, result[1])
+        self.assertEquals(2, len(json.loads(result[0])["keys"]))
+        self.assertNotEquals(etag, input_output.response["headers"]["ETAG"])
+
+    def test_filter_by_kid(self):
+        jwks = test(
+            {
+                "handler_class": Jwks,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                },
+            },
+            bindings={"secrets": self.secrets},
+        )
+        keys = json.loads(jwks(query_parameters={"kid": "my_test_key_1"})[0])["keys"]
+        self.assertEquals(["my_test_key_1"], [key["kid"] for key in keys])
+        self.assertEquals({"keys": []}, json.loads(jwks(query_parameters={"kid": "not-a-key"})[0]))
@@ -1,13 +1,16 @@
-from jwcrypto import jwk
-import json
+from jwcrypto.common import base64url_encode, json_encode
 from clearskies.handlers.base import Base as HandlerBase
+from ..hashing import HashingOverloaded
+from ..keys import KeyGenerator, KeyStore, default_algorithms, key_storage_layouts, signing_algorithms
+from ..metrics import MetricsRegistry, auth_server_metrics
 
 
 class KeyBase(HandlerBase):
     _secrets = None
     _datetime = None
-    _key_cache = None
-    _cache_time = None
+    _key_store = None
+    _key_generator = None
+    _metrics_registry = None
 
     _configuration_defaults = {
         "path_to_public_keys": "",
@@ -16,13 +19,26 @@ class KeyBase(HandlerBase):
         "key_type": "RSA",
         "key_size": 2048,
         "key_cache_duration": 7200,
+        "key_refresh_mode": "synchronous",
+        "key_storage_layout": "single",
     }
 
+    _key_refresh_modes = ["synchronous", "background"]
+
     def __init__(self, di, secrets, datetime):
         super().__init__(di)
         self._secrets = secrets
         self._datetime = datetime
-        self._key_cache = {}
+        self._key_store = None
+        self._key_generator = None
+        self._metrics_registry = None
+
+    def __call__(self, input_output):
+        try:
+            return super().__call__(input_output)
+        except HashingOverloaded as overloaded:
+            input_output.set_header("retry-after", str(overloaded.retry_after))
+            return self.error(input_output, str(overloaded), overloaded.status_code)
 
     def _check_configuration(self, configuration):
         super()._check_configuration(configuration)
@@ -30,53 +46,155 @@ class KeyBase(HandlerBase):
         for config_name in ["path_to_private_keys", "path_to_public_keys"]:
             if not configuration.get(config_name):
                 raise ValueError(f"{error_prefix} the configuration value '{config_name}' is required but missing.")
+        key_refresh_mode = configuration.get("key_refresh_mode")
+        if key_refresh_mode and key_refresh_mode not in self._key_refresh_modes:
+            raise ValueError(
+                f"{error_prefix} 'key_refresh_mode' must be one of '"
+                + "', '".join(self._key_refresh_modes)
+                + f"', but instead it is '{key_refresh_mode}'"
+            )
+        key_storage_layout = configuration.get("key_storage_layout")
+        if key_storage_layout and key_storage_layout not in key_storage_layouts:
+            raise ValueError(
+                f"{error_prefix} 'key_storage_layout' must be one of '"
+                + "', '".join(key_storage_layouts)
+                + f"', but instead it is '{key_storage_layout}'"
+            )
         algorithm = configuration.get("algorithm")
-        if algorithm and algorithm != "RSA256":
-            raise ValueError("Currently only RSA256 is supported for the algorithm.")
+        if algorithm and algorithm not in signing_algorithms:
+            raise ValueError(
+                f"{error_prefix} 'algorithm' must be one of '"
+                + "', '".join(signing_algorithms.keys())
+                + f"', but instead it is '{algorithm}'"
+            )
         key_type = configuration.get("key_type")
-        if key_type and key_type != "RSA":
-            raise ValueError("Currently only RSA keys are supported.")
+        if key_type and key_type not in default_algorithms:
+            raise ValueError(
+                f"{error_prefix} 'key_type' must be one of '"
+                + "', '".join(default_algorithms.keys())
+                + f"', but instead it is '{key_type}'"
+            )
+        if algorithm and key_type and signing_algorithms[algorithm]["key_type"] != key_type:
+            expected_key_type = signing_algorithms[algorithm]["key_type"]
+            raise ValueError(
+                f"{error_prefix} the algorithm '{algorithm}' requires a key type of '{expected_key_type}', but 'key_type' is '{key_type}'"
+            )
+
+    def apply_default_configuration(self, configuration):
+        # if only one of the algorithm or key type is set, then the other one follows from it
+        if "algorithm" in self._configuration_defaults:
+            algorithm = configuration.get("algorithm")
+            key_type = configuration.get("key_type")
+            if algorithm and not key_type:
+                configuration = {**configuration, "key_type": signing_algorithms[algorithm]["key_type"]}
+            if key_type and not algorithm:
+                configuration = {**configuration, "algorithm": default_algorithms[key_type]}
+        return super().apply_default_configuration(configuration)
+
+    @property
+    def key_store(self):
+        """
+        The key store that caches our keys.
+
+        It comes out of the dependency injection container, so the same key store (and therefore the same cached
+        and parsed keys) is shared by all of the handlers in the application.
+        """
+        if self._key_store is None:
+            self._key_store = self._di.build(KeyStore, cache=True)
+            auth_server_metrics.watch_key_store(self.metrics_registry, self._key_store)
+        return self._key_store
+
+    @property
+    def metrics_registry(self):
+        """
+        The metrics registry (see the metrics module), which is shared by all the handlers and served by Metrics.
+        """
+        if self._metrics_registry is None:
+            self._metrics_registry = self._di.build(MetricsRegistry, cache=True)
+        return self._metrics_registry
+
+    @property
+    def key_generator(self):
+        """
+        The key generator, which generates keys outside of requests (see the CreateKey handler).
+
+        Like the key store, it comes out of the dependency injection container and is shared by all the handlers.
+        """
+        if self._key_generator is None:
+            self._key_generator = self._di.build(KeyGenerator, cache=True)
+        return self._key_generator
+
+    def key_cache_options(self, use_cache=True):
+        """
+        Returns the keyword arguments for the key store that match our configuration.
+
+        With a `key_refresh_mode` of `background`, the key store reloads the keys in a separate thread shortly
+        before they expire, so requests never have to wait for the secret manager.
+        """
+        return {
+            "use_cache": use_cache,
+            "background": self.configuration("key_refresh_mode") == "background",
+        }
+
+    def key_set_age(self, path):
+        """
+        Returns how long ago (in seconds) the keys at the given path were last loaded from the secret manager.
+        """
+        return self.key_store.get_age(path)
 
     def fetch_and_check_keys(self, path, use_cache=True):
-        if use_cache and path in self._key_cache:
-            cache_valid_time = self._datetime.datetime.now() - self._datetime.timedelta(
-                seconds=self.configuration("key_cache_duration")
-            )
-            if self._key_cache[path]["cache_time"] > cache_valid_time:
-                return self._key_cache[path]["key_data"]
+        """
+        Returns the keys stored at the given path.
 
-        raw_data = self._secrets.get(path, silent_if_not_found=True)
-        if not raw_data:
-            return {}
+        The returned dictionary is shared with everyone else using the key store, so don't modify it.
+        """
+        return self.key_store.get_key_data(
+            path, self.configuration("key_cache_duration"), **self.key_cache_options(use_cache)
+        )
 
-        try:
-            key_data = json.loads(raw_data)
-        except json.JSONDecodeError as e:
-            raise ValueError(
-                f"I fetched the key data from '{path}'.  It should have been a JSON encoded object but it isn't JSON.  Sorry :("
-            )
+    def get_parsed_key(self, path, key_id, use_cache=True):
+        return self.key_store.get_parsed_key(
+            path, key_id, self.configuration("key_cache_duration"), **self.key_cache_options(use_cache)
+        )
 
-        actual_type = type(key_data)
-        if actual_type != dict:
-            raise ValueError(
-                f"The key data stored in '{path}' should have been a dictionary but instead was a '{actual_type.__name__}'"
-            )
+    def get_signing_key(self, path, use_cache=True):
+        return self.get_youngest_private_key(path, use_cache=use_cache, as_json=False)
 
-        if use_cache:
-            self._key_cache[path] = {"cache_time": self._datetime.datetime.now(), "key_data": key_data}
+    def create_signed_jwt(self, claims, path=None, use_cache=True):
+        """
+        Builds and signs a JWT with the current signing key, returning it in JWS compact serialization.
 
-        # that's as far as we're going to get for now.
-        return key_data
+        This produces the same bytes as `jwt.JWT(header=..., claims=...).make_signed_token(key)` followed by
+        `serialize()` (with the alg in the header set by the key type), but skips most of the work: the base64url
+        encoded header and the actual signing function are built once per key (and cached alongside the parsed
+        key), so for each token we just have to encode the claims and sign.
+        """
+        if path is None:
+            path = self.configuration("path_to_private_keys")
+        signer = self.key_store.get_signer(
+            path, self.configuration("key_cache_duration"), **self.key_cache_options(use_cache)
+        )
+        auth_server_metrics.tokens_minted(self.metrics_registry).inc(labels=(signer["kid"],))
+        signing_input = signer["encoded_header"] + b"." + base64url_encode(json_encode(claims)).encode("utf-8")
+        return (signing_input + b"." + base64url_encode(signer["sign"](signing_input)).encode("utf-8")).decode("utf-8")
 
     def get_oldest_private_key(self, path, use_cache=True, as_json=True):
-        keys = self.fetch_and_check_keys(path, use_cache=use_cache)
-        oldest_key_id = min(keys, key=lambda key_id: keys[key_id]["issue_date"])
-        return keys[oldest_key_id] if as_json else jwk.JWK(**keys[oldest_key_id])
+        max_age = self.configuration("key_cache_duration")
+        oldest_key_id = self.key_store.get_oldest_key_id(path, max_age, **self.key_cache_options(use_cache))
+        if not oldest_key_id:
+            raise ValueError(f"There are no keys stored in '{path}'")
+        if not as_json:
+            return self.key_store.get_parsed_key(path, oldest_key_id, max_age, **self.key_cache_options())
+        return self.key_store.get_key(path, oldest_key_id, max_age, **self.key_cache_options())
 
     def get_youngest_private_key(self, path, use_cache=True, as_json=True):
-        keys = self.fetch_and_check_keys(path, use_cache=use_cache)
-        youngest_key_id = max(keys, key=lambda key_id: keys[key_id]["issue_date"])
-        return keys[youngest_key_id] if as_json else jwk.JWK(**keys[youngest_key_id])
+        max_age = self.configuration("key_cache_duration")
+        youngest_key_id = self.key_store.get_youngest_key_id(path, max_age, **self.key_cache_options(use_cache))
+        if not youngest_key_id:
+            raise ValueError(f"There are no keys stored in '{path}'")
+        if not as_json:
+            return self.key_store.get_parsed_key(path, youngest_key_id, max_age, **self.key_cache_options())
+        return self.key_store.get_key(path, youngest_key_id, max_age, **self.key_cache_options())
 
     def check_for_inconsistencies(self, private_keys, public_keys):
         """
@@ -109,7 +227,7 @@ class KeyBase(HandlerBase):
             )
 
     def save_keys(self, path, keys):
-        self._secrets.upsert(path, json.dumps(keys))
+        self.key_store.save(path, keys, layout=self.configuration("key_storage_layout"))
 
     def respond_unstructured(self, input_output, response_data, status_code):
         response_headers = self.configuration("response_headers")
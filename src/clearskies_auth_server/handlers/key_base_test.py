@@ -0,0 +1,104 @@
+import datetime
+import json
+import unittest
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+from jwcrypto import jwk, jwt
+import clearskies
+from .key_base_test_helper import KeyBaseTestHelper
+from .jwks import Jwks
+
+
+class KeyBaseTest(KeyBaseTestHelper):
+    def test_signing_key_is_parsed_once(self):
+        secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(self.private_keys)))
+        handler = self.build_handler(Jwks, secrets)
+
+        signing_key = handler.get_signing_key("/path/to/private")
+        self.assertEqual(self.key_id, signing_key["kid"])
+        self.assertIs(signing_key, handler.get_signing_key("/path/to/private"))
+        secrets.get.assert_called_once_with("/path/to/private", silent_if_not_found=True)
+
+    def test_signing_key_is_the_youngest(self):
+        new_key = jwk.JWK.generate(kty="RSA", size=2048, kid="my_test_key_2", alg="RSA256", use="sig")
+        private_keys = {
+            **self.private_keys,
+            "my_test_key_2": {**json.loads(new_key.export_private()), "issue_date": "2"},
+        }
+        secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(private_keys)))
+        handler = self.build_handler(Jwks, secrets)
+
+        self.assertEqual("my_test_key_2", handler.get_signing_key("/path/to/private")["kid"])
+        self.assertEqual(self.key_id, handler.get_oldest_private_key("/path/to/private")["kid"])
+
+    def test_changed_key_set_drops_parsed_keys(self):
+        new_key = jwk.JWK.generate(kty="RSA", size=2048, kid="my_test_key_2", alg="RSA256", use="sig")
+        private_keys = {
+            **self.private_keys,
+            "my_test_key_2": {**json.loads(new_key.export_private()), "issue_date": "2"},
+        }
+        secrets = SimpleNamespace(
+            get=MagicMock(
+                side_effect=[json.dumps(self.private_keys), json.dumps(self.private_keys), json.dumps(private_keys)]
+            )
+        )
+        handler = self.build_handler(Jwks, secrets)
+
+        original_key = handler.get_signing_key("/path/to/private")
+        self.assertIs(original_key, handler.get_signing_key("/path/to/private", use_cache=False))
+        new_signing_key = handler.get_signing_key("/path/to/private", use_cache=False)
+        self.assertEqual("my_test_key_2", new_signing_key["kid"])
+
+    def test_save_keys_clears_cache(self):
+        secrets = SimpleNamespace(
+            get=MagicMock(return_value=json.dumps(self.private_keys)),
+            upsert=MagicMock(),
+        )
+        handler = self.build_handler(Jwks, secrets)
+
+        original_key = handler.get_signing_key("/path/to/private")
+        private_keys = {self.key_id: {**self.private_keys[self.key_id], "issue_date": "2"}}
+        handler.save_keys("/path/to/private", private_keys)
+        secrets.get.return_value = json.dumps(private_keys)
+        self.assertIsNot(original_key, handler.get_signing_key("/path/to/private"))
+        # the save reads the current keys too, rather than trusting the cache
+        self.assertEqual(3, secrets.get.call_count)
+
+    def test_create_signed_jwt_matches_jwcrypto(self):
+        secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(self.private_keys)))
+        handler = self.build_handler(Jwks, secrets)
+        claims = {"aud": "example.com", "iss": "https://example.com", "exp": 1700086400, "email": "a@b.com", "iat": 1}
+
+        token = jwt.JWT(header={"alg": "RS256", "typ": "JWT", "kid": self.key_id}, claims=claims)
+        token.make_signed_token(self.key)
+        self.assertEqual(token.serialize(), handler.create_signed_jwt(claims, path="/path/to/private"))
+        self.assertEqual(token.serialize(), handler.create_signed_jwt(claims, path="/path/to/private"))
+
+    def test_create_signed_jwt_with_new_key_types(self):
+        now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        claims = {"aud": "example.com", "iss": "https://example.com", "exp": now + 60, "email": "a@b.com", "iat": now}
+        for key_type, curve, algorithm in [("OKP", "Ed25519", "EdDSA"), ("EC", "P-256", "ES256")]:
+            key = jwk.JWK.generate(kty=key_type, crv=curve, kid=f"{key_type}_key", alg=algorithm, use="sig")
+            private_keys = {
+                **self.private_keys,
+                key["kid"]: {**json.loads(key.export_private()), "issue_date": "2"},
+            }
+            handler = self.build_handler(Jwks, SimpleNamespace(get=MagicMock(return_value=json.dumps(private_keys))))
+
+            token = jwt.JWT(jwt=handler.create_signed_jwt(claims, path="/path/to/private"), key=key, algs=[algorithm])
+            self.assertEqual({"alg": algorithm, "typ": "JWT", "kid": key["kid"]}, json.loads(token.header))
+            self.assertEqual(claims, json.loads(token.claims))
+
+    def test_background_key_refresh(self):
+        secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(self.private_keys)))
+        handler = self.build_handler(Jwks, secrets, key_refresh_mode="background")
+
+        handler.get_signing_key("/path/to/private")
+        self.assertEqual(0, round(handler.key_set_age("/path/to/private")))
+        secrets.get.side_effect = ConnectionError("secret manager is down")
+        handler.get_signing_key("/path/to/private", use_cache=False)
+        self.assertEqual("secret manager is down", handler.key_store.get_last_error("/path/to/private"))
+
+        with self.assertRaises(ValueError) as context:
+            self.build_handler(Jwks, secrets, key_refresh_mode="eventually")
+        self.assertIn("'key_refresh_mode' must be one of 'synchronous', 'background'", str(context.exception))
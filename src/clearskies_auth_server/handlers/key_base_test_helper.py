@@ -4,6 +4,7 @@ from unittest.mock import MagicMock, call
 from types import SimpleNamespace
 from jwcrypto import jwk
 from .key_base import KeyBase
+import clearskies
 from clearskies.contexts import test
 
 
@@ -22,8 +23,25 @@ class KeyBaseTestHelper(unittest.TestCase):
         self.public_keys = {self.key_id: {**json.loads(self.key.export_public()), "issue_date": "1"}}
 
         self.fetch_keys = MagicMock()
-        self.fetch_keys.side_effect = [json.dumps(self.private_keys), json.dumps(self.public_keys)]
+        stored_keys = {
+            "/path/to/private": json.dumps(self.private_keys),
+            "/path/to/public": json.dumps(self.public_keys),
+        }
+        self.fetch_keys.side_effect = lambda path, silent_if_not_found=False: stored_keys[path]
         self.secrets = SimpleNamespace(
             get=self.fetch_keys,
             upsert=MagicMock(),
         )
+
+    def build_handler(self, handler_class, secrets, **handler_config):
+        di = clearskies.di.StandardDependencies(bindings={"secrets": secrets})
+        handler = di.build(handler_class)
+        handler.configure(
+            {
+                "path_to_private_keys": "/path/to/private",
+                "path_to_public_keys": "/path/to/public",
+                "authentication": clearskies.authentication.public(),
+                **handler_config,
+            }
+        )
+        return handler
@@ -1,22 +1,36 @@
-from jwcrypto import jwk
-import json
-
 from .key_base import KeyBase
 
 
 class ListKeys(KeyBase):
     def handle(self, input_output):
-        # fetch the old keys
-        private_keys = self.fetch_and_check_keys(self.configuration("path_to_private_keys"))
-        public_keys = self.fetch_and_check_keys(self.configuration("path_to_public_keys"))
+        # we only need to know about the keys, not the keys themselves, so we stick to the index (which, with the
+        # per-key storage layout, means that we don't have to fetch every private key just to list them).
+        max_age = self.configuration("key_cache_duration")
+        private_keys = self.key_store.get_key_index(
+            self.configuration("path_to_private_keys"), max_age, **self.key_cache_options()
+        )
+        public_keys = self.key_store.get_key_index(
+            self.configuration("path_to_public_keys"), max_age, **self.key_cache_options()
+        )
         self.check_for_inconsistencies(private_keys, public_keys)
 
         keys = [
             {
-                "id": key["kid"],
+                "id": key_id,
                 "algorithm": key["alg"],
                 "issue_date": key["issue_date"],
             }
-            for key in private_keys.values()
+            for (key_id, key) in private_keys.items()
         ]
+        # keys that are still being generated in the background (or failed to be)
+        for job in self.key_generator.pending():
+            if job["id"] not in private_keys:
+                keys.append(
+                    {
+                        "id": job["id"],
+                        "algorithm": job["algorithm"],
+                        "issue_date": None,
+                        "status": job["status"],
+                    }
+                )
         return self.success(input_output, keys)
@@ -0,0 +1,34 @@
+from clearskies.handlers.base import Base as HandlerBase
+from ..metrics import MetricsRegistry
+
+
+class Metrics(HandlerBase):
+    """
+    Serves the metrics recorded by the other handlers, in the Prometheus text format.
+
+    The metrics come out of the metrics registry in the dependency injection container (see the metrics module), so
+    this reports on the handlers in the same application.  By default that only covers the process that handles
+    the scrape: see MetricsRegistry for how to aggregate across worker processes.
+
+    Metrics can tell an attacker how busy (and how locked out) your users are, so keep this endpoint private, e.g.
+    with `authentication` or by only routing to it on an internal port.
+    """
+
+    _configuration_defaults = {}
+
+    def __init__(self, di):
+        super().__init__(di)
+
+    @property
+    def metrics_registry(self):
+        return self._di.build(MetricsRegistry, cache=True)
+
+    def handle(self, input_output):
+        body = self.metrics_registry.render()
+        response_headers = self.configuration("response_headers")
+        if response_headers:
+            input_output.set_headers(response_headers)
+        for security_header in self.configuration("security_headers"):
+            security_header.set_headers_for_input_output(input_output)
+        input_output.set_header("content-type", "text/plain; version=0.0.4; charset=utf-8")
+        return input_output.respond(body, 200)
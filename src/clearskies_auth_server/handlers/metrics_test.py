@@ -0,0 +1,36 @@
+from .key_base_test_helper import KeyBaseTestHelper
+from .jwks import Jwks
+from .metrics import Metrics
+from ..metrics import MetricsRegistry
+from clearskies.contexts import test
+from clearskies.mocks import InputOutput
+
+
+class MetricsTest(KeyBaseTestHelper):
+    def test_metrics(self):
+        metrics_registry = MetricsRegistry()
+        bindings = {"secrets": self.secrets, "metrics_registry": metrics_registry}
+        jwks = test(
+            {
+                "handler_class": Jwks,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                },
+            },
+            bindings=bindings,
+        )
+        input_output = InputOutput()
+        jwks(input_output=input_output)
+        jwks(headers={"If-None-Match": input_output.response["headers"]["ETAG"]})
+
+        metrics = test({"handler_class": Metrics, "handler_config": {}}, bindings=bindings)
+        input_output = InputOutput()
+        (body, status_code) = metrics(input_output=input_output)
+        self.assertEqual(200, status_code)
+        self.assertEqual("text/plain; version=0.0.4; charset=utf-8", input_output.response["headers"]["CONTENT-TYPE"])
+        self.assertIn("# TYPE auth_server_jwks_requests_total counter\n", body)
+        self.assertIn('auth_server_jwks_requests_total{status="200"} 1\n', body)
+        self.assertIn('auth_server_jwks_requests_total{status="304"} 1\n', body)
+        self.assertIn('auth_server_key_cache_total{result="misses"} 1\n', body)
+        self.assertIn('auth_server_key_cache_total{result="hits"} 1\n', body)
@@ -0,0 +1,17 @@
+from .key_base import KeyBase
+
+
+class MigrateKeys(KeyBase):
+    """
+    Re-saves the private and public keys in the configured `key_storage_layout`.
+
+    Readers understand both layouts, so it's safe to migrate while the application is running: the switch
+    happens in a single write to each path.
+    """
+
+    def handle(self, input_output):
+        layout = self.configuration("key_storage_layout")
+        for path in [self.configuration("path_to_private_keys"), self.configuration("path_to_public_keys")]:
+            self.key_store.migrate(path, layout)
+
+        return self.success(input_output, {"key_storage_layout": layout})
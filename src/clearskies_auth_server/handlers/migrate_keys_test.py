@@ -0,0 +1,50 @@
+import json
+from types import SimpleNamespace
+from .key_base_test_helper import KeyBaseTestHelper
+from .create_key import CreateKey
+from .jwks import Jwks
+from .migrate_keys import MigrateKeys
+from clearskies.contexts import test
+
+
+class MigrateKeysTest(KeyBaseTestHelper):
+    def test_migrate_and_create(self):
+        stored = {"/path/to/private": json.dumps(self.private_keys), "/path/to/public": json.dumps(self.public_keys)}
+        secrets = SimpleNamespace(
+            get=lambda path, silent_if_not_found=False: stored.get(path),
+            upsert=lambda path, value: stored.update({path: value}),
+        )
+        handler_config = {
+            "path_to_private_keys": "/path/to/private",
+            "path_to_public_keys": "/path/to/public",
+            "key_storage_layout": "per_key",
+        }
+        migrate_keys = test(
+            {"handler_class": MigrateKeys, "handler_config": handler_config}, bindings={"secrets": secrets}
+        )
+        result = migrate_keys()
+        self.assertEquals(200, result[1])
+        self.assertEquals({"key_storage_layout": "per_key"}, result[0]["data"])
+        self.assertEquals(1, json.loads(stored["/path/to/private"])["version"])
+        self.assertEquals(self.private_keys[self.key_id], json.loads(stored[f"/path/to/private/{self.key_id}"]))
+        self.assertEquals(self.public_keys[self.key_id], json.loads(stored[f"/path/to/public/{self.key_id}"]))
+
+        create_key = test({"handler_class": CreateKey, "handler_config": handler_config}, bindings={"secrets": secrets})
+        key_id = create_key()[0]["data"]["id"]
+        manifest = json.loads(stored["/path/to/private"])
+        self.assertEquals(2, manifest["version"])
+        self.assertEquals(key_id, manifest["active_key_id"])
+        self.assertEquals(key_id, json.loads(stored[f"/path/to/private/{key_id}"])["kid"])
+
+        # readers don't need to be told about the layout
+        jwks = test(
+            {
+                "handler_class": Jwks,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                },
+            },
+            bindings={"secrets": secrets},
+        )
+        self.assertEquals([self.key_id, key_id], [key["kid"] for key in json.loads(jwks()[0])["keys"]])
@@ -1,9 +1,10 @@
 import inspect
 import json
-from jwcrypto import jwk, jwt
+from types import MappingProxyType
 from clearskies.handlers.exceptions import ClientError, NotFound
 from clearskies.column_types import Audit, String, DateTime
 from .password_login import PasswordLogin
+from .user_columns import select_user_columns
 
 
 class PasswordLessLinkLogin(PasswordLogin):
@@ -20,6 +21,7 @@ class PasswordLessLinkLogin(PasswordLogin):
         "path_to_private_keys": "",
         "path_to_public_keys": "",
         "key_cache_duration": 7200,
+        "key_refresh_mode": "synchronous",
         "claims_callable": None,
         "claims_column_names": None,
         "login_check_callables": [],
@@ -28,6 +30,12 @@ class PasswordLessLinkLogin(PasswordLogin):
         "audit_action_name_successful_login": "login",
         "audit_action_name_failed_login": "failed_login",
         "audit_overrides": {},
+        "buffered_audit": False,
+        "select_user_columns": False,
+        "extra_user_column_names": [],
+        "timing_sink": None,
+        "refresh_token_model_class": None,
+        "refresh_token_lifetime_seconds": 2592000,
         "users": None,
     }
 
@@ -58,6 +66,8 @@ class PasswordLessLinkLogin(PasswordLogin):
         self._check_input_error_callable_configuration(configuration, error_prefix)
         self._check_audit_configuration(configuration, error_prefix)
         self._check_login_check_callables(configuration, error_prefix)
+        self._check_timing_sink_configuration(configuration, error_prefix)
+        self._check_refresh_token_configuration(configuration, error_prefix)
 
         key_source = configuration.get("key_source")
         if key_source and key_source not in ["query_parameters", "json_body"]:
@@ -83,102 +93,139 @@ class PasswordLessLinkLogin(PasswordLogin):
                     f"{error_prefix} config {config_name} should be a clearskies column of type {name}, but is not."
                 )
 
-    def handle(self, input_output):
+    def compile_plan(self):
+        """
+        Returns everything that the request path needs to know about the configuration (see PasswordLogin).
+        """
+        key_column_name = self.configuration("key_column_name")
+        return {
+            **self._compile_user_plan(),
+            **self._compile_claims_plan(),
+            **self._compile_audit_plan(),
+            **self._compile_refresh_token_plan(),
+            "key_column_name": key_column_name,
+            "key_expiration_column_name": self.configuration("key_expiration_column_name"),
+            "key_source": self.configuration("key_source"),
+            "key_source_key_name": self.configuration("key_source_key_name") or key_column_name,
+            "username_column_name": self.configuration("username_column_name"),
+            "audit_overrides": MappingProxyType(self.configuration("audit_overrides")),
+            "timing_sink": self.configuration("timing_sink"),
+            "tenant_id_column_name": None,
+            "account_lockout": False,
+        }
+
+    def attempt_login(self, input_output, timings):
+        plan = self._plan
         login_key = self.get_login_key(input_output)
+        timings.mark("input")
         if not login_key:
+            timings.outcome = "invalid_input"
             return self.error(input_output, "Missing login key.", 404)
         if not isinstance(login_key, str):
+            timings.outcome = "invalid_input"
             return self.error(input_output, "Login key was not a string.", 404)
 
-        key_column_name = self.configuration("key_column_name")
-        users = self.users
-        user = users.find(f"{key_column_name}={login_key}")
+        key_column_name = plan["key_column_name"]
+        users = plan["login_users"]
+        user = select_user_columns(users, self._user_column_names).find(f"{key_column_name}={login_key}")
+        timings.mark("user_lookup")
         if not user.exists:
+            timings.outcome = "unknown_key"
             return self.error(input_output, "No matching login session found.", 404)
-        username_column_name = self.configuration("username_column_name")
-        audit_overrides = self.configuration("audit_overrides")
         audit_extra_data_unmapped = {
-            "username": user.get(self.configuration("username_column_name")),
+            "username": user.get(plan["username_column_name"]),
             "user_id": user.get(user.id_column_name),
         }
         audit_extra_data = {}
-        for key, value in audit_overrides.items():
+        for key, value in plan["audit_overrides"].items():
             audit_extra_data[value] = audit_extra_data_unmapped[key]
 
-        key_expiration_column_name = self.configuration("key_expiration_column_name")
+        key_expiration_column_name = plan["key_expiration_column_name"]
         expiration = user.get(key_expiration_column_name)
         if not expiration.tzinfo:
             expiration.replace(tzinfo=self._datetime.timezone.utc)
         if not expiration:
             self.audit(
                 user,
-                self.configuration("audit_action_name_failed_login"),
+                plan["audit_action_name_failed_login"],
                 data={
                     "reason": "Login refused: missing expiration date for login key.",
                     **audit_extra_data,
                 },
             )
+            timings.mark("audit")
+            timings.outcome = "expired_key"
             return self.error(input_output, "No matching login session found.", 404)
         if expiration < self._datetime.datetime.now(self._datetime.timezone.utc):
             self.audit(
                 user,
-                self.configuration("audit_action_name_failed_login"),
+                plan["audit_action_name_failed_login"],
                 data={
                     "reason": "Attempt to login with single-use key failed due to expired key.",
                     **audit_extra_data,
                 },
             )
+            timings.mark("audit")
+            timings.outcome = "expired_key"
             return self.error(input_output, "No matching login session found.", 404)
 
         # developer-defined checks
-        login_check_callables = self.configuration("login_check_callables")
-        if login_check_callables:
-            for login_check_callable in login_check_callables:
-                response = self._di.call_function(
-                    login_check_callable,
-                    user=user,
-                    input_output=input_output,
-                    **input_output.routing_data(),
-                    **input_output.context_specifics(),
+        for login_check_callable in plan["login_check_callables"]:
+            response = login_check_callable({"user": user, "input_output": input_output}, input_output=input_output)
+            if response:
+                timings.mark("login_checks")
+                self.audit(
+                    user,
+                    plan["audit_action_name_failed_login"],
+                    data={
+                        "reason": response,
+                        **audit_extra_data,
+                    },
                 )
-                if response:
-                    self.audit(
-                        user,
-                        self.configuration("audit_action_name_failed_login"),
-                        data={
-                            "reason": response,
-                            **audit_extra_data,
-                        },
-                    )
-                    return self.error(input_output, "No matching login session found.", 404)
-
-        [jwt, jwt_claims] = self.create_jwt(user, audit_extra_data=audit_extra_data)
+                timings.mark("audit")
+                timings.outcome = "login_check_failed"
+                return self.error(input_output, "No matching login session found.", 404)
+        if plan["login_check_callables"]:
+            timings.mark("login_checks")
+
+        [token, jwt_claims] = self.create_token(user, audit_extra_data=audit_extra_data, timings=timings)
         user.save(
             {
                 key_column_name: "",
                 key_expiration_column_name: self._datetime.datetime.now(self._datetime.timezone.utc),
             }
         )
+        timings.mark("clear_key")
         self.login_successful(user, input_output)
-
-        return self.respond_unstructured(
-            input_output,
-            {
-                "token": jwt.serialize(),
-                "expires_at": jwt_claims["exp"],
-            },
-            200,
-        )
+        timings.mark("login_successful")
+        response_data = self.token_response_data(user, token, jwt_claims, timings=timings)
+        timings.outcome = "success"
+
+        return self.respond_unstructured(input_output, response_data, 200)
+
+    def user_callables_configured(self):
+        # a subclass that does something after login may use anything on the user
+        if type(self).login_successful is not PasswordLessLinkLogin.login_successful:
+            return True
+        return super().user_callables_configured()
+
+    def needed_user_column_names(self):
+        audit_column_name = self.configuration("audit_column_name") if self.configuration("audit") else None
+        return [
+            self.users.id_column_name,
+            self.configuration("username_column_name"),
+            self.configuration("key_column_name"),
+            self.configuration("key_expiration_column_name"),
+            *(self.configuration("claims_column_names") or []),
+            self._columns[audit_column_name].config("parent_id_column_name") if audit_column_name else None,
+        ]
 
     def login_successful(self, user, input_output):
         pass
 
     def get_login_key(self, input_output):
-        key_source = self.configuration("key_source")
-        key_source_key_name = self.configuration("key_source_key_name")
-        if not key_source_key_name:
-            key_source_key_name = self.configuration("key_column_name")
-
+        key_source = self._plan["key_source"]
+        key_source_key_name = self._plan["key_source_key_name"]
         if key_source == "query_parameters":
             return input_output.get_query_parameter(key_source_key_name)
         request_data = input_output.json_body()
@@ -197,3 +197,40 @@ class PasswordLessLinkLoginTest(KeyBaseTestHelper):
             }
         )
         self.assertEquals(404, response[1])
+
+    def test_timing_sink(self):
+        recorded = []
+        login = test(
+            {
+                "handler_class": PasswordLessLinkLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "key_column_name": "login_code",
+                    "username_column_name": "email",
+                    "key_expiration_column_name": "login_code_expiration",
+                    "timing_sink": recorded.append,
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[User, AuditRecord],
+        )
+        login.build("users").create(
+            {
+                "email": "cmancone@example.com",
+                "login_code": "asdfer",
+                "login_code_expiration": datetime_module.datetime.utcnow() + datetime_module.timedelta(hours=5),
+            }
+        )
+        login(query_parameters={"login_code": "asdfer"})
+        login()
+
+        self.assertEquals(["success", "invalid_input"], [timings.outcome for timings in recorded])
+        self.assertEquals("PasswordLessLinkLogin", recorded[0].handler)
+        self.assertEquals(
+            ["input", "user_lookup", "audit", "sign", "clear_key", "login_successful"], list(recorded[0].phases.keys())
+        )
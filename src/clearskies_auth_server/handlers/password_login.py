@@ -1,9 +1,20 @@
 import inspect
 import json
-from jwcrypto import jwk, jwt
+import math
+from types import MappingProxyType
+from jwcrypto import jwt
+from ..audits import AuditWriter
+from ..keys import jws_algorithm
+from ..lockouts import LockoutStore
+from ..metrics import auth_server_metrics
+from ..rate_limits import RateLimiter
+from ..refresh_tokens import RefreshTokenStore
+from ..timings import NullTimings, RequestTimings, null_timings
 from clearskies.handlers.exceptions import InputError
 from clearskies.column_types import Audit
 from .key_base import KeyBase
+from .call_plan import call_plan
+from .user_columns import backend_column_names, build_login_users, select_user_columns
 import datetime
 
 
@@ -21,6 +32,7 @@ class PasswordLogin(KeyBase):
         "path_to_private_keys": "",
         "path_to_public_keys": "",
         "key_cache_duration": 7200,
+        "key_refresh_mode": "synchronous",
         "claims_callable": None,
         "claims_column_names": None,
         "input_error_callable": None,
@@ -31,9 +43,22 @@ class PasswordLogin(KeyBase):
         "audit_action_name_failed_login": "failed_login",
         "audit_action_name_account_locked": "account_lockout",
         "audit_overrides": {},
+        "buffered_audit": False,
         "account_lockout": True,
         "account_lockout_failed_attempts_threshold": 10,
         "account_lockout_failed_attempts_period_minutes": 5,
+        "account_lockout_source": "audit",
+        "select_user_columns": False,
+        "extra_user_column_names": [],
+        "timing_sink": None,
+        # the default rate limiter keeps its buckets in memory, so every process gets the full `rate_limits` and
+        # the effective limit is multiplied by the number of workers.  Bind a shared limiter to `rate_limiter` (e.g.
+        # SqliteRateLimiter), or set `rate_limits_per_process` to True to confirm that per-process limits are fine.
+        "rate_limits": {},
+        "rate_limits_per_process": False,
+        "rate_limit_status_code": 429,
+        "refresh_token_model_class": None,
+        "refresh_token_lifetime_seconds": 2592000,
         "users": None,
     }
 
@@ -45,9 +70,22 @@ class PasswordLogin(KeyBase):
         "path_to_public_keys",
     ]
 
+    # what we can rate limit on, in the order they're checked
+    _rate_limit_names = ["client_ip", "tenant", "username"]
+
     def __init__(self, di, secrets, datetime):
         super().__init__(di, secrets, datetime)
         self._columns = None
+        self._lockout_store = None
+        self._rate_limiter = None
+        self._audit_writer = None
+        self._user_column_names = None
+        self._plan = None
+
+    def configure(self, configuration):
+        super().configure(configuration)
+        self._user_column_names = self.user_column_names()
+        self._plan = MappingProxyType(self.compile_plan())
 
     def _check_configuration(self, configuration):
         super()._check_configuration(configuration)
@@ -95,11 +133,19 @@ class PasswordLogin(KeyBase):
         self._check_audit_configuration(configuration, error_prefix)
         self._check_login_check_callables(configuration, error_prefix)
         self._check_tenant_id_column_name_configuration(configuration, error_prefix)
+        self._check_timing_sink_configuration(configuration, error_prefix)
+        self._check_rate_limits_configuration(configuration, error_prefix)
+        self._check_refresh_token_configuration(configuration, error_prefix)
 
         if configuration.get("account_lockout") and not configuration.get("audit"):
             raise ValueError(
                 f"{error_prefix} 'account_lockout' is set to True but 'audit' is False.  You must enable auditing to turn on account lockouts."
             )
+        account_lockout_source = configuration.get("account_lockout_source", "audit")
+        if account_lockout_source not in ["audit", "lockout_store"]:
+            raise ValueError(
+                f"{error_prefix} 'account_lockout_source' must be either 'audit' or 'lockout_store', but is '{account_lockout_source}'"
+            )
 
     def _check_required_configuration(self, configuration, error_prefix):
         for key in self._required_configurations:
@@ -218,6 +264,64 @@ class PasswordLogin(KeyBase):
         if configuration.get("tenant_id_source") not in ["routing_data"]:
             raise ValueError(f"{error_prefix} 'tenant_id_source must be set to 'routing_data', but is something else.")
 
+    def _check_timing_sink_configuration(self, configuration, error_prefix):
+        if configuration.get("timing_sink") and not callable(configuration.get("timing_sink")):
+            raise ValueError(f"{error_prefix} the provided 'timing_sink' configuration is not actually callable.")
+
+    def _check_rate_limits_configuration(self, configuration, error_prefix):
+        rate_limits = configuration.get("rate_limits")
+        if not rate_limits:
+            return
+        if not isinstance(rate_limits, dict):
+            raise ValueError(f"{error_prefix} 'rate_limits' should be a dictionary, but is a {type(rate_limits)}")
+        for limit_name, rate_limit in rate_limits.items():
+            if limit_name not in self._rate_limit_names:
+                allowed = ", ".join(self._rate_limit_names)
+                raise ValueError(f"{error_prefix} unknown rate limit '{limit_name}'.  It must be one of {allowed}")
+            if not isinstance(rate_limit, dict) or set(rate_limit.keys()) - {"requests", "per_seconds", "burst"}:
+                raise ValueError(
+                    f"{error_prefix} the rate limit for '{limit_name}' should be a dictionary with 'requests', 'per_seconds', and (optionally) 'burst'"
+                )
+            for key in ["requests", "per_seconds", "burst"]:
+                if key == "burst" and key not in rate_limit:
+                    continue
+                value = rate_limit.get(key)
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                    raise ValueError(
+                        f"{error_prefix} '{key}' for the '{limit_name}' rate limit should be a positive number"
+                    )
+            if rate_limit.get("burst", rate_limit["requests"]) < 1:
+                raise ValueError(
+                    f"{error_prefix} the '{limit_name}' rate limit must allow at least one request at a time"
+                )
+        if "tenant" in rate_limits and not configuration.get("tenant_id_column_name"):
+            raise ValueError(
+                f"{error_prefix} there is a rate limit for 'tenant', but tenants are only used when you set 'tenant_id_column_name'"
+            )
+        if getattr(self.rate_limiter, "per_process", False) and not configuration.get("rate_limits_per_process"):
+            raise ValueError(
+                f"{error_prefix} 'rate_limits' are set but the rate limiter keeps its buckets in memory, so each process would allow the full limit.  Bind a shared rate limiter to 'rate_limiter' (e.g. clearskies_auth_server.rate_limits.SqliteRateLimiter), or set 'rate_limits_per_process' to True if per-process limits are what you want."
+            )
+        status_code = configuration.get("rate_limit_status_code", 429)
+        if not isinstance(status_code, int) or status_code < 400 or status_code > 599:
+            raise ValueError(f"{error_prefix} 'rate_limit_status_code' should be an HTTP error status code")
+
+    def _check_refresh_token_configuration(self, configuration, error_prefix):
+        refresh_token_model_class = configuration.get("refresh_token_model_class")
+        if not refresh_token_model_class:
+            return
+        if not inspect.isclass(refresh_token_model_class) or not hasattr(refresh_token_model_class, "where"):
+            raise ValueError(f"{error_prefix} 'refresh_token_model_class' should be a clearskies model class")
+        missing = RefreshTokenStore.missing_column_names(refresh_token_model_class, self._di)
+        if missing:
+            raise ValueError(
+                f"{error_prefix} the refresh token model, '{refresh_token_model_class.__name__}', is missing the required column(s) "
+                + ", ".join(missing)
+            )
+        lifetime_seconds = configuration.get("refresh_token_lifetime_seconds", 2592000)
+        if isinstance(lifetime_seconds, bool) or not isinstance(lifetime_seconds, int) or lifetime_seconds <= 0:
+            raise ValueError(f"{error_prefix} 'refresh_token_lifetime_seconds' should be a positive integer")
+
     def _get_audit_column(self, columns):
         audit_column = None
         for column in columns.values():
@@ -231,53 +335,264 @@ class PasswordLogin(KeyBase):
             configuration["audit_column_name"] = self._get_audit_column(self._columns).name
         return super().apply_default_configuration(configuration)
 
+    @property
+    def lockout_store(self):
+        """
+        Keeps track of failed logins for the account lockout, when `account_lockout_source` is 'lockout_store'.
+
+        The default lives in memory, so each process counts on its own, but since it comes out of the dependency
+        injection container, you can swap in a shared store by binding it to `lockout_store` (see the lockouts module).
+        """
+        if self._lockout_store is None:
+            self._lockout_store = self._di.build(LockoutStore, cache=True)
+        return self._lockout_store
+
+    @property
+    def rate_limiter(self):
+        """
+        Holds the token buckets for the `rate_limits`.
+
+        Like the lockout store, the default lives in memory and you can swap in a shared one by binding it to
+        `rate_limiter` (see the rate_limits module).
+        """
+        if self._rate_limiter is None:
+            self._rate_limiter = self._di.build(RateLimiter, cache=True)
+        return self._rate_limiter
+
+    @property
+    def audit_writer(self):
+        if self._audit_writer is None:
+            self._audit_writer = self._di.build(AuditWriter, cache=True)
+            auth_server_metrics.watch_audit_writer(self.metrics_registry, self._audit_writer)
+        return self._audit_writer
+
+    def user_column_names(self):
+        """
+        Returns the columns to load when fetching the user, or None to load them all.
+
+        Loading the whole user can be a lot of work for a login (if, e.g., the user has large JSON columns), so
+        with `select_user_columns` turned on we only load the columns we use.  It's off by default, since the user
+        is also saved (e.g. to upgrade the password hash) and handed to the callables, which then only see part of
+        it.  Callables can use anything on the user, so if there are any then we load everything, unless you tell
+        us which extra columns they need via `extra_user_column_names`.
+        """
+        if not self.configuration("select_user_columns"):
+            return None
+        extra_user_column_names = self.configuration("extra_user_column_names")
+        if not extra_user_column_names and self.user_callables_configured():
+            return None
+        return backend_column_names(self._columns, [*self.needed_user_column_names(), *extra_user_column_names])
+
+    def user_callables_configured(self):
+        return bool(self.configuration("claims_callable") or self.configuration("login_check_callables"))
+
+    def needed_user_column_names(self):
+        audit_column_name = self.configuration("audit_column_name") if self.configuration("audit") else None
+        return [
+            self.users.id_column_name,
+            self.configuration("username_column_name"),
+            self.configuration("password_column_name"),
+            self.configuration("tenant_id_column_name"),
+            *(self.configuration("claims_column_names") or []),
+            # the id of the user in the audit record
+            self._columns[audit_column_name].config("parent_id_column_name") if audit_column_name else None,
+        ]
+
+    def compile_plan(self):
+        """
+        Returns everything that the request path needs to know about the configuration.
+
+        None of this changes after the handler is configured, so rather than looking up the configuration (and
+        rebuilding column maps, claim lists, etc...) for every login, we work it all out once in `configure()` and
+        store it in `self._plan` (as a read-only mapping).  If you override this, extend what the parent returns.
+        """
+        username_column_name = self.configuration("username_column_name")
+        password_column_name = self.configuration("password_column_name")
+        input_column_names = (username_column_name, password_column_name)
+        tenant_id_column_name = self.configuration("tenant_id_column_name")
+        account_lockout = self.configuration("account_lockout")
+        return {
+            **self._compile_user_plan(),
+            **self._compile_claims_plan(),
+            **self._compile_audit_plan(),
+            **self._compile_refresh_token_plan(),
+            "username_column_name": username_column_name,
+            "password_column_name": password_column_name,
+            "password_column": self._columns[password_column_name],
+            # maps the keys in the request body to our column names
+            "column_map": MappingProxyType(
+                {self.auto_case_column_name(column_name, True): column_name for column_name in input_column_names}
+            ),
+            "allowed_column_names": frozenset(input_column_names),
+            "input_columns": tuple(self._columns[column_name] for column_name in input_column_names),
+            "input_error_callable": call_plan(self._di, self.configuration("input_error_callable")),
+            "tenant_id_column_name": tenant_id_column_name,
+            "tenant_id": self._compile_tenant_id_resolver() if tenant_id_column_name else None,
+            "account_lockout": account_lockout,
+            "account_lockout_failed_attempts_threshold": self.configuration(
+                "account_lockout_failed_attempts_threshold"
+            ),
+            "lockout_window_seconds": self.configuration("account_lockout_failed_attempts_period_minutes") * 60,
+            # failed logins are counted in the audit table unless a lockout store was asked for
+            "lockouts_from_audit": self.configuration("account_lockout_source") == "audit",
+            "audit_action_name_account_locked": self.configuration("audit_action_name_account_locked"),
+            "lockouts": auth_server_metrics.lockouts(self.metrics_registry),
+            "rate_limits": self._compile_rate_limits(),
+            "rate_limit_status_code": self.configuration("rate_limit_status_code"),
+            "rate_limited": auth_server_metrics.rate_limited(self.metrics_registry),
+        }
+
+    def _compile_user_plan(self):
+        return {
+            # users are loaded through a model that only configures its columns once (see `SharedColumns`)
+            "login_users": build_login_users(self._di, self.configuration("user_model_class")),
+            "timing_sink": self.configuration("timing_sink"),
+            "handler_name": self.__class__.__name__,
+            "logins": auth_server_metrics.logins(self.metrics_registry),
+            "login_check_callables": tuple(
+                call_plan(self._di, login_check_callable)
+                for login_check_callable in self.configuration("login_check_callables") or []
+            ),
+        }
+
+    def _compile_claims_plan(self):
+        claims_callable = call_plan(self._di, self.configuration("claims_callable"))
+        if claims_callable:
+            claims = lambda user: claims_callable({"user": user})
+        else:
+            claims_column_names = tuple(self.configuration("claims_column_names"))
+            claims = lambda user: {claim_column: user.get(claim_column) for claim_column in claims_column_names}
+        return {
+            "claims": claims,
+            "audience": self.configuration("audience"),
+            "issuer": self.configuration("issuer"),
+            "jwt_lifetime": datetime.timedelta(seconds=self.configuration("jwt_lifetime_seconds")),
+        }
+
+    def _compile_audit_plan(self):
+        audit = self.configuration("audit")
+        return {
+            "audit_column": self._columns[self.configuration("audit_column_name")] if audit else None,
+            "buffered_audit": self.configuration("buffered_audit"),
+            "audit_action_name_successful_login": self.configuration("audit_action_name_successful_login"),
+            "audit_action_name_failed_login": self.configuration("audit_action_name_failed_login"),
+        }
+
+    def _compile_refresh_token_plan(self):
+        refresh_token_model_class = self.configuration("refresh_token_model_class")
+        return {
+            "refresh_tokens": (
+                RefreshTokenStore(self._di.build(refresh_token_model_class, cache=True), self._datetime, self._di)
+                if refresh_token_model_class
+                else None
+            ),
+            "refresh_token_lifetime_seconds": self.configuration("refresh_token_lifetime_seconds"),
+        }
+
+    def _compile_rate_limits(self):
+        # (name, capacity, refill_per_second) for each rate limit
+        rate_limits = self.configuration("rate_limits") or {}
+        return tuple(
+            (
+                limit_name,
+                rate_limits[limit_name].get("burst", rate_limits[limit_name]["requests"]),
+                rate_limits[limit_name]["requests"] / rate_limits[limit_name]["per_seconds"],
+            )
+            for limit_name in self._rate_limit_names
+            if limit_name in rate_limits
+        )
+
+    def _compile_tenant_id_resolver(self):
+        # routing data is the only source we support (which the configuration checks enforce)
+        tenant_id_source_key_name = self.configuration("tenant_id_source_key_name")
+        return lambda input_output: input_output.routing_data().get(tenant_id_source_key_name)
+
     @property
     def users(self):
         return self._di.build(self.configuration("user_model_class"), cache=True)
 
+    def start_timings(self):
+        """
+        Returns the object that records how long each phase of the login takes.
+
+        If there's no `timing_sink` then no times are recorded, and this is a stand-in that only keeps track of the
+        outcome (for the login metrics).
+        """
+        timing_sink = self._plan["timing_sink"]
+        return RequestTimings(self._plan["handler_name"], timing_sink) if timing_sink else NullTimings()
+
     def handle(self, input_output):
+        timings = self.start_timings()
+        try:
+            return self.attempt_login(input_output, timings)
+        finally:
+            timings.finish()
+            self._plan["logins"].inc(labels=(self._plan["handler_name"], timings.outcome))
+
+    def attempt_login(self, input_output, timings):
+        plan = self._plan
         request_data = self.request_data(input_output)
         input_errors = self._find_input_errors(self.users, request_data, input_output)
+        timings.mark("input")
         if input_errors:
+            timings.outcome = "invalid_input"
             raise InputError(input_errors)
 
-        username_column_name = self.configuration("username_column_name")
-        password_column_name = self.configuration("password_column_name")
-        password_column = self._columns[password_column_name]
+        username_column_name = plan["username_column_name"]
+        password_column_name = plan["password_column_name"]
+        password_column = plan["password_column"]
         tenant_id_value = None
         username = request_data[username_column_name]
-        users = self.users
+        users = plan["login_users"]
         audit_extra_data = {
             username_column_name: username,
         }
-        if self.configuration("tenant_id_column_name"):
-            tenant_id_column_name = self.configuration("tenant_id_column_name")
-            tenant_id_source_key_name = self.configuration("tenant_id_source_key_name")
-            if self.configuration("tenant_id_source") == "routing_data":
-                tenant_id_value = input_output.routing_data().get(tenant_id_source_key_name)
+        tenant_id_column_name = plan["tenant_id_column_name"]
+        if tenant_id_column_name:
+            tenant_id_value = plan["tenant_id"](input_output)
             if not tenant_id_value:
+                timings.outcome = "invalid_tenant"
                 return self.input_errors(input_output, {username_column_name: "Invalid username/password combination"})
             users = users.where(f"{tenant_id_column_name}={tenant_id_value}")
             audit_extra_data[tenant_id_column_name] = tenant_id_value
-        user = users.find(f"{username_column_name}={username}")
+
+        # rate limits come before anything that touches the database or the password hash
+        if plan["rate_limits"]:
+            retry_after = self.check_rate_limits(input_output, username, tenant_id_value)
+            timings.mark("rate_limit")
+            if retry_after is not None:
+                timings.outcome = "rate_limited"
+                input_output.set_header("retry-after", str(max(1, math.ceil(retry_after))))
+                return self.error(
+                    input_output, "Too many login attempts.  Please try again later.", plan["rate_limit_status_code"]
+                )
+
+        user = select_user_columns(users, self._user_column_names).find(f"{username_column_name}={username}")
         audit_extra_data["user_id"] = user.get(user.id_column_name)
+        timings.mark("user_lookup")
 
         # no user found
         if not user.exists:
+            timings.outcome = "unknown_user"
             return self.input_errors(input_output, {username_column_name: "Invalid username/password combination"})
 
         # account lockout
-        if self.account_locked(user):
+        account_locked = self.account_locked(user)
+        timings.mark("lockout_check")
+        if account_locked:
             self.audit(
                 user,
-                self.configuration("audit_action_name_account_locked"),
+                plan["audit_action_name_account_locked"],
                 data={
                     "reason": "Account Locked",
                     **audit_extra_data,
                 },
                 record_data=audit_extra_data,
             )
-            minutes = self.configuration("account_lockout_failed_attempts_threshold")
+            timings.mark("audit")
+            timings.outcome = "account_locked"
+            plan["lockouts"].inc(labels=(plan["handler_name"],))
+            minutes = plan["account_lockout_failed_attempts_threshold"]
             s = "s" if int(minutes) != 1 else ""
             return self.input_errors(
                 input_output,
@@ -288,135 +603,250 @@ class PasswordLogin(KeyBase):
 
         # password not set
         if not user.get(password_column_name):
-            self.audit(
+            self.failed_login(
                 user,
-                self.configuration("audit_action_name_failed_login"),
                 data={
                     "reason": "Password not set - user is not configured for password login",
                     **audit_extra_data,
                 },
                 record_data=audit_extra_data,
             )
+            timings.mark("audit")
+            timings.outcome = "password_not_set"
             return self.input_errors(input_output, {username_column_name: "Invalid username/password combination"})
 
         # invalid password
-        if not password_column.validate_password(user, request_data[password_column_name]):
-            self.audit(
+        valid_password = password_column.validate_password(user, request_data[password_column_name])
+        timings.mark("password_verify")
+        if not valid_password:
+            self.failed_login(
                 user,
-                self.configuration("audit_action_name_failed_login"),
                 data={
                     "reason": "Invalid password",
                     **audit_extra_data,
                 },
                 record_data=audit_extra_data,
             )
+            timings.mark("audit")
+            timings.outcome = "invalid_password"
             return self.input_errors(input_output, {username_column_name: "Invalid username/password combination"})
 
         # developer-defined checks
-        login_check_callables = self.configuration("login_check_callables")
-        if login_check_callables:
-            for login_check_callable in login_check_callables:
-                response = self._di.call_function(
-                    login_check_callable,
-                    user=user,
-                    request_data=request_data,
-                    input_output=input_output,
-                    **input_output.routing_data(),
-                    **input_output.context_specifics(),
+        for login_check_callable in plan["login_check_callables"]:
+            response = login_check_callable(
+                {"user": user, "request_data": request_data, "input_output": input_output},
+                input_output=input_output,
+            )
+            if response:
+                timings.mark("login_checks")
+                self.failed_login(
+                    user,
+                    data={
+                        "reason": response,
+                        **audit_extra_data,
+                    },
+                    record_data=audit_extra_data,
                 )
-                if response:
-                    self.audit(
-                        user,
-                        self.configuration("audit_action_name_failed_login"),
-                        data={
-                            "reason": response,
-                            **audit_extra_data,
-                        },
-                        record_data=audit_extra_data,
-                    )
-                    return self.input_errors(input_output, {username_column_name: response})
+                timings.mark("audit")
+                timings.outcome = "login_check_failed"
+                return self.input_errors(input_output, {username_column_name: response})
+        if plan["login_check_callables"]:
+            timings.mark("login_checks")
+
+        [token, jwt_claims] = self.create_token(
+            user, audit_extra_data=audit_extra_data, record_data=audit_extra_data, timings=timings
+        )
+        response_data = self.token_response_data(user, token, jwt_claims, timings=timings)
+        timings.outcome = "success"
+
+        return self.respond_unstructured(input_output, response_data, 200)
 
-        [jwt, jwt_claims] = self.create_jwt(user, audit_extra_data=audit_extra_data, record_data=audit_extra_data)
+    def create_jwt(self, user, audit_extra_data=None, record_data=None, timings=null_timings):
+        """
+        Records the successful login and returns the signed JWT (a jwcrypto JWT) along with its claims.
 
-        return self.respond_unstructured(
-            input_output,
-            {
-                "token": jwt.serialize(),
-                "expires_at": jwt_claims["exp"],
-            },
-            200,
+        The login handlers use create_token instead, which signs the same token without building a jwcrypto JWT.
+        """
+        self.audit_successful_login(user, audit_extra_data=audit_extra_data, record_data=record_data)
+        timings.mark("audit")
+        jwt_claims = self.get_jwt_claims(user)
+        signing_key = self.get_signing_key(self.configuration("path_to_private_keys"))
+        token = jwt.JWT(
+            header={"alg": jws_algorithm(signing_key), "typ": "JWT", "kid": signing_key["kid"]}, claims=jwt_claims
         )
+        token.make_signed_token(signing_key)
+        auth_server_metrics.tokens_minted(self.metrics_registry).inc(labels=(signing_key["kid"],))
+        timings.mark("sign")
+        return [token, jwt_claims]
+
+    def create_token(self, user, audit_extra_data=None, record_data=None, timings=null_timings):
+        """
+        Records the successful login and returns the serialized JWT along with its claims.
+        """
+        # if a subclass customizes create_jwt, then those are the tokens we hand out
+        if type(self).create_jwt is not PasswordLogin.create_jwt:
+            [token, jwt_claims] = self.create_jwt(user, audit_extra_data=audit_extra_data, record_data=record_data)
+            return [token.serialize(), jwt_claims]
+        self.audit_successful_login(user, audit_extra_data=audit_extra_data, record_data=record_data)
+        timings.mark("audit")
+        jwt_claims = self.get_jwt_claims(user)
+        token = self.create_signed_jwt(jwt_claims)
+        timings.mark("sign")
+        return [token, jwt_claims]
 
-    def create_jwt(self, user, audit_extra_data=None, record_data=None):
+    def audit_successful_login(self, user, audit_extra_data=None, record_data=None):
         self.audit(
             user,
-            self.configuration("audit_action_name_successful_login"),
+            self._plan["audit_action_name_successful_login"],
             data=audit_extra_data,
             record_data=record_data,
         )
-        signing_key = self.get_youngest_private_key(self.configuration("path_to_private_keys"), as_json=False)
-        jwt_claims = self.get_jwt_claims(user)
-        token = jwt.JWT(header={"alg": "RS256", "typ": "JWT", "kid": signing_key["kid"]}, claims=jwt_claims)
-        token.make_signed_token(signing_key)
-        return [token, jwt_claims]
+
+    def token_response_data(self, user, token, jwt_claims, exchanged_refresh_token=None, timings=null_timings):
+        """
+        Returns the response for a successful login, with a new refresh token if they're enabled.
+
+        Pass along the refresh token that was just exchanged to keep the new one in the same family (and within the
+        family's original expiration), or leave it out to start a new family (i.e. for a fresh login).
+        """
+        response_data = {
+            "token": token,
+            "expires_at": jwt_claims["exp"],
+        }
+        refresh_tokens = self._plan["refresh_tokens"]
+        if refresh_tokens is None:
+            return response_data
+        (refresh_token, refresh_token_expires_at) = refresh_tokens.issue(
+            user.get(user.id_column_name),
+            self._plan["refresh_token_lifetime_seconds"],
+            family_id=exchanged_refresh_token.get("family_id") if exchanged_refresh_token else None,
+            family_expires_at=exchanged_refresh_token.get("expires_at") if exchanged_refresh_token else None,
+        )
+        timings.mark("refresh_token")
+        return {
+            **response_data,
+            "refresh_token": refresh_token,
+            "refresh_token_expires_at": int(refresh_token_expires_at.timestamp()),
+        }
+
+    def failed_login(self, user, data=None, record_data=None):
+        plan = self._plan
+        if plan["account_lockout"] and plan["lockouts_from_audit"]:
+            # the lockout counts these records, so they can't wait in the audit buffer
+            self.audit(user, plan["audit_action_name_failed_login"], data=data, record_data=record_data, buffered=False)
+            return
+
+        self.audit(user, plan["audit_action_name_failed_login"], data=data, record_data=record_data)
+        if plan["account_lockout"]:
+            self.lockout_store.record_failure(self.lockout_key(user), self.lockout_window_seconds())
 
     def account_locked(self, user):
-        if not self.configuration("account_lockout"):
-            return True
+        plan = self._plan
+        if not plan["account_lockout"]:
+            return False
+
+        if plan["lockouts_from_audit"]:
+            failed_attempts = self.count_audited_failures(user)
+        else:
+            failed_attempts = self.lockout_store.count_failures(self.lockout_key(user), self.lockout_window_seconds())
+        return failed_attempts >= plan["account_lockout_failed_attempts_threshold"]
+
+    def count_audited_failures(self, user):
+        """
+        Counts the user's failed logins in the lockout window from the audit table.
 
-        threshold_time = datetime.datetime.now() - datetime.timedelta(
-            minutes=self.configuration("account_lockout_failed_attempts_period_minutes")
+        The audit table is shared by every process, so the lockout holds no matter which worker (or Lambda) handles
+        the login.
+        """
+        plan = self._plan
+        now = self._datetime.datetime.now(self._datetime.timezone.utc)
+        threshold_time = now - self._datetime.timedelta(seconds=plan["lockout_window_seconds"])
+        failed_attempts = (
+            user.get(plan["audit_column"].name)
+            .where("action=" + plan["audit_action_name_failed_login"])
+            .where("created_at>" + threshold_time.strftime("%Y-%m-%d %H:%M:%S"))
         )
-        audit_column_name = self.configuration("audit_column_name")
-        failed_attempts = user.get(audit_column_name).where(
-            "action=" + self.configuration("audit_action_name_failed_login")
+        return len(failed_attempts)
+
+    def check_rate_limits(self, input_output, username, tenant_id):
+        """
+        Takes a token from each of the rate limits, returning None if there was one, or the seconds to wait if not.
+
+        We stop at the first rate limit that refuses the request, so a client that's over its limit doesn't use up
+        the tokens of the other limits (e.g. the username they're guessing at).
+        """
+        plan = self._plan
+        for limit_name, capacity, refill_per_second in plan["rate_limits"]:
+            key = self.rate_limit_key(limit_name, input_output, username, tenant_id)
+            if key is None:
+                continue
+            (allowed, retry_after) = self.rate_limiter.take(key, capacity, refill_per_second)
+            if not allowed:
+                plan["rate_limited"].inc(labels=(plan["handler_name"], limit_name))
+                return retry_after
+        return None
+
+    def rate_limit_key(self, limit_name, input_output, username, tenant_id):
+        if limit_name == "client_ip":
+            client_ip = input_output.get_client_ip()
+            return json.dumps([limit_name, client_ip]) if client_ip else None
+        if limit_name == "tenant":
+            return json.dumps([limit_name, tenant_id])
+        # usernames are case-insensitive more often than not, so don't let a change in case get a fresh bucket
+        return json.dumps([limit_name, tenant_id, str(username).strip().lower()])
+
+    def lockout_key(self, user):
+        tenant_id_column_name = self._plan["tenant_id_column_name"]
+        return json.dumps(
+            [
+                user.get(tenant_id_column_name) if tenant_id_column_name else None,
+                user.get(self._plan["username_column_name"]),
+            ]
         )
-        failed_attempts = failed_attempts.where("created_at>" + threshold_time.strftime("%Y-%m-%d %H:%M:%S"))
-        return len(failed_attempts) >= self.configuration("account_lockout_failed_attempts_threshold")
+
+    def lockout_window_seconds(self):
+        return self._plan["lockout_window_seconds"]
 
     def request_data(self, input_output, required=True):
         # make sure we don't drop any data along the way, because the input validation
         # needs to return an error for unexpected data.
-        column_map = {
-            self.configuration("username_column_name"): self.auto_case_column_name(
-                self.configuration("username_column_name"), True
-            ),
-            self.configuration("password_column_name"): self.auto_case_column_name(
-                self.configuration("password_column_name"), True
-            ),
-        }
+        column_map = self._plan["column_map"]
         mapped_data = {}
         for key, value in input_output.request_data(required=required).items():
             mapped_data[column_map.get(key, key)] = value
         return mapped_data
 
     def _find_input_errors(self, model, request_data, input_output):
+        plan = self._plan
         input_errors = {}
-        allowed_column_names = [
-            self.configuration("username_column_name"),
-            self.configuration("password_column_name"),
-        ]
-        for extra_column in set(request_data.keys()) - set(allowed_column_names):
+        for extra_column in request_data.keys() - plan["allowed_column_names"]:
             input_errors[extra_column] = "Input column '{extra_column}' is not an allowed column."
-        for column_name in allowed_column_names:
+        for column in plan["input_columns"]:
             input_errors = {
                 **input_errors,
-                **self._columns[column_name].input_errors(model, request_data),
+                **column.input_errors(model, request_data),
             }
-        input_error_callable = self.configuration("input_error_callable")
+        input_error_callable = plan["input_error_callable"]
         if input_error_callable:
-            more_input_errors = self._di.call_function(
-                input_error_callable,
-                input_data=request_data,
-                request_data=request_data,
-                input_output=input_output,
-                routing_data=input_output.routing_data(),
-                authorization_data=input_output.get_authorization_data(),
+            more_input_errors = input_error_callable(
+                {
+                    "input_data": request_data,
+                    "request_data": request_data,
+                    "input_output": input_output,
+                    "routing_data": (
+                        input_output.routing_data() if input_error_callable.takes("routing_data") else None
+                    ),
+                    "authorization_data": (
+                        input_output.get_authorization_data()
+                        if input_error_callable.takes("authorization_data")
+                        else None
+                    ),
+                }
             )
             if type(more_input_errors) != dict:
                 raise ValueError(
                     "The input error callable, '"
-                    + str(input_error_callable)
+                    + str(input_error_callable.callable)
                     + "', did not return a dictionary as required"
                 )
             input_errors = {
@@ -426,25 +856,22 @@ class PasswordLogin(KeyBase):
         return input_errors
 
     def get_jwt_claims(self, user):
-        if self.configuration("claims_callable"):
-            claims = self._di.call_function(self.configuration("claims_callable"), user=user)
-        else:
-            claims = {
-                claim_column: user.get(claim_column) for claim_column in self.configuration("claims_column_names")
-            }
-
+        plan = self._plan
+        claims = plan["claims"](user)
         now = self._datetime.datetime.now(self._datetime.timezone.utc)
         return {
-            "aud": self.configuration("audience"),
-            "iss": self.configuration("issuer"),
-            "exp": int((now + datetime.timedelta(seconds=self.configuration("jwt_lifetime_seconds"))).timestamp()),
+            "aud": plan["audience"],
+            "iss": plan["issuer"],
+            "exp": int((now + plan["jwt_lifetime"]).timestamp()),
             **claims,
             "iat": int(now.timestamp()),
         }
 
-    def audit(self, user, action_name, data=None, record_data=None):
-        if not self.configuration("audit"):
+    def audit(self, user, action_name, data=None, record_data=None, buffered=True):
+        audit_column = self._plan["audit_column"]
+        if audit_column is None:
             return
-        self._columns[self.configuration("audit_column_name")].record(
-            user, action_name, data=data, record_data=record_data
-        )
+        if buffered and self._plan["buffered_audit"]:
+            self.audit_writer.record(audit_column, user, action_name, data=data, record_data=record_data)
+        else:
+            audit_column.record(user, action_name, data=data, record_data=record_data)
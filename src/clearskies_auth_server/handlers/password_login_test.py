@@ -1,17 +1,29 @@
 import datetime
+import os
+import tempfile
+import json as json_module
 from jose import jwt
 from collections import OrderedDict
+import threading
 import unittest
 from unittest.mock import MagicMock, call
 from types import SimpleNamespace
 from jwcrypto import jwk
+from jwcrypto import jwt as jwcrypto_jwt
 from .key_base_test_helper import KeyBaseTestHelper
 from .password_login import PasswordLogin
 import clearskies
 from clearskies.contexts import test
+from clearskies.mocks import InputOutput
 from clearskies.column_types import audit, email, json, string, created, updated
+from clearskies.column_types import datetime as datetime_column
 from clearskies.input_requirements import required
 from ..column_types import password
+from ..audits import AuditWriter
+from ..hashing import HashingExecutor
+from ..metrics import MetricsRegistry
+from ..rate_limits import RateLimiter, SqliteRateLimiter
+from ..refresh_tokens import RefreshTokenStore
 
 
 class AuditRecord(clearskies.Model):
@@ -47,6 +59,60 @@ class User(clearskies.Model):
         )
 
 
+class RefreshToken(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("token_hash"),
+                string("user_id"),
+                string("family_id"),
+                datetime_column("expires_at"),
+                datetime_column("used_at"),
+                datetime_column("revoked_at"),
+            ]
+        )
+
+
+class ExecutorUser(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email", input_requirements=[required()]),
+                password("password", input_requirements=[required()], use_hashing_executor=True),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class CasedUser(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email_address", input_requirements=[required()]),
+                password("password", input_requirements=[required()]),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class LegacyLogin(PasswordLogin):
+    def create_jwt(self, user, audit_extra_data=None, record_data=None):
+        [token, jwt_claims] = super().create_jwt(user, audit_extra_data=audit_extra_data, record_data=record_data)
+        jwt_claims = {**jwt_claims, "legacy": True}
+        token = jwcrypto_jwt.JWT(header=json_module.loads(token.header), claims=jwt_claims)
+        token.make_signed_token(self.get_signing_key(self.configuration("path_to_private_keys")))
+        return [token, jwt_claims]
+
+
 class PasswordLoginTest(KeyBaseTestHelper):
     def setUp(self):
         super().setUp()
@@ -103,6 +169,43 @@ class PasswordLoginTest(KeyBaseTestHelper):
         self.assertEquals("cmancone@example.com", jwt_claims["email"])
         self.assertEquals(["create", "login"], [audit.action for audit in self.user.audit])
 
+    def test_create_jwt(self):
+        # create_jwt still hands back a jwcrypto JWT, signed the same way as the tokens in our responses
+        self.login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        [token, jwt_claims] = self.login.handler.create_jwt(self.user)
+        self.assertIsInstance(token, jwcrypto_jwt.JWT)
+        self.assertEqual({"alg": "RS256", "typ": "JWT", "kid": self.key_id}, json_module.loads(token.header))
+        self.assertEqual(self.login.handler.create_signed_jwt(jwt_claims), token.serialize())
+        self.assertEquals(["create", "login", "login"], [audit.action for audit in self.user.audit])
+
+    def test_create_jwt_override(self):
+        login = test(
+            {
+                "handler_class": LegacyLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[User, AuditRecord],
+        )
+        login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertEquals(200, response[1])
+        jwt_claims = jwt.decode(
+            response[0]["token"],
+            self.public_keys[self.key_id],
+            algorithms=["RS256"],
+            audience="example.com",
+            issuer="https://example.com",
+        )
+        self.assertTrue(jwt_claims["legacy"])
+
     def test_failure_non_user(self):
         response = self.login(
             body={
@@ -283,3 +386,528 @@ class PasswordLoginTest(KeyBaseTestHelper):
         self.assertEquals(200, response[1])
         self.assertEquals("input_errors", response[0]["status"])
         self.assertEquals("not gonna happen", response[0]["input_errors"]["email"])
+
+    def test_lockout_uses_lockout_store(self):
+        lockout_store = SimpleNamespace(
+            count_failures=MagicMock(return_value=10),
+            record_failure=MagicMock(),
+        )
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "account_lockout_source": "lockout_store",
+                },
+            },
+            bindings={"secrets": self.secrets, "lockout_store": lockout_store},
+            binding_classes=[User, AuditRecord],
+        )
+        login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertIn("lockout", response[0]["input_errors"]["email"])
+        lockout_store.count_failures.assert_called_once_with('[null, "cmancone@example.com"]', 300)
+
+        lockout_store.count_failures.return_value = 0
+        response = login(body={"email": "cmancone@example.com", "password": "wrongpassword"})
+        lockout_store.record_failure.assert_called_once_with('[null, "cmancone@example.com"]', 300)
+
+    def test_lockout_counts_audit_table(self):
+        lockout_store = SimpleNamespace(count_failures=MagicMock(), record_failure=MagicMock())
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "buffered_audit": True,
+                },
+            },
+            bindings={
+                "secrets": self.secrets,
+                "lockout_store": lockout_store,
+                "audit_writer": AuditWriter().configure(flush_interval=60),
+            },
+            binding_classes=[User, AuditRecord],
+        )
+        user = login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        # failures recorded by other processes count too
+        audit_column = user.columns()["audit"]
+        for i in range(9):
+            audit_column.record(user, "failed_login")
+        login(body={"email": "cmancone@example.com", "password": "wrongpassword"})
+
+        # the failed login skipped the audit buffer so that the lockout could see it
+        self.assertEquals(["create"] + ["failed_login"] * 10, [audit.action for audit in user.audit])
+        response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertIn("lockout", response[0]["input_errors"]["email"])
+        lockout_store.count_failures.assert_not_called()
+        lockout_store.record_failure.assert_not_called()
+
+    def test_lockout_source_configuration(self):
+        with self.assertRaisesRegex(ValueError, "'account_lockout_source' must be either 'audit' or 'lockout_store'"):
+            test(
+                {
+                    "handler_class": PasswordLogin,
+                    "handler_config": {
+                        "claims_column_names": ["email"],
+                        "path_to_private_keys": "/path/to/private",
+                        "path_to_public_keys": "/path/to/public",
+                        "user_model_class": User,
+                        "issuer": "https://example.com",
+                        "audience": "example.com",
+                        "account_lockout_source": "memory",
+                    },
+                },
+                bindings={"secrets": self.secrets},
+                binding_classes=[User, AuditRecord],
+            )()
+
+    def test_lockout_disabled(self):
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "account_lockout": False,
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[User, AuditRecord],
+        )
+        login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        for i in range(11):
+            login(body={"email": "cmancone@example.com", "password": "wrongpassword"})
+        response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertEquals(200, response[1])
+        self.assertIn("token", response[0])
+
+    def test_buffered_audit(self):
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "buffered_audit": True,
+                    "account_lockout_source": "lockout_store",
+                },
+            },
+            bindings={"secrets": self.secrets, "audit_writer": AuditWriter().configure(flush_interval=60)},
+            binding_classes=[User, AuditRecord],
+        )
+        user = login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        for i in range(10):
+            login(body={"email": "cmancone@example.com", "password": "wrongpassword"})
+
+        # the lockout doesn't depend on the audit records being written
+        response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertIn("lockout", response[0]["input_errors"]["email"])
+        self.assertEquals(["create"], [audit.action for audit in user.audit])
+
+        audit_writer = login.build("audit_writer")
+        audit_writer.flush()
+        self.assertEquals(
+            ["create"] + ["failed_login"] * 10 + ["account_lockout"], [audit.action for audit in user.audit]
+        )
+        self.assertEquals(11, audit_writer.stats()["flushed"])
+        metrics_registry = login.build("metrics_registry")
+        metrics_registry.collect()
+        audit_records = metrics_registry.counter("auth_server_audit_records_total", "", ("result",))
+        self.assertEquals(11, audit_records.value(("flushed",)))
+
+    def test_hashing_overloaded(self):
+        hashing_executor = HashingExecutor().configure(max_concurrency=1, max_queue=0, retry_after=2)
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": ExecutorUser,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                },
+            },
+            bindings={"secrets": self.secrets, "hashing_executor": hashing_executor},
+            binding_classes=[ExecutorUser, AuditRecord],
+        )
+        login.build("executor_user").create({"email": "cmancone@example.com", "password": "crappypassword"})
+
+        # tie up the only slot
+        finish = threading.Event()
+        started = threading.Event()
+
+        def slow_hash(password):
+            started.set()
+            finish.wait(5)
+
+        thread = threading.Thread(
+            target=hashing_executor.run, args=(SimpleNamespace(hash=slow_hash), "hash", "password")
+        )
+        thread.start()
+        started.wait(5)
+        input_output = InputOutput()
+        response = login(
+            body={"email": "cmancone@example.com", "password": "crappypassword"}, input_output=input_output
+        )
+        finish.set()
+        thread.join()
+        self.assertEquals(503, response[1])
+        self.assertEquals("client_error", response[0]["status"])
+        self.assertEquals("2", input_output.response["headers"]["RETRY-AFTER"])
+
+        response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertEquals(200, response[1])
+        self.assertEquals(1, hashing_executor.stats()["rejected"])
+
+    def capture_user_queries(self, context):
+        memory_backend = context.build("users")._backend
+        records = memory_backend.records
+        user_queries = []
+
+        def capture(configuration, model, next_page_data=None):
+            if configuration["table_name"] == "users":
+                user_queries.append(configuration)
+            return records(configuration, model, next_page_data=next_page_data)
+
+        memory_backend.records = capture
+        return user_queries
+
+    def test_select_user_columns(self):
+        # the whole user is loaded unless you ask for less
+        user_queries = self.capture_user_queries(self.login)
+        response = self.login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertEquals(200, response[1])
+        self.assertTrue(user_queries[0]["select_all"])
+        self.assertEquals([], user_queries[0]["selects"])
+
+    def test_select_all_user_columns_for_callables(self):
+        def claims(user):
+            return {"email": user.email}
+
+        secrets = SimpleNamespace(
+            get=lambda path, silent_if_not_found=False: json_module.dumps(
+                self.private_keys if "private" in path else self.public_keys
+            )
+        )
+        for extra_config, selects in [
+            (
+                {"claims_column_names": ["email"], "select_user_columns": True},
+                ["users.id", "users.email", "users.password"],
+            ),
+            ({"claims_callable": claims, "select_user_columns": True}, []),
+            (
+                {"claims_callable": claims, "extra_user_column_names": ["email"], "select_user_columns": True},
+                ["users.id", "users.email", "users.password"],
+            ),
+        ]:
+            login = test(
+                {
+                    "handler_class": PasswordLogin,
+                    "handler_config": {
+                        "path_to_private_keys": "/path/to/private",
+                        "path_to_public_keys": "/path/to/public",
+                        "user_model_class": User,
+                        "issuer": "https://example.com",
+                        "audience": "example.com",
+                        **extra_config,
+                    },
+                },
+                bindings={"secrets": secrets},
+                binding_classes=[User, AuditRecord],
+            )
+            login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+            user_queries = self.capture_user_queries(login)
+            response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+            self.assertEquals(200, response[1])
+            self.assertEquals(not selects, user_queries[0]["select_all"])
+            self.assertEquals(selects, user_queries[0]["selects"])
+
+    def test_request_plan(self):
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": CasedUser,
+                    "username_column_name": "email_address",
+                    "claims_column_names": ["email_address"],
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "internal_casing": "snake_case",
+                    "external_casing": "camelCase",
+                    "audit": False,
+                    "account_lockout": False,
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[CasedUser, AuditRecord],
+        )
+        login.build("cased_users").create({"email_address": "cmancone@example.com", "password": "crappypassword"})
+        response = login(body={"emailAddress": "cmancone@example.com", "password": "crappypassword"})
+        self.assertEquals(200, response[1])
+        jwt_claims = jwt.decode(
+            response[0]["token"],
+            self.public_keys[self.key_id],
+            algorithms=["RS256"],
+            audience="example.com",
+            issuer="https://example.com",
+        )
+        self.assertEquals("cmancone@example.com", jwt_claims["email_address"])
+
+        handler = self.login.build(PasswordLogin)
+        handler.configure(
+            {
+                "path_to_private_keys": "/path/to/private",
+                "path_to_public_keys": "/path/to/public",
+                "user_model_class": User,
+                "claims_column_names": ["email"],
+                "issuer": "https://example.com",
+                "audience": "example.com",
+                "authentication": clearskies.authentication.public(),
+            }
+        )
+        self.assertEquals(frozenset(["email", "password"]), handler._plan["allowed_column_names"])
+        with self.assertRaises(TypeError):
+            handler._plan["audience"] = "somewhere-else"
+
+    def test_timing_sink(self):
+        recorded = []
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "timing_sink": lambda timings: recorded.append(timings.as_dict()),
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[User, AuditRecord],
+        )
+        login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        login(body={"email": "cmancone@example.com", "password": "wrongpassword"})
+        login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        login(body={"email": "nobody@example.com", "password": "crappypassword"})
+
+        self.assertEquals(["invalid_password", "success", "unknown_user"], [timing["outcome"] for timing in recorded])
+        self.assertEquals(
+            ["input", "user_lookup", "lockout_check", "password_verify", "audit"], list(recorded[0]["phases"].keys())
+        )
+        self.assertEquals(
+            ["input", "user_lookup", "lockout_check", "password_verify", "audit", "sign"],
+            list(recorded[1]["phases"].keys()),
+        )
+        self.assertEquals(["input", "user_lookup"], list(recorded[2]["phases"].keys()))
+        for timing in recorded:
+            self.assertEquals("PasswordLogin", timing["handler"])
+            self.assertAlmostEqual(sum(timing["phases"].values()), timing["total"], places=3)
+
+    def test_rate_limits(self):
+        metrics_registry = MetricsRegistry()
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "rate_limits": {
+                        "client_ip": {"requests": 4, "per_seconds": 60},
+                        "username": {"requests": 1, "per_seconds": 60, "burst": 2},
+                    },
+                    "rate_limits_per_process": True,
+                },
+            },
+            bindings={
+                "secrets": self.secrets,
+                "metrics_registry": metrics_registry,
+                "rate_limiter": RateLimiter(datetime),
+            },
+            binding_classes=[User, AuditRecord],
+        )
+        users = login.build("users")
+        users.create({"email": "cmancone@example.com", "password": "crappypassword"})
+
+        def attempt(email, client_ip="10.0.0.1"):
+            input_output = InputOutput(client_ip=client_ip, body={"email": email, "password": "wrongpassword"})
+            return (login(input_output=input_output), input_output.response["headers"])
+
+        self.assertEquals(200, attempt("cmancone@example.com")[0][1])
+        self.assertEquals(200, attempt("CMancone@example.com")[0][1])
+        # the username is out of tokens (regardless of case), and we didn't even look up the user
+        ((response, status_code), headers) = attempt("cmancone@example.com ")
+        self.assertEquals(429, status_code)
+        self.assertEquals("client_error", response["status"])
+        self.assertEquals("60", headers["RETRY-AFTER"])
+        # (the memory backend is case-sensitive, so only the first attempt found the user)
+        audit_actions = [audit.action for audit in users.find("email=cmancone@example.com").audit]
+        self.assertEquals(1, audit_actions.count("failed_login"))
+
+        # every attempt counts against the client IP, including the one the username limit refused
+        self.assertEquals(200, attempt("other@example.com")[0][1])
+        self.assertEquals(429, attempt("another@example.com")[0][1])
+        self.assertEquals(200, attempt("another@example.com", client_ip="10.0.0.2")[0][1])
+
+        rate_limited = metrics_registry.counter("auth_server_rate_limited_total", "", ("handler", "limit"))
+        self.assertEquals(1, rate_limited.value(("PasswordLogin", "username")))
+        self.assertEquals(1, rate_limited.value(("PasswordLogin", "client_ip")))
+        logins = metrics_registry.counter("auth_server_logins_total", "", ("handler", "outcome"))
+        self.assertEquals(2, logins.value(("PasswordLogin", "rate_limited")))
+
+    def test_rate_limits_configuration(self):
+        for rate_limits, message in [
+            ({"cookie": {"requests": 1, "per_seconds": 1}}, "unknown rate limit 'cookie'"),
+            ({"client_ip": {"requests": 1}}, "'per_seconds' for the 'client_ip' rate limit"),
+            ({"client_ip": {"requests": 0.5, "per_seconds": 1}}, "at least one request"),
+            ({"tenant": {"requests": 1, "per_seconds": 1}}, "tenant_id_column_name"),
+        ]:
+            with self.assertRaises(ValueError) as context:
+                test(
+                    {
+                        "handler_class": PasswordLogin,
+                        "handler_config": {
+                            "claims_column_names": ["email"],
+                            "path_to_private_keys": "/path/to/private",
+                            "path_to_public_keys": "/path/to/public",
+                            "user_model_class": User,
+                            "issuer": "https://example.com",
+                            "audience": "example.com",
+                            "rate_limits": rate_limits,
+                        },
+                    },
+                    bindings={"secrets": self.secrets},
+                    binding_classes=[User, AuditRecord],
+                )()
+            self.assertIn(message, str(context.exception))
+
+    def test_rate_limits_need_a_shared_limiter(self):
+        config = {
+            "claims_column_names": ["email"],
+            "path_to_private_keys": "/path/to/private",
+            "path_to_public_keys": "/path/to/public",
+            "user_model_class": User,
+            "issuer": "https://example.com",
+            "audience": "example.com",
+            "rate_limits": {"client_ip": {"requests": 4, "per_seconds": 60}},
+        }
+        with self.assertRaisesRegex(ValueError, "each process would allow the full limit"):
+            test(
+                {"handler_class": PasswordLogin, "handler_config": config},
+                bindings={"secrets": self.secrets},
+                binding_classes=[User, AuditRecord],
+            )()
+
+        with tempfile.TemporaryDirectory() as directory:
+            login = test(
+                {"handler_class": PasswordLogin, "handler_config": config},
+                bindings={
+                    "secrets": self.secrets,
+                    "rate_limiter": SqliteRateLimiter(os.path.join(directory, "rate_limits.db")),
+                },
+                binding_classes=[User, AuditRecord],
+            )
+            self.assertEquals(200, login(body={"email": "cmancone@example.com", "password": "crappypassword"})[1])
+
+    def test_metrics(self):
+        metrics_registry = MetricsRegistry()
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "account_lockout_failed_attempts_threshold": 1,
+                },
+            },
+            bindings={"secrets": self.secrets, "metrics_registry": metrics_registry},
+            binding_classes=[User, AuditRecord],
+        )
+        users = login.build("users")
+        users.create({"email": "cmancone@example.com", "password": "crappypassword"})
+        users.create({"email": "other@example.com", "password": "crappypassword"})
+        login(body={"email": "cmancone@example.com", "password": "wrongpassword"})
+        login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        login(body={"email": "other@example.com", "password": "crappypassword"})
+
+        logins = metrics_registry.counter("auth_server_logins_total", "", ("handler", "outcome"))
+        self.assertEquals(1, logins.value(("PasswordLogin", "invalid_password")))
+        self.assertEquals(1, logins.value(("PasswordLogin", "account_locked")))
+        self.assertEquals(1, logins.value(("PasswordLogin", "success")))
+        lockouts = metrics_registry.counter("auth_server_lockouts_total", "", ("handler",))
+        self.assertEquals(1, lockouts.value(("PasswordLogin",)))
+        tokens_minted = metrics_registry.counter("auth_server_tokens_minted_total", "", ("kid",))
+        self.assertEquals(1, tokens_minted.value((self.key_id,)))
+        [bucket_counts, total] = metrics_registry.histogram(
+            "auth_server_password_hash_seconds", "", ("operation",)
+        ).value(("verify_and_update",))
+        self.assertEquals(2, sum(bucket_counts))
+
+    def test_refresh_token(self):
+        login = test(
+            {
+                "handler_class": PasswordLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "refresh_token_model_class": RefreshToken,
+                    "refresh_token_lifetime_seconds": 3600,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[User, AuditRecord, RefreshToken],
+        )
+        user = login.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        response = login(body={"email": "cmancone@example.com", "password": "crappypassword"})
+        self.assertEquals(200, response[1])
+        # the JWT and the refresh token are timed separately, so they can land on either side of a second
+        self.assertAlmostEqual(
+            response[0]["refresh_token_expires_at"] - 3600, response[0]["expires_at"] - 86400, delta=1
+        )
+
+        # only the hash is stored
+        refresh_tokens = login.build("refresh_tokens")
+        self.assertEquals(1, len(refresh_tokens))
+        self.assertEquals([], list(refresh_tokens.where(f"token_hash={response[0]['refresh_token']}")))
+        refresh_token = login.build(RefreshTokenStore).find(response[0]["refresh_token"])
+        self.assertEquals(str(user.id), refresh_token.user_id)
+
+        # and every login starts a new family
+        second = login(body={"email": "cmancone@example.com", "password": "crappypassword"})[0]["refresh_token"]
+        self.assertNotEquals(refresh_token.family_id, login.build(RefreshTokenStore).find(second).family_id)
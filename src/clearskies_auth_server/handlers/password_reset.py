@@ -3,6 +3,9 @@ import inspect
 from clearskies.handlers.exceptions import InputError
 from clearskies.handlers import Update
 from clearskies.column_types import Audit, String
+from ..hashing import HashingOverloaded
+from ..refresh_tokens import RefreshTokenStore
+from .user_columns import backend_column_names, select_user_columns
 
 
 class PasswordReset(Update):
@@ -24,6 +27,8 @@ class PasswordReset(Update):
         "audit": True,
         "audit_column_name": None,
         "audit_action_name_successful_reset": "password_reset",
+        "select_user_columns": False,
+        "refresh_token_model_class": None,
     }
 
     _required_configurations = [
@@ -34,6 +39,28 @@ class PasswordReset(Update):
         super().__init__(di)
         self._columns = None
         self._datetime = datetime
+        self._user_column_names = None
+
+    def configure(self, configuration):
+        super().configure(configuration)
+        # finding the user for a reset key only takes a couple columns (the update loads the whole user afterwards)
+        if self.configuration("select_user_columns"):
+            self._user_column_names = backend_column_names(
+                self._columns,
+                [
+                    self.users.id_column_name,
+                    self.configuration("reset_key_column_name"),
+                    self.configuration("reset_expiration_column_name"),
+                ],
+            )
+
+    def __call__(self, input_output):
+        # setting the new password means hashing it, which the hashing executor may turn down if it's too busy
+        try:
+            return super().__call__(input_output)
+        except HashingOverloaded as overloaded:
+            input_output.set_header("retry-after", str(overloaded.retry_after))
+            return self.error(input_output, str(overloaded), overloaded.status_code)
 
     def _check_configuration(self, configuration):
         user_model_class = configuration.get("user_model_class")
@@ -72,6 +99,17 @@ class PasswordReset(Update):
                         f"{error_prefix} the provided column name for {config_name}, '{column_name}', does not exist in the user model '{user_model_class.__name__}'"
                     )
 
+        refresh_token_model_class = configuration.get("refresh_token_model_class")
+        if refresh_token_model_class:
+            if not inspect.isclass(refresh_token_model_class) or not hasattr(refresh_token_model_class, "where"):
+                raise ValueError(f"{error_prefix} 'refresh_token_model_class' should be a clearskies model class")
+            missing = RefreshTokenStore.missing_column_names(refresh_token_model_class, self._di)
+            if missing:
+                raise ValueError(
+                    f"{error_prefix} the refresh token model, '{refresh_token_model_class.__name__}', is missing the required column(s) "
+                    + ", ".join(missing)
+                )
+
         if configuration.get("audit"):
             audit_column_name = configuration.get("audit_column_name")
             if audit_column_name not in self._columns:
@@ -122,7 +160,9 @@ class PasswordReset(Update):
                 "Error with PasswordReset handler: the reset key wasn't found in the routing data, which usually means I'm misconfigured"
             )
 
-        user = self.users.find(f"{reset_key_column_name}=" + routing_data.get(reset_key_source_key_name))
+        user = select_user_columns(self.users, self._user_column_names).find(
+            f"{reset_key_column_name}=" + routing_data.get(reset_key_source_key_name)
+        )
         if not user.exists:
             return None
 
@@ -138,6 +178,23 @@ class PasswordReset(Update):
 
         return user.get(self.users.id_column_name)
 
+    def _model_as_json(self, model, input_output):
+        # this only happens once the new password has been saved
+        self.password_changed(model)
+        return super()._model_as_json(model, input_output)
+
+    def password_changed(self, user):
+        """
+        Revokes the user's refresh tokens, so that a stolen one doesn't outlive the password reset.
+        """
+        refresh_token_model_class = self.configuration("refresh_token_model_class")
+        if not refresh_token_model_class:
+            return
+        refresh_tokens = RefreshTokenStore(
+            self._di.build(refresh_token_model_class, cache=True), self._datetime, self._di
+        )
+        refresh_tokens.revoke_user(user.get(user.id_column_name))
+
     def _get_writeable_columns(self):
         """
         We want to make sure that our reset key is cleared after we save.
@@ -1,8 +1,12 @@
 import secrets
 import inspect
+from types import MappingProxyType
 from clearskies.handlers.exceptions import InputError
 from clearskies.handlers.base import Base
 from clearskies.column_types import Audit
+from ..audits import AuditWriter
+from ..metrics import MetricsRegistry, auth_server_metrics
+from .call_plan import call_plan
 
 
 class PasswordResetRequest(Base):
@@ -18,6 +22,7 @@ class PasswordResetRequest(Base):
         "audit": True,
         "audit_column_name": "audit",
         "audit_action_name": "request_password_reset",
+        "buffered_audit": False,
         "users": None,
     }
 
@@ -29,6 +34,21 @@ class PasswordResetRequest(Base):
         super().__init__(di)
         self._columns = None
         self._datetime = datetime
+        self._audit_writer = None
+        self._plan = None
+
+    def configure(self, configuration):
+        super().configure(configuration)
+        self._plan = MappingProxyType(self.compile_plan())
+
+    def compile_plan(self):
+        """
+        Returns what the request path needs to know about the configuration (see PasswordLogin).
+        """
+        return {
+            "where": call_plan(self._di, self.configuration("where")),
+            "input_error_callable": call_plan(self._di, self.configuration("input_error_callable")),
+        }
 
     def _check_configuration(self, configuration):
         super()._check_configuration(configuration)
@@ -116,15 +136,17 @@ class PasswordResetRequest(Base):
 
         username_column_name = self.configuration("username_column_name")
         users = self.users
-        if self.configuration("where"):
-            users = self._di.call_function(
-                self.configuration("where"),
-                users=users,
-                input_output=input_output,
-                request_data=request_data,
-                routing_data=input_output.routing_data(),
+        where = self._plan["where"]
+        if where:
+            users = where(
+                {
+                    "users": users,
+                    "input_output": input_output,
+                    "request_data": request_data,
+                    "routing_data": input_output.routing_data() if where.takes("routing_data") else None,
+                }
             )
-        user = self.users.find(f"{username_column_name}=" + request_data[username_column_name])
+        user = users.find(f"{username_column_name}=" + request_data[username_column_name])
 
         # no user found.  Don't return data since that gives away if the user exists in the system.
         if not user.exists:
@@ -168,20 +190,27 @@ class PasswordResetRequest(Base):
                 **input_errors,
                 **self._columns[column_name].input_errors(model, request_data),
             }
-        input_error_callable = self.configuration("input_error_callable")
+        input_error_callable = self._plan["input_error_callable"]
         if input_error_callable:
-            more_input_errors = self._di.call_function(
-                input_error_callable,
-                input_data=request_data,
-                request_data=request_data,
-                input_output=input_output,
-                routing_data=input_output.routing_data(),
-                authorization_data=input_output.get_authorization_data(),
+            more_input_errors = input_error_callable(
+                {
+                    "input_data": request_data,
+                    "request_data": request_data,
+                    "input_output": input_output,
+                    "routing_data": (
+                        input_output.routing_data() if input_error_callable.takes("routing_data") else None
+                    ),
+                    "authorization_data": (
+                        input_output.get_authorization_data()
+                        if input_error_callable.takes("authorization_data")
+                        else None
+                    ),
+                }
             )
             if type(more_input_errors) != dict:
                 raise ValueError(
                     "The input error callable, '"
-                    + str(input_error_callable)
+                    + str(input_error_callable.callable)
                     + "', did not return a dictionary as required"
                 )
             input_errors = {
@@ -190,7 +219,19 @@ class PasswordResetRequest(Base):
             }
         return input_errors
 
+    @property
+    def audit_writer(self):
+        if self._audit_writer is None:
+            self._audit_writer = self._di.build(AuditWriter, cache=True)
+            metrics_registry = self._di.build(MetricsRegistry, cache=True)
+            auth_server_metrics.watch_audit_writer(metrics_registry, self._audit_writer)
+        return self._audit_writer
+
     def audit(self, user, action_name, data=None):
         if not self.configuration("audit"):
             return
-        self._columns[self.configuration("audit_column_name")].record(user, action_name, data=None)
+        audit_column = self._columns[self.configuration("audit_column_name")]
+        if self.configuration("buffered_audit"):
+            self.audit_writer.record(audit_column, user, action_name, data=None)
+        else:
+            audit_column.record(user, action_name, data=None)
@@ -90,3 +90,22 @@ class PasswordResetRequestTest(unittest.TestCase):
         user = self.users.find(f"id={self.user.id}")
         self.assertEquals(None, user.reset_key)
         self.assertEquals(["create"], [audit.action for audit in user.audit])
+
+    def test_where(self):
+        login = test(
+            {
+                "handler_class": PasswordResetRequest,
+                "handler_config": {
+                    "user_model_class": User,
+                    "where": lambda users, request_data: users.where("email=someone-else@example.com"),
+                },
+            },
+            binding_classes=[User, AuditRecord],
+        )
+        users = login.build("users")
+        user = users.create({"email": "cmancone@example.com", "password": "crappypassword"})
+        response = login(body={"email": "cmancone@example.com"})
+        self.assertEquals(200, response[1])
+
+        user = users.find(f"id={user.id}")
+        self.assertEquals(None, user.reset_key)
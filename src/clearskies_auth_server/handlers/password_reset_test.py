@@ -0,0 +1,102 @@
+import datetime
+import unittest
+from collections import OrderedDict
+from .password_reset import PasswordReset
+from ..refresh_tokens import RefreshTokenStore
+import clearskies
+from clearskies.contexts import test
+from clearskies.column_types import audit, email, json, string, created, updated
+from clearskies.column_types import datetime as datetime_column
+from ..column_types import password
+
+
+class AuditRecord(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("class"),
+                string("resource_id"),
+                string("action"),
+                json("data"),
+                created("created_at"),
+                updated("updated_at"),
+            ]
+        )
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email"),
+                password("password"),
+                string("reset_key"),
+                datetime_column("reset_key_expiration"),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class RefreshToken(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("token_hash"),
+                string("user_id"),
+                string("family_id"),
+                datetime_column("expires_at"),
+                datetime_column("used_at"),
+                datetime_column("revoked_at"),
+            ]
+        )
+
+
+class PasswordResetTest(unittest.TestCase):
+    def setUp(self):
+        self.reset = test(
+            {
+                "handler_class": PasswordReset,
+                "handler_config": {
+                    "user_model_class": User,
+                    "refresh_token_model_class": RefreshToken,
+                    "readable_columns": ["email"],
+                },
+            },
+            binding_classes=[User, AuditRecord, RefreshToken],
+        )
+        self.user = self.reset.build("users").create(
+            {
+                "email": "cmancone@example.com",
+                "password": "crappypassword",
+                "reset_key": "asdfer",
+                "reset_key_expiration": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
+            }
+        )
+        self.store = self.reset.build(RefreshTokenStore)
+
+    def test_revokes_refresh_tokens(self):
+        (raw_token, expires_at) = self.store.issue(self.user.id, 3600)
+        (other_token, expires_at) = self.store.issue("someone-else", 3600)
+        response = self.reset(
+            body={"password": "newpassword", "repeat_password": "newpassword"}, routing_data={"reset_key": "asdfer"}
+        )
+        self.assertEqual("success", response[0]["status"])
+        self.assertTrue(self.store.find(raw_token).revoked_at)
+        self.assertFalse(self.store.find(other_token).revoked_at)
+
+    def test_failed_reset_keeps_refresh_tokens(self):
+        (raw_token, expires_at) = self.store.issue(self.user.id, 3600)
+        response = self.reset(
+            body={"password": "newpassword", "repeat_password": "newpassword"}, routing_data={"reset_key": "wrong"}
+        )
+        self.assertEqual(404, response[1])
+        self.assertFalse(self.store.find(raw_token).revoked_at)
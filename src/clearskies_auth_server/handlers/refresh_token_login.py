@@ -0,0 +1,183 @@
+from .password_login import PasswordLogin
+from .user_columns import select_user_columns
+
+
+class RefreshTokenLogin(PasswordLogin):
+    """
+    Exchanges a refresh token for a new JWT (and a new refresh token), without going anywhere near the password.
+
+    Refresh tokens are issued by PasswordLogin and PasswordLessLinkLogin when they have a `refresh_token_model_class`,
+    and this handler needs the same model class.  The client sends the refresh token in the JSON body:
+
+    ```
+    {"refresh_token": "..."}
+    ```
+
+    and, if it's valid, gets back the same response as a login.  Every refresh token can only be used once: it's
+    marked as used and the response has its replacement, which expires at the same time (so, like SwitchTenant,
+    refreshing can't extend a session past `refresh_token_lifetime_seconds` after the login).  If a used token comes back, we assume it was stolen and
+    revoke every token descended from the same login (see RefreshTokenStore).  The token is claimed atomically before
+    the new one is issued, so if two requests bring the same token at the same moment, only one of them wins and the
+    other is treated as reuse.
+    """
+
+    _configuration_defaults = {
+        "user_model_class": "",
+        "refresh_token_model_class": "",
+        "refresh_token_lifetime_seconds": 2592000,
+        "refresh_token_key_name": "refresh_token",
+        "jwt_lifetime_seconds": 86400,
+        "issuer": "",
+        "audience": "",
+        "path_to_private_keys": "",
+        "path_to_public_keys": "",
+        "key_cache_duration": 7200,
+        "key_refresh_mode": "synchronous",
+        "claims_callable": None,
+        "claims_column_names": None,
+        "login_check_callables": [],
+        "audit": True,
+        "audit_column_name": "audit",
+        "audit_action_name_successful_login": "refresh",
+        "audit_action_name_failed_login": "failed_refresh",
+        "audit_action_name_token_reuse": "refresh_token_reuse",
+        "buffered_audit": False,
+        "select_user_columns": False,
+        "extra_user_column_names": [],
+        "timing_sink": None,
+        "users": None,
+    }
+
+    _required_configurations = [
+        "user_model_class",
+        "refresh_token_model_class",
+        "issuer",
+        "audience",
+        "path_to_private_keys",
+        "path_to_public_keys",
+    ]
+
+    def __init__(self, di, secrets, datetime):
+        super().__init__(di, secrets, datetime)
+        self._columns = None
+
+    def _my_configuration_checks(self, configuration):
+        error_prefix = "Invalid configuration for handler " + self.__class__.__name__ + ":"
+        self._check_required_configuration(configuration, error_prefix)
+        self._check_user_model_class_configuration(configuration, error_prefix)
+
+        self._columns = self._di.build(configuration.get("user_model_class")).columns()
+        self._check_claims_configuration(configuration, error_prefix)
+        self._check_audit_configuration(configuration, error_prefix)
+        self._check_login_check_callables(configuration, error_prefix)
+        self._check_timing_sink_configuration(configuration, error_prefix)
+        self._check_refresh_token_configuration(configuration, error_prefix)
+
+        refresh_token_key_name = configuration.get("refresh_token_key_name", "refresh_token")
+        if not refresh_token_key_name or not isinstance(refresh_token_key_name, str):
+            raise ValueError(f"{error_prefix} 'refresh_token_key_name' should be a non-empty string")
+
+    def compile_plan(self):
+        """
+        Returns everything that the request path needs to know about the configuration (see PasswordLogin).
+        """
+        return {
+            **self._compile_user_plan(),
+            **self._compile_claims_plan(),
+            **self._compile_audit_plan(),
+            **self._compile_refresh_token_plan(),
+            "refresh_token_key_name": self.configuration("refresh_token_key_name"),
+            "audit_action_name_token_reuse": self.configuration("audit_action_name_token_reuse"),
+            "tenant_id_column_name": None,
+            "account_lockout": False,
+        }
+
+    def attempt_login(self, input_output, timings):
+        plan = self._plan
+        refresh_tokens = plan["refresh_tokens"]
+        raw_token = self.get_refresh_token(input_output)
+        timings.mark("input")
+        if not raw_token or not isinstance(raw_token, str):
+            timings.outcome = "invalid_input"
+            return self.error(input_output, "Missing refresh token.", 400)
+
+        refresh_token = refresh_tokens.find(raw_token)
+        timings.mark("token_lookup")
+        if not refresh_token.exists:
+            timings.outcome = "unknown_token"
+            return self.invalid_refresh_token(input_output)
+        if refresh_token.get("revoked_at"):
+            timings.outcome = "revoked_token"
+            return self.invalid_refresh_token(input_output)
+
+        family_id = refresh_token.get("family_id")
+        user_id = refresh_token.get("user_id")
+        users = plan["login_users"]
+        user = select_user_columns(users, self._user_column_names).find(f"{users.id_column_name}={user_id}")
+        timings.mark("user_lookup")
+        if not user.exists:
+            refresh_tokens.revoke_family(family_id)
+            timings.outcome = "unknown_user"
+            return self.invalid_refresh_token(input_output)
+        audit_extra_data = {"user_id": user_id, "family_id": family_id}
+
+        # a token that has already been exchanged means that someone else has a copy of it
+        if refresh_token.get("used_at"):
+            return self.refresh_token_reused(input_output, user, family_id, audit_extra_data, timings)
+
+        if refresh_tokens.is_expired(refresh_token):
+            timings.outcome = "expired_token"
+            return self.invalid_refresh_token(input_output)
+
+        # developer-defined checks, e.g. for disabled accounts, which also end the session
+        for login_check_callable in plan["login_check_callables"]:
+            response = login_check_callable({"user": user, "input_output": input_output}, input_output=input_output)
+            if response:
+                timings.mark("login_checks")
+                refresh_tokens.revoke_family(family_id)
+                self.failed_login(user, data={"reason": response, **audit_extra_data})
+                timings.mark("audit")
+                timings.outcome = "login_check_failed"
+                return self.invalid_refresh_token(input_output)
+        if plan["login_check_callables"]:
+            timings.mark("login_checks")
+
+        # the check above is only a shortcut: this is what makes sure that the token is only exchanged once
+        claimed = refresh_tokens.claim(refresh_token)
+        timings.mark("claim")
+        if not claimed:
+            return self.refresh_token_reused(input_output, user, family_id, audit_extra_data, timings)
+        [token, jwt_claims] = self.create_token(user, audit_extra_data=audit_extra_data, timings=timings)
+        response_data = self.token_response_data(
+            user, token, jwt_claims, exchanged_refresh_token=refresh_token, timings=timings
+        )
+        timings.outcome = "success"
+
+        return self.respond_unstructured(input_output, response_data, 200)
+
+    def refresh_token_reused(self, input_output, user, family_id, audit_extra_data, timings):
+        plan = self._plan
+        plan["refresh_tokens"].revoke_family(family_id)
+        self.audit(
+            user,
+            plan["audit_action_name_token_reuse"],
+            data={"reason": "A refresh token was used twice, so its family was revoked", **audit_extra_data},
+        )
+        timings.mark("audit")
+        timings.outcome = "reused_token"
+        return self.invalid_refresh_token(input_output)
+
+    def invalid_refresh_token(self, input_output):
+        return self.error(input_output, "Invalid refresh token.", 401)
+
+    def get_refresh_token(self, input_output):
+        request_data = input_output.request_data(required=False)
+        return request_data.get(self._plan["refresh_token_key_name"]) if isinstance(request_data, dict) else None
+
+    def needed_user_column_names(self):
+        audit_column_name = self.configuration("audit_column_name") if self.configuration("audit") else None
+        return [
+            self.users.id_column_name,
+            *(self.configuration("claims_column_names") or []),
+            self._columns[audit_column_name].config("parent_id_column_name") if audit_column_name else None,
+        ]
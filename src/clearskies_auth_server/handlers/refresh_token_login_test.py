@@ -0,0 +1,208 @@
+import datetime as datetime_module
+from jose import jwt
+from collections import OrderedDict
+import unittest
+from unittest.mock import patch
+from .key_base_test_helper import KeyBaseTestHelper
+from .refresh_token_login import RefreshTokenLogin
+from ..refresh_tokens import RefreshTokenStore
+import clearskies
+from clearskies.contexts import test
+from clearskies.column_types import audit, email, json, string, datetime, created, updated
+from ..column_types import password
+
+
+class AuditRecord(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("class"),
+                string("resource_id"),
+                string("action"),
+                json("data"),
+                created("created_at"),
+                updated("updated_at"),
+            ]
+        )
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email"),
+                password("password"),
+                string("status"),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class RefreshToken(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("token_hash"),
+                string("user_id"),
+                string("family_id"),
+                datetime("expires_at"),
+                datetime("used_at"),
+                datetime("revoked_at"),
+            ]
+        )
+
+
+class RefreshTokenLoginTest(KeyBaseTestHelper):
+    def setUp(self):
+        super().setUp()
+        self.refresh = test(
+            {
+                "handler_class": RefreshTokenLogin,
+                "handler_config": {
+                    "claims_column_names": ["email"],
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "refresh_token_model_class": RefreshToken,
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    "login_check_callables": [self.active],
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[User, AuditRecord, RefreshToken],
+        )
+
+        self.user = self.refresh.build("users").create({"email": "cmancone@example.com", "password": "crappypassword"})
+        self.store = self.refresh.build(RefreshTokenStore)
+        (self.raw_token, expires_at) = self.store.issue(self.user.id, 3600)
+
+    def active(self, user):
+        return "Account disabled" if user.status == "disabled" else ""
+
+    def test_rotation(self):
+        response = self.refresh(body={"refresh_token": self.raw_token})
+        self.assertEquals(200, response[1])
+        jwt_claims = jwt.decode(
+            response[0]["token"],
+            self.public_keys[self.key_id],
+            algorithms=["RS256"],
+            audience="example.com",
+            issuer="https://example.com",
+        )
+        self.assertEquals("cmancone@example.com", jwt_claims["email"])
+        self.assertEquals(["create", "refresh"], [audit.action for audit in self.user.audit])
+
+        # the old token is used up and the new one is in the same family
+        new_token = response[0]["refresh_token"]
+        self.assertNotEquals(self.raw_token, new_token)
+        self.assertTrue(self.store.find(self.raw_token).used_at)
+        self.assertEquals(self.store.find(self.raw_token).family_id, self.store.find(new_token).family_id)
+        self.assertEquals(RefreshTokenStore.hash_token(new_token), self.store.find(new_token).token_hash)
+
+        response = self.refresh(body={"refresh_token": new_token})
+        self.assertEquals(200, response[1])
+        self.assertIn("refresh_token", response[0])
+
+    def test_rotation_keeps_family_expiration(self):
+        # the handler would give a new token 30 days, but the family started with an hour
+        (raw_token, expires_at) = self.store.issue(self.user.id, 3600)
+        for i in range(2):
+            response = self.refresh(body={"refresh_token": raw_token})
+            self.assertEquals(200, response[1])
+            self.assertEquals(int(expires_at.timestamp()), response[0]["refresh_token_expires_at"])
+            raw_token = response[0]["refresh_token"]
+
+    def test_reuse_revokes_family(self):
+        new_token = self.refresh(body={"refresh_token": self.raw_token})[0]["refresh_token"]
+        (other_session_token, expires_at) = self.store.issue(self.user.id, 3600)
+
+        response = self.refresh(body={"refresh_token": self.raw_token})
+        self.assertEquals(401, response[1])
+        self.assertEquals(["create", "refresh", "refresh_token_reuse"], [audit.action for audit in self.user.audit])
+
+        # the token that replaced the reused one is now dead too, but other logins aren't affected
+        self.assertEquals(401, self.refresh(body={"refresh_token": new_token})[1])
+        self.assertEquals(200, self.refresh(body={"refresh_token": other_session_token})[1])
+
+    def test_concurrent_exchange(self):
+        # both requests found the token unused, but only the first can claim it
+        stale = self.store.find(self.raw_token)
+        self.assertEquals(200, self.refresh(body={"refresh_token": self.raw_token})[1])
+        self.assertFalse(self.store.claim(stale))
+
+        # and a request that loses the race is treated as reuse
+        (raw_token, expires_at) = self.store.issue(self.user.id, 3600)
+        with patch.object(RefreshTokenStore, "claim", return_value=False):
+            response = self.refresh(body={"refresh_token": raw_token})
+        self.assertEquals(401, response[1])
+        self.assertEquals("refresh_token_reuse", list(self.user.audit)[-1].action)
+        self.assertTrue(self.store.find(raw_token).revoked_at)
+
+    def test_revoke_user(self):
+        (other_session_token, expires_at) = self.store.issue(self.user.id, 3600)
+        self.assertEquals(2, self.store.revoke_user(self.user.id))
+        self.assertEquals(0, self.store.revoke_user(self.user.id))
+        self.assertEquals(401, self.refresh(body={"refresh_token": self.raw_token})[1])
+        self.assertEquals(401, self.refresh(body={"refresh_token": other_session_token})[1])
+
+    def test_expired(self):
+        self.store.find(self.raw_token).save(
+            {"expires_at": datetime_module.datetime.now(datetime_module.timezone.utc) - datetime_module.timedelta(1)}
+        )
+        self.assertEquals(401, self.refresh(body={"refresh_token": self.raw_token})[1])
+
+    def test_unknown_and_missing(self):
+        self.assertEquals(401, self.refresh(body={"refresh_token": "not-a-real-token"})[1])
+        self.assertEquals(400, self.refresh(body={"something": "else"})[1])
+
+    def test_login_check_revokes_family(self):
+        self.user.save({"status": "disabled"})
+        response = self.refresh(body={"refresh_token": self.raw_token})
+        self.assertEquals(401, response[1])
+        self.assertEquals(["create", "update", "failed_refresh"], [audit.action for audit in self.user.audit])
+        self.assertTrue(self.store.find(self.raw_token).revoked_at)
+
+    def test_configuration(self):
+        with self.assertRaisesRegex(ValueError, "missing required configuration 'refresh_token_model_class'"):
+            test(
+                {
+                    "handler_class": RefreshTokenLogin,
+                    "handler_config": {
+                        "claims_column_names": ["email"],
+                        "path_to_private_keys": "/path/to/private",
+                        "path_to_public_keys": "/path/to/public",
+                        "user_model_class": User,
+                        "issuer": "https://example.com",
+                        "audience": "example.com",
+                    },
+                },
+                bindings={"secrets": self.secrets},
+                binding_classes=[User, AuditRecord],
+            )()
+        with self.assertRaisesRegex(ValueError, "missing the required column"):
+            test(
+                {
+                    "handler_class": RefreshTokenLogin,
+                    "handler_config": {
+                        "claims_column_names": ["email"],
+                        "path_to_private_keys": "/path/to/private",
+                        "path_to_public_keys": "/path/to/public",
+                        "user_model_class": User,
+                        "refresh_token_model_class": AuditRecord,
+                        "issuer": "https://example.com",
+                        "audience": "example.com",
+                    },
+                },
+                bindings={"secrets": self.secrets},
+                binding_classes=[User, AuditRecord],
+            )()
@@ -1,9 +1,13 @@
 import inspect
 import json
-from jwcrypto import jwk, jwt
+from types import MappingProxyType
 from clearskies.handlers.exceptions import InputError
 from clearskies.column_types import Audit
 from .key_base import KeyBase
+from .call_plan import call_plan
+from .user_columns import backend_column_names, build_login_users, select_user_columns
+from ..audits import AuditWriter
+from ..metrics import auth_server_metrics
 import datetime
 
 
@@ -20,12 +24,16 @@ class SwitchTenant(KeyBase):
         "path_to_private_keys": "",
         "path_to_public_keys": "",
         "key_cache_duration": 7200,
+        "key_refresh_mode": "synchronous",
         "can_switch_callable": None,
         "claims_callable": None,
         "claims_column_names": None,
         "audit": True,
         "audit_column_name": None,
         "audit_action_name_successful_login": "login",
+        "buffered_audit": False,
+        "select_user_columns": False,
+        "extra_user_column_names": [],
         "users": None,
     }
 
@@ -43,6 +51,14 @@ class SwitchTenant(KeyBase):
     def __init__(self, di, secrets, datetime):
         super().__init__(di, secrets, datetime)
         self._columns = None
+        self._audit_writer = None
+        self._user_column_names = None
+        self._plan = None
+
+    def configure(self, configuration):
+        super().configure(configuration)
+        self._user_column_names = self.user_column_names()
+        self._plan = MappingProxyType(self.compile_plan())
 
     def _check_configuration(self, configuration):
         super()._check_configuration(configuration)
@@ -172,20 +188,75 @@ class SwitchTenant(KeyBase):
             configuration["audit_column_name"] = self._get_audit_column(self._columns).name
         return super().apply_default_configuration(configuration)
 
+    def user_column_names(self):
+        """
+        Returns the columns to load when fetching the user, or None to load them all.
+
+        See PasswordLogin.user_column_names: it's the same idea, but the claims callable is the only thing that
+        can look at the user here.
+        """
+        if not self.configuration("select_user_columns"):
+            return None
+        extra_user_column_names = self.configuration("extra_user_column_names")
+        if not extra_user_column_names and self.configuration("claims_callable"):
+            return None
+        audit_column_name = self.configuration("audit_column_name") if self.configuration("audit") else None
+        return backend_column_names(
+            self._columns,
+            [
+                self.users.id_column_name,
+                self.configuration("username_column_name"),
+                self.configuration("tenant_id_column_name"),
+                *(self.configuration("claims_column_names") or []),
+                self._columns[audit_column_name].config("parent_id_column_name") if audit_column_name else None,
+                *extra_user_column_names,
+            ],
+        )
+
+    def compile_plan(self):
+        """
+        Returns everything that the request path needs to know about the configuration.
+
+        This is worked out once in `configure()` and stored in `self._plan` (as a read-only mapping), so that
+        switching tenants doesn't have to look up the configuration over and over again.
+        """
+        claims_callable = call_plan(self._di, self.configuration("claims_callable"))
+        if claims_callable:
+            claims = lambda user: claims_callable({"user": user})
+        else:
+            claims_column_names = tuple(self.configuration("claims_column_names"))
+            claims = lambda user: {claim_column: user.get(claim_column) for claim_column in claims_column_names}
+        tenant_id_source_key_name = self.configuration("tenant_id_source_key_name")
+        audit = self.configuration("audit")
+        return {
+            # users are loaded through a model that only configures its columns once (see `SharedColumns`)
+            "login_users": build_login_users(self._di, self.configuration("user_model_class")),
+            # routing data is the only source we support (which the configuration checks enforce)
+            "tenant_id": lambda input_output: input_output.routing_data().get(tenant_id_source_key_name),
+            "tenant_id_column_name": self.configuration("tenant_id_column_name"),
+            "username_column_name": self.configuration("username_column_name"),
+            "username_key_name_in_authorization_data": self.configuration("username_key_name_in_authorization_data"),
+            "can_switch_callable": call_plan(self._di, self.configuration("can_switch_callable")),
+            "claims": claims,
+            "audience": self.configuration("audience"),
+            "issuer": self.configuration("issuer"),
+            "audit_column": self._columns[self.configuration("audit_column_name")] if audit else None,
+            "buffered_audit": self.configuration("buffered_audit"),
+            "audit_action_name_successful_login": self.configuration("audit_action_name_successful_login"),
+        }
+
     @property
     def users(self):
         return self._di.build(self.configuration("user_model_class"), cache=True)
 
     def get_tenant_id(self, input_output):
-        source = self.configuration("tenant_id_source")
-        if source == "routing_data":
-            routing_data = input_output.routing_data()
-            return routing_data.get(self.configuration("tenant_id_source_key_name"))
+        return self._plan["tenant_id"](input_output)
 
     def get_username(self, authorization_data):
-        return authorization_data.get(self.configuration("username_key_name_in_authorization_data"))
+        return authorization_data.get(self._plan["username_key_name_in_authorization_data"])
 
     def handle(self, input_output):
+        plan = self._plan
         authorization_data = input_output.get_authorization_data()
         tenant_id = self.get_tenant_id(input_output)
         if not tenant_id:
@@ -193,65 +264,74 @@ class SwitchTenant(KeyBase):
         username = self.get_username(authorization_data)
         if not username:
             return self.error(input_output, "Invalid user", 404)
-        can_switch_callable = self.configuration("can_switch_callable")
+        can_switch_callable = plan["can_switch_callable"]
         if can_switch_callable:
-            allowed = self._di.call_function(
-                can_switch_callable,
-                tenant_id=tenant_id,
-                username=username,
-                request_data=input_output.request_data(required=False),
+            allowed = can_switch_callable(
+                {
+                    "tenant_id": tenant_id,
+                    "username": username,
+                    "request_data": (
+                        input_output.request_data(required=False) if can_switch_callable.takes("request_data") else None
+                    ),
+                    "input_output": input_output,
+                },
                 input_output=input_output,
-                **input_output.routing_data(),
-                **input_output.context_specifics(),
             )
             if not allowed:
                 return self.error(input_output, "Invalid user + tenant", 404)
 
-        username_column_name = self.configuration("username_column_name")
-        tenant_id_column_name = self.configuration("tenant_id_column_name")
+        username_column_name = plan["username_column_name"]
+        tenant_id_column_name = plan["tenant_id_column_name"]
 
         user = (
-            self.users.where(f"{tenant_id_column_name}={tenant_id}").where(f"{username_column_name}={username}").first()
+            select_user_columns(plan["login_users"], self._user_column_names)
+            .where(f"{tenant_id_column_name}={tenant_id}")
+            .where(f"{username_column_name}={username}")
+            .first()
         )
 
         # no user found
         if not user.exists:
             return self.error(input_output, "Invalid user + tenant", 404)
 
-        self.audit(user, self.configuration("audit_action_name_successful_login"))
-        signing_key = self.get_youngest_private_key(self.configuration("path_to_private_keys"), as_json=False)
+        self.audit(user, plan["audit_action_name_successful_login"])
         # use the old expiration time, otherwise users can just automatically extend their session life
         jwt_claims = self.get_jwt_claims(user, authorization_data["exp"])
-        token = jwt.JWT(header={"alg": "RS256", "typ": "JWT", "kid": signing_key["kid"]}, claims=jwt_claims)
-        token.make_signed_token(signing_key)
+        token = self.create_signed_jwt(jwt_claims)
 
         return self.respond_unstructured(
             input_output,
             {
-                "token": token.serialize(),
+                "token": token,
                 "expires_at": jwt_claims["exp"],
             },
             200,
         )
 
     def get_jwt_claims(self, user, exp):
-        if self.configuration("claims_callable"):
-            claims = self._di.call_function(user=user)
-        else:
-            claims = {
-                claim_column: user.get(claim_column) for claim_column in self.configuration("claims_column_names")
-            }
-
+        plan = self._plan
+        claims = plan["claims"](user)
         now = self._datetime.datetime.now(self._datetime.timezone.utc)
         return {
-            "aud": self.configuration("audience"),
-            "iss": self.configuration("issuer"),
+            "aud": plan["audience"],
+            "iss": plan["issuer"],
             "exp": exp,
             **claims,
             "iat": int(now.timestamp()),
         }
 
+    @property
+    def audit_writer(self):
+        if self._audit_writer is None:
+            self._audit_writer = self._di.build(AuditWriter, cache=True)
+            auth_server_metrics.watch_audit_writer(self.metrics_registry, self._audit_writer)
+        return self._audit_writer
+
     def audit(self, user, action_name, data=None):
-        if not self.configuration("audit"):
+        audit_column = self._plan["audit_column"]
+        if audit_column is None:
             return
-        self._columns[self.configuration("audit_column_name")].record(user, action_name, data=None)
+        if self._plan["buffered_audit"]:
+            self.audit_writer.record(audit_column, user, action_name, data=None)
+        else:
+            audit_column.record(user, action_name, data=None)
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import clearskies
+from clearskies.column_types import audit, email, json, string, created, updated
+from clearskies.contexts import test
+from clearskies.input_requirements import required
+from jose import jwt
+from .key_base_test_helper import KeyBaseTestHelper
+from .switch_tenant import SwitchTenant
+from ..column_types import password
+
+
+class AuditRecord(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("class"),
+                string("resource_id"),
+                string("action"),
+                json("data"),
+                created("created_at"),
+                updated("updated_at"),
+            ]
+        )
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email", input_requirements=[required()]),
+                password("password", input_requirements=[required()]),
+                string("tenant_id"),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class SwitchTenantTest(KeyBaseTestHelper):
+    def build_switch_tenant(self, **handler_config):
+        switch_tenant = test(
+            {
+                "handler_class": SwitchTenant,
+                "handler_config": {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/public",
+                    "user_model_class": User,
+                    "tenant_id_column_name": "tenant_id",
+                    "tenant_id_source": "routing_data",
+                    "tenant_id_source_key_name": "tenant_id",
+                    "issuer": "https://example.com",
+                    "audience": "example.com",
+                    **handler_config,
+                },
+            },
+            bindings={"secrets": self.secrets},
+            binding_classes=[User, AuditRecord],
+        )
+        switch_tenant.build("users").create({"email": "cmancone@example.com", "password": "hey", "tenant_id": "t2"})
+        return switch_tenant
+
+    def test_claims_callable(self):
+        switch_tenant = self.build_switch_tenant(
+            claims_callable=lambda user: {"email": user.email, "tenant": user.tenant_id},
+            can_switch_callable=lambda username, tenant_id: tenant_id == "t2",
+        )
+        response = switch_tenant(
+            routing_data={"tenant_id": "t2"},
+            authorization_data={"email": "cmancone@example.com", "exp": 1234567890},
+        )
+        self.assertEquals(200, response[1])
+        jwt_claims = jwt.get_unverified_claims(response[0]["token"])
+        self.assertEquals("cmancone@example.com", jwt_claims["email"])
+        self.assertEquals("t2", jwt_claims["tenant"])
+        self.assertEquals(1234567890, jwt_claims["exp"])
+
+    def test_can_switch_callable(self):
+        switch_tenant = self.build_switch_tenant(
+            claims_column_names=["email"],
+            can_switch_callable=lambda username, tenant_id: tenant_id == "t1",
+        )
+        response = switch_tenant(
+            routing_data={"tenant_id": "t2"},
+            authorization_data={"email": "cmancone@example.com", "exp": 1234567890},
+        )
+        self.assertEquals(404, response[1])
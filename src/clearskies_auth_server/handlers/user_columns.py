@@ -0,0 +1,90 @@
+"""
+Helpers for loading only the columns of the user model that a handler actually needs.
+"""
+
+import inspect
+import threading
+from collections import OrderedDict
+from clearskies.columns import Columns
+
+
+def backend_column_names(columns, column_names):
+    """
+    Returns the names of the columns that have to be loaded from the backend in order to read the given columns.
+
+    Not every column lives in the backend: relationships (and audit columns) are provided by another column, and
+    temporary columns aren't stored at all.  For columns that are provided by another column (e.g. the parent model
+    of a belongs to), we load the providing column instead, if it's stored.
+    """
+    names = []
+
+    def add(name):
+        if name not in names:
+            names.append(name)
+
+    for column_name in column_names:
+        if not column_name:
+            continue
+        providers = [column for column in columns.values() if column.can_provide(column_name)]
+        if not providers:
+            if column_name in columns and not columns[column_name].is_temporary:
+                add(column_name)
+            continue
+        for provider in providers:
+            if provider.name != column_name and not provider.is_temporary:
+                add(provider.name)
+    return names
+
+
+def select_user_columns(users, column_names):
+    """
+    Restricts the query to the given columns, unless `column_names` is None (in which case we load everything).
+    """
+    if column_names is None:
+        return users
+    table_name = users.table_name()
+    users = users.select_all(False)
+    for column_name in column_names:
+        # qualified names never need quoting in SQL, even if the column name happens to be a reserved word
+        users = users.select(f"{table_name}.{column_name}")
+    return users
+
+
+class SharedColumns(Columns):
+    """
+    Configures the columns of each model class once, and then gives the same columns to every model.
+
+    Clearskies configures the columns separately for every model that it loads (the first time a value is read),
+    which, with hashing and signing out of the picture, costs more than the rest of a login put together.  The
+    configured columns only depend on the model class, so the login handlers load their users through models that
+    use this (see `build_login_users`) instead of the standard one.  Each model still gets its own dictionary of
+    columns, since clearskies adds to it when saving with extra columns.
+    """
+
+    def __init__(self, di):
+        super().__init__(di)
+        self._configured = {}
+        self._lock = threading.Lock()
+
+    def configure(self, definitions, model_class, overrides=None):
+        if overrides is not None:
+            return super().configure(definitions, model_class, overrides=overrides)
+        with self._lock:
+            if model_class not in self._configured:
+                self._configured[model_class] = super().configure(definitions, model_class)
+            return OrderedDict(self._configured[model_class])
+
+
+def build_login_users(di, model_class):
+    """
+    Builds a separate instance of the user model class, which configures its columns only once (see SharedColumns).
+
+    Everything else comes out of the dependency injection container, just like `di.build(model_class)`.  Clearskies
+    models ask for their dependencies (i.e. the backend) by name, so that's how we find them.
+    """
+    arguments = {
+        argument_name: di.build(argument_name, cache=True)
+        for argument_name in inspect.signature(model_class).parameters
+        if argument_name != "columns"
+    }
+    return model_class(**arguments, columns=SharedColumns(di))
@@ -0,0 +1,91 @@
+import unittest
+from collections import OrderedDict
+import clearskies
+from clearskies.column_types import audit, belongs_to, created, json, string, updated
+from clearskies.contexts import test
+from .user_columns import SharedColumns, backend_column_names, build_login_users, select_user_columns
+
+
+class AuditRecord(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("class"),
+                string("resource_id"),
+                string("action"),
+                json("data"),
+                created("created_at"),
+                updated("updated_at"),
+            ]
+        )
+
+
+class Tenant(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict([string("name")])
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("email"),
+                json("profile"),
+                string("scratch", is_temporary=True),
+                belongs_to("tenant_id", parent_models_class=Tenant, model_column_name="tenant"),
+                audit("audit", audit_models_class=AuditRecord),
+            ]
+        )
+
+
+class UserColumnsTest(unittest.TestCase):
+    def setUp(self):
+        self.context = test(lambda: None, binding_classes=[User, Tenant, AuditRecord])
+        self.users = self.context.build(User)
+
+    def test_backend_column_names(self):
+        columns = self.users.columns()
+        self.assertEqual(
+            ["id", "email", "tenant_id"],
+            backend_column_names(columns, ["id", "email", "email", None, "scratch", "audit", "tenant", "missing"]),
+        )
+
+    def test_select_user_columns(self):
+        self.assertIs(self.users, select_user_columns(self.users, None))
+        users = select_user_columns(self.users, ["id", "email"])
+        self.assertFalse(users.query_select_all)
+        self.assertEqual(["users.id", "users.email"], users.query_selects)
+        # the original query is untouched
+        self.assertTrue(self.users.query_select_all)
+
+    def test_build_login_users(self):
+        login_users = build_login_users(self.context.di, User)
+        self.assertIsNot(self.users, login_users)
+        self.users.create({"email": "cmancone@example.com"})
+
+        # the same backend, but the columns are only configured once
+        user = login_users.find("email=cmancone@example.com")
+        other = login_users.find("email=cmancone@example.com")
+        self.assertEqual("cmancone@example.com", user.get("email"))
+        self.assertIs(user.columns()["email"], other.columns()["email"])
+        self.assertIsNot(user.columns(), other.columns())
+
+        # and the standard models are left alone
+        self.assertIsNot(user.columns()["email"], self.users.find("email=cmancone@example.com").columns()["email"])
+
+    def test_shared_columns_overrides(self):
+        shared_columns = SharedColumns(self.context.di)
+        definitions = self.users.raw_columns_configuration()
+        columns = shared_columns.configure(definitions, User)
+        self.assertIs(columns["email"], shared_columns.configure(definitions, User)["email"])
+        overridden = shared_columns.configure(definitions, User, overrides={"email": {"is_temporary": True}})
+        self.assertIsNot(columns["email"], overridden["email"])
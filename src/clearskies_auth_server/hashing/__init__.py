@@ -0,0 +1,25 @@
+from .calibration import (
+    calibrate,
+    calibration_schemes,
+    check_model_verify_latency,
+    check_verify_latency,
+    crypt_context_string,
+    measure,
+)
+from .hash_inventory import HashInventory
+from .hashing_executor import HashingExecutor
+from .hashing_overloaded import HashingOverloaded
+from .rehash_queue import RehashQueue
+
+__all__ = [
+    "calibrate",
+    "calibration_schemes",
+    "check_model_verify_latency",
+    "check_verify_latency",
+    "crypt_context_string",
+    "HashInventory",
+    "HashingExecutor",
+    "HashingOverloaded",
+    "measure",
+    "RehashQueue",
+]
@@ -0,0 +1,184 @@
+"""
+Measures what password hashing costs on the current machine, and picks settings that hit a latency target.
+
+Everything here works with passlib crypt contexts (or the settings used to build them), so the results can be
+pasted straight into the `crypt_context_string` of a password column.  The supported schemes are argon2, bcrypt,
+and the pbkdf2 family, which covers everything that's sensible for passwords.  See
+`benchmarks/calibrate_password_hashing.py` for a command line front end.
+"""
+
+import statistics
+import threading
+import time
+import warnings
+from passlib.context import CryptContext
+
+calibration_schemes = ["argon2", "bcrypt", "pbkdf2_sha256", "pbkdf2_sha512"]
+
+# (crypt context string, budget, concurrency) => result, so the startup check only measures once per process
+_checked = {}
+_checked_lock = threading.Lock()
+
+
+def measure(crypt_context, concurrency=1, samples=5, password="calibration-password"):
+    """
+    Times hashing and verifying with the given crypt context.
+
+    With a `concurrency` above 1, that many threads verify at the same time (argon2 and bcrypt release the GIL, so
+    this shows how much slower things get when the CPUs are shared).  Returns a dictionary with the scheme, the
+    concurrency, and the median `hash_seconds` and `verify_seconds`, as well as the slowest verify in
+    `max_verify_seconds`.
+    """
+    if isinstance(crypt_context, dict):
+        crypt_context = CryptContext(**crypt_context)
+    hash_seconds = []
+    hashed_password = None
+    for i in range(max(1, samples // 2)):
+        started_at = time.perf_counter()
+        hashed_password = crypt_context.hash(password)
+        hash_seconds.append(time.perf_counter() - started_at)
+
+    verify_seconds = []
+    lock = threading.Lock()
+
+    def verify():
+        for i in range(samples):
+            started_at = time.perf_counter()
+            crypt_context.verify(password, hashed_password)
+            elapsed = time.perf_counter() - started_at
+            with lock:
+                verify_seconds.append(elapsed)
+
+    threads = [threading.Thread(target=verify) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        "scheme": crypt_context.handler().name,
+        "concurrency": concurrency,
+        "hash_seconds": statistics.median(hash_seconds),
+        "verify_seconds": statistics.median(verify_seconds),
+        "max_verify_seconds": max(verify_seconds),
+    }
+
+
+def calibrate(scheme, target_seconds, concurrency=1, samples=3, memory_cost=None, parallelism=None):
+    """
+    Finds the most expensive settings for the scheme that still verify within `target_seconds`.
+
+    The latency is measured with `concurrency` verifies running at once, so pass the number of logins you expect to
+    handle at the same time on one machine.  For argon2 we tune the number of rounds (`time_cost`) and leave the
+    memory cost (in KiB) and parallelism alone unless you provide them.  For bcrypt we tune the (log2) rounds and
+    for pbkdf2 the number of iterations.  Every scheme has a floor on its cost, so if even that is too slow then
+    you get the floor back, and `verify_seconds` in the result will be over the target.
+
+    Returns a dictionary with the `settings` (the keyword arguments for CryptContext), the `crypt_context_string`,
+    and the `verify_seconds` that was measured for those settings.
+    """
+    if scheme not in calibration_schemes:
+        raise ValueError(
+            "Can only calibrate schemes '" + "', '".join(calibration_schemes) + f"', but was asked for '{scheme}'"
+        )
+    if target_seconds <= 0:
+        raise ValueError("The target latency for calibration must be greater than zero")
+
+    base_settings = {"schemes": [scheme]}
+    if scheme == "argon2":
+        if memory_cost is not None:
+            base_settings["argon2__memory_cost"] = memory_cost
+        if parallelism is not None:
+            base_settings["argon2__parallelism"] = parallelism
+
+    def settings_for(rounds):
+        return {**base_settings, f"{scheme}__rounds": rounds}
+
+    def latency(rounds):
+        return measure(settings_for(rounds), concurrency=concurrency, samples=samples)["verify_seconds"]
+
+    handler = CryptContext(**base_settings).handler()
+    min_rounds = max(1, handler.min_rounds)
+    if scheme == "bcrypt":
+        # every round doubles the work, so we just count up until the next one would be too slow
+        rounds = min_rounds
+        verify_seconds = latency(rounds)
+        while rounds < handler.max_rounds:
+            next_verify_seconds = latency(rounds + 1)
+            if next_verify_seconds > target_seconds:
+                break
+            rounds += 1
+            verify_seconds = next_verify_seconds
+    else:
+        # the cost is (roughly) a fixed overhead plus a constant amount per round, so we measure two points,
+        # extrapolate, and then back off until we're actually under the target.
+        low_rounds = min_rounds if scheme == "argon2" else max(min_rounds, 1000)
+        high_rounds = low_rounds * 2
+        low_seconds = latency(low_rounds)
+        high_seconds = latency(high_rounds)
+        per_round = max((high_seconds - low_seconds) / (high_rounds - low_rounds), 1e-9)
+        rounds = int(low_rounds + (target_seconds - low_seconds) / per_round)
+        # with noisy timings the two points can come out (nearly) the same, and the extrapolation then runs off to
+        # millions of rounds.  The cost never grows faster than the rounds, so twice the straight proportion of
+        # the slower measurement is a safe ceiling.
+        rounds = min(rounds, int(high_rounds * 2 * target_seconds / max(high_seconds, 1e-9)))
+        rounds = min(max(min_rounds, rounds), handler.max_rounds)
+        verify_seconds = latency(rounds)
+        while verify_seconds > target_seconds and rounds > min_rounds:
+            rounds = max(min_rounds, int(rounds * target_seconds / verify_seconds) - (1 if scheme == "argon2" else 0))
+            verify_seconds = latency(rounds)
+
+    settings = settings_for(rounds)
+    return {
+        "settings": settings,
+        "crypt_context_string": crypt_context_string(settings),
+        "verify_seconds": verify_seconds,
+        "concurrency": concurrency,
+    }
+
+
+def crypt_context_string(settings):
+    """
+    Converts the keyword arguments for a CryptContext into the string format that `crypt_context_string` expects.
+    """
+    return CryptContext(**settings).to_string()
+
+
+def check_verify_latency(crypt_context, budget_seconds, concurrency=1, samples=3):
+    """
+    Measures the verify latency of the crypt context, and warns if it's over budget.
+
+    The result is remembered, so calling this again (e.g. for several models with the same password settings) for the same
+    crypt context, budget, and concurrency only measures once per process.  Returns the measurement.
+    """
+    cache_key = (crypt_context.to_string(), budget_seconds, concurrency)
+    with _checked_lock:
+        if cache_key in _checked:
+            return _checked[cache_key]
+        result = measure(crypt_context, concurrency=concurrency, samples=samples)
+        _checked[cache_key] = result
+    if result["verify_seconds"] > budget_seconds:
+        warnings.warn(
+            f"Verifying a '{result['scheme']}' password takes {result['verify_seconds']:.3f} seconds with "
+            + f"{concurrency} concurrent logins, which is over the budget of {budget_seconds:.3f} seconds.  "
+            + "See clearskies_auth_server.hashing.calibrate for settings that fit.",
+            RuntimeWarning,
+        )
+    return result
+
+
+def check_model_verify_latency(model):
+    """
+    Runs the verify latency check for every password column in the model that has a `verify_latency_budget`.
+
+    Call this once at startup (e.g. `check_model_verify_latency(di.build(User))`), or in a deployment check.
+    Returns a dictionary with the measurement for each password column that was checked.
+    """
+    results = {}
+    for column_name, column in model.columns().items():
+        if not callable(getattr(column, "check_verify_latency", None)):
+            continue
+        result = column.check_verify_latency()
+        if result is not None:
+            results[column_name] = result
+    return results
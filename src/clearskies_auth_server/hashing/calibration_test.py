@@ -0,0 +1,74 @@
+import unittest
+import warnings
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from passlib.context import CryptContext
+from .calibration import calibrate, check_model_verify_latency, check_verify_latency, crypt_context_string, measure
+
+
+class CalibrationTest(unittest.TestCase):
+    def test_measure(self):
+        result = measure({"schemes": ["pbkdf2_sha256"], "pbkdf2_sha256__rounds": 1000}, concurrency=2, samples=2)
+        self.assertEqual("pbkdf2_sha256", result["scheme"])
+        self.assertEqual(2, result["concurrency"])
+        self.assertGreater(result["verify_seconds"], 0)
+        self.assertGreaterEqual(result["max_verify_seconds"], result["verify_seconds"])
+
+    def test_calibrate(self):
+        for scheme in ["argon2", "bcrypt", "pbkdf2_sha256"]:
+            result = calibrate(scheme, 0.02, samples=1, memory_cost=1024)
+            rounds = result["settings"][f"{scheme}__rounds"]
+            self.assertGreaterEqual(rounds, 1)
+            # round trip the suggested settings through the string format
+            crypt_context = CryptContext.from_string(result["crypt_context_string"])
+            self.assertEqual(scheme, crypt_context.handler().name)
+            self.assertEqual(rounds, crypt_context.handler().default_rounds)
+        self.assertEqual(
+            1024,
+            CryptContext.from_string(calibrate("argon2", 0.02, samples=1, memory_cost=1024)["crypt_context_string"])
+            .handler()
+            .memory_cost,
+        )
+
+    def test_calibrate_noisy_timings(self):
+        # if the cost doesn't seem to grow with the rounds, we mustn't extrapolate to billions of them
+        flat = {"verify_seconds": 0.001}
+        with patch("clearskies_auth_server.hashing.calibration.measure", return_value=flat) as measure_mock:
+            result = calibrate("argon2", 0.02, samples=1)
+        self.assertEqual(80, result["settings"]["argon2__rounds"])
+        self.assertEqual(3, measure_mock.call_count)
+
+    def test_calibrate_checks(self):
+        with self.assertRaises(ValueError):
+            calibrate("md5_crypt", 0.1)
+        with self.assertRaises(ValueError):
+            calibrate("argon2", 0)
+
+    def test_crypt_context_string(self):
+        self.assertEqual(
+            "[passlib]\nschemes = argon2\nargon2__rounds = 3\n\n",
+            crypt_context_string({"schemes": ["argon2"], "argon2__rounds": 3}),
+        )
+
+    def test_check_verify_latency(self):
+        crypt_context = CryptContext(schemes=["pbkdf2_sha256"], pbkdf2_sha256__rounds=1001)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            result = check_verify_latency(crypt_context, 0.000001)
+            self.assertEqual(1, len(caught))
+            self.assertIn("over the budget", str(caught[0].message))
+            # the second time around, we don't measure again (or warn again)
+            self.assertIs(result, check_verify_latency(crypt_context, 0.000001))
+            self.assertEqual(1, len(caught))
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            check_verify_latency(crypt_context, 60)
+            self.assertEqual(0, len(caught))
+
+    def test_check_model_verify_latency(self):
+        password = SimpleNamespace(check_verify_latency=MagicMock(return_value={"verify_seconds": 0.1}))
+        no_budget = SimpleNamespace(check_verify_latency=MagicMock(return_value=None))
+        model = SimpleNamespace(columns=lambda: {"password": password, "pin": no_budget, "email": SimpleNamespace()})
+        self.assertEqual({"password": {"verify_seconds": 0.1}}, check_model_verify_latency(model))
+        no_budget.check_verify_latency.assert_called_once_with()
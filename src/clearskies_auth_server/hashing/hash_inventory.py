@@ -0,0 +1,224 @@
+import json
+import os
+import time
+from passlib.context import CryptContext
+
+# everything we try to recognize when the password column's crypt context doesn't know a hash.  Note that we
+# leave out the schemes (like des_crypt) that are too loosely defined to identify reliably.
+known_schemes = [
+    "argon2",
+    "bcrypt_sha256",
+    "bcrypt",
+    "scrypt",
+    "pbkdf2_sha1",
+    "pbkdf2_sha256",
+    "pbkdf2_sha512",
+    "sha256_crypt",
+    "sha512_crypt",
+    "md5_crypt",
+]
+
+# the settings that make up a "parameter set", for the schemes that have them.  The ident tells apart variants
+# of the same scheme, like the $2a$ and $2b$ versions of bcrypt.
+parameter_names = ["type", "memory_cost", "rounds", "parallelism", "block_size", "ident"]
+
+
+class HashInventory:
+    """
+    Pages through the users and reports which password hashes are in use.
+
+    The only time we can upgrade a password hash is when the user logs in, so after the crypt context changes,
+    there can be accounts sitting on old (or weak) hashes for a long time.  This job walks through the user model
+    `page_size` records at a time (sorted by id, so memory use stays flat no matter how many users there are) and
+    counts the hashes by scheme and by parameter set.  Anything that the password column's crypt context says
+    `needs_update` (including hashes it doesn't recognize at all) is counted, and, if you set
+    `flag_column_name`, marked by setting that column to True, e.g. so that you can force a password reset.  For
+    anything fancier, override `flag()`.
+
+    To go easy on a production database, set `max_rows_per_second`.  To make the job resumable, set
+    `checkpoint_path`: after every page we save our place (and the counts so far) to that file, and `run()` picks
+    up where it left off.  `run(max_pages=...)` stops early, so you can also spread a large inventory over a few
+    runs on purpose.
+
+    Only passwords can produce a new hash, so this job doesn't upgrade anything itself: see the `rehash_mode` of
+    the password column for that.
+    """
+
+    _di = None
+    _users = None
+    _password_column = None
+    _password_column_name = None
+    _page_size = None
+    _max_rows_per_second = None
+    _checkpoint_path = None
+    _flag_column_name = None
+    _known_crypt_context = None
+
+    def __init__(self, di):
+        self._di = di
+        self._sleep = time.sleep
+
+    def configure(
+        self,
+        user_model_class,
+        password_column_name="password",
+        page_size=500,
+        max_rows_per_second=None,
+        checkpoint_path=None,
+        flag_column_name=None,
+    ):
+        error_prefix = f"Configuration error for {self.__class__.__name__}:"
+        users = self._di.build(user_model_class, cache=False)
+        columns = users.columns()
+        if password_column_name not in columns:
+            raise ValueError(
+                f"{error_prefix} the password column, '{password_column_name}', does not exist in the user model '{user_model_class.__name__}'"
+            )
+        if not hasattr(columns[password_column_name], "crypt_context"):
+            raise ValueError(
+                f"{error_prefix} the password column, '{password_column_name}', in model '{user_model_class.__name__}' is not a password column"
+            )
+        if flag_column_name and flag_column_name not in columns:
+            raise ValueError(
+                f"{error_prefix} the flag column, '{flag_column_name}', does not exist in the user model '{user_model_class.__name__}'"
+            )
+        if page_size < 1:
+            raise ValueError(f"{error_prefix} 'page_size' must be at least 1")
+        self._users = users
+        self._password_column = columns[password_column_name]
+        self._password_column_name = password_column_name
+        self._page_size = page_size
+        self._max_rows_per_second = max_rows_per_second
+        self._checkpoint_path = checkpoint_path
+        self._flag_column_name = flag_column_name
+        self._known_crypt_context = CryptContext(schemes=known_schemes)
+        return self
+
+    def run(self, max_pages=None, restart=False):
+        """
+        Runs the inventory (or continues it from the checkpoint) and returns the report.
+
+        The report has the number of users `scanned`, how many have no password (`empty`), how many have a hash
+        that `needs_update` (and how many of those were `flagged`), the counts per `schemes` and per
+        `parameter_sets` (e.g. "argon2(type=id, memory_cost=65536, rounds=5, parallelism=4)"), plus where we are
+        (`last_id`) and whether we're `finished`.
+        """
+        if self._users is None:
+            raise ValueError(f"You must call configure() before running the {self.__class__.__name__}")
+        report = None if restart else self.load_checkpoint()
+        if report is None:
+            report = self.empty_report()
+        if report["finished"]:
+            return report
+
+        id_column_name = self._users.id_column_name
+        started_at = time.monotonic()
+        scanned_this_run = 0
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            if pages:
+                self._rate_limit(started_at, scanned_this_run)
+            users = self._users.sort_by(id_column_name, "asc").limit(self._page_size)
+            if report["last_id"] is not None:
+                users = users.where(f"{id_column_name}>{report['last_id']}")
+            page = [user for user in users]
+            for user in page:
+                self.inspect(user, report)
+                report["last_id"] = user.get(id_column_name)
+            if len(page) < self._page_size:
+                report["finished"] = True
+            pages += 1
+            scanned_this_run += len(page)
+            self.save_checkpoint(report)
+            if report["finished"]:
+                break
+        return report
+
+    def empty_report(self):
+        return {
+            "scanned": 0,
+            "empty": 0,
+            "needs_update": 0,
+            "flagged": 0,
+            "schemes": {},
+            "parameter_sets": {},
+            "last_id": None,
+            "finished": False,
+        }
+
+    def inspect(self, user, report):
+        report["scanned"] += 1
+        hashed_password = user.get(self._password_column_name)
+        if not hashed_password:
+            report["empty"] += 1
+            return
+
+        (scheme, parameter_set, needs_update) = self.describe(hashed_password)
+        report["schemes"][scheme] = report["schemes"].get(scheme, 0) + 1
+        if parameter_set not in report["parameter_sets"]:
+            report["parameter_sets"][parameter_set] = {"count": 0, "needs_update": needs_update}
+        report["parameter_sets"][parameter_set]["count"] += 1
+        if not needs_update:
+            return
+        report["needs_update"] += 1
+        if self._flag_column_name and self.flag(user, scheme, parameter_set):
+            report["flagged"] += 1
+
+    def describe(self, hashed_password):
+        """
+        Returns the scheme, parameter set, and whether or not the hash needs an update.
+        """
+        crypt_context = self._password_column.crypt_context
+        handler = crypt_context.identify(hashed_password, resolve=True, required=False)
+        # anything the crypt context doesn't recognize can't even be verified anymore
+        needs_update = True
+        if handler:
+            needs_update = crypt_context.needs_update(hashed_password)
+        else:
+            handler = self._known_crypt_context.identify(hashed_password, resolve=True, required=False)
+        if not handler:
+            return ("unknown", "unknown", True)
+
+        try:
+            parsed = handler.from_string(hashed_password)
+        except (ValueError, TypeError):
+            return (handler.name, f"{handler.name}(malformed)", True)
+        parameters = []
+        for parameter_name in parameter_names:
+            if parameter_name == "ident" and len(getattr(handler, "ident_values", None) or []) < 2:
+                continue
+            value = getattr(parsed, parameter_name, None)
+            if value is not None:
+                parameters.append(f"{parameter_name}={value}")
+        return (handler.name, handler.name + "(" + ", ".join(parameters) + ")", needs_update)
+
+    def flag(self, user, scheme, parameter_set):
+        """
+        Marks a user whose hash needs an update.  Returns True if they were flagged.
+        """
+        if user.get(self._flag_column_name):
+            return False
+        user.save({self._flag_column_name: True})
+        return True
+
+    def load_checkpoint(self):
+        if not self._checkpoint_path or not os.path.exists(self._checkpoint_path):
+            return None
+        with open(self._checkpoint_path, "r") as checkpoint:
+            return json.load(checkpoint)
+
+    def save_checkpoint(self, report):
+        if not self._checkpoint_path:
+            return
+        # write and then rename, so an interrupted job never leaves behind half a checkpoint
+        temporary_path = f"{self._checkpoint_path}.tmp"
+        with open(temporary_path, "w") as checkpoint:
+            json.dump(report, checkpoint)
+        os.replace(temporary_path, self._checkpoint_path)
+
+    def _rate_limit(self, started_at, scanned):
+        if not self._max_rows_per_second:
+            return
+        wait = scanned / self._max_rows_per_second - (time.monotonic() - started_at)
+        if wait > 0:
+            self._sleep(wait)
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+from collections import OrderedDict
+import clearskies
+from clearskies.column_types import boolean, string
+from clearskies.contexts import test
+from passlib.context import CryptContext
+from ..column_types import password
+from .hash_inventory import HashInventory
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                string("email"),
+                password(
+                    "password",
+                    require_repeat_password=False,
+                    crypt_context={
+                        "schemes": ["argon2", "sha256_crypt"],
+                        "deprecated": ["sha256_crypt"],
+                        "argon2__rounds": 1,
+                        "argon2__memory_cost": 1024,
+                    },
+                ),
+                boolean("needs_password_reset"),
+            ]
+        )
+
+
+class HashInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.context = test(lambda: None, binding_classes=[User])
+        self.users = self.context.build(User)
+        password_column = self.users.columns()["password"]
+        legacy_hashes = [
+            CryptContext(schemes=["sha256_crypt"], sha256_crypt__rounds=1000).hash("password"),
+            CryptContext(schemes=["pbkdf2_sha256"], pbkdf2_sha256__rounds=1000).hash("password"),
+            "not-a-hash",
+        ]
+        for i in range(4):
+            self.users.create({"email": f"current{i}@example.com", "password": "password"})
+        for i, legacy_hash in enumerate(legacy_hashes):
+            user = self.users.create({"email": f"legacy{i}@example.com", "password": "password"})
+            password_column.save_hashed_password(user, legacy_hash)
+        self.users.create({"email": "nopassword@example.com"})
+        self.inventory = self.context.build(HashInventory)
+
+    def test_report(self):
+        self.inventory.configure(User, page_size=3)
+        report = self.inventory.run()
+        self.assertTrue(report["finished"])
+        self.assertEqual(8, report["scanned"])
+        self.assertEqual(1, report["empty"])
+        self.assertEqual(3, report["needs_update"])
+        self.assertEqual(0, report["flagged"])
+        self.assertEqual(
+            {"argon2": 4, "sha256_crypt": 1, "pbkdf2_sha256": 1, "unknown": 1},
+            report["schemes"],
+        )
+        self.assertEqual(
+            {"count": 4, "needs_update": False},
+            report["parameter_sets"]["argon2(type=id, memory_cost=1024, rounds=1, parallelism=4)"],
+        )
+        self.assertEqual({"count": 1, "needs_update": True}, report["parameter_sets"]["sha256_crypt(rounds=1000)"])
+        # not something the crypt context can verify at all
+        self.assertEqual({"count": 1, "needs_update": True}, report["parameter_sets"]["pbkdf2_sha256(rounds=1000)"])
+        self.assertEqual({"count": 1, "needs_update": True}, report["parameter_sets"]["unknown"])
+
+    def test_bcrypt_variants(self):
+        self.inventory.configure(User)
+        self.assertEqual(
+            ("bcrypt", "bcrypt(rounds=5, ident=$2a$)", True),
+            self.inventory.describe("$2a$05$" + "a" * 53),
+        )
+
+    def test_flag(self):
+        self.inventory.configure(User, flag_column_name="needs_password_reset")
+        report = self.inventory.run()
+        self.assertEqual(3, report["flagged"])
+        flagged = sorted(user.email for user in self.users if user.needs_password_reset)
+        self.assertEqual(["legacy0@example.com", "legacy1@example.com", "legacy2@example.com"], flagged)
+
+    def test_resume_and_rate_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, "inventory.json")
+            sleeps = []
+            self.inventory._sleep = sleeps.append
+            self.inventory.configure(User, page_size=2, checkpoint_path=checkpoint_path, max_rows_per_second=1)
+            report = self.inventory.run(max_pages=2)
+            self.assertFalse(report["finished"])
+            self.assertEqual(4, report["scanned"])
+            # we slept between the pages, but not after the last one
+            self.assertEqual(1, len(sleeps))
+            self.assertGreater(sleeps[0], 1)
+
+            # a new job picks up where the last one left off
+            inventory = self.context.build(HashInventory).configure(User, page_size=2, checkpoint_path=checkpoint_path)
+            report = inventory.run()
+            self.assertTrue(report["finished"])
+            self.assertEqual(8, report["scanned"])
+            self.assertEqual(3, report["needs_update"])
+            self.assertEqual(report, inventory.run())
+
+            report = inventory.run(restart=True)
+            self.assertEqual(8, report["scanned"])
+
+    def test_configure_checks(self):
+        with self.assertRaises(ValueError):
+            self.inventory.configure(User, password_column_name="secret")
+        with self.assertRaises(ValueError):
+            self.inventory.configure(User, password_column_name="email")
+        with self.assertRaises(ValueError):
+            self.inventory.configure(User, flag_column_name="locked")
+        with self.assertRaises(ValueError):
+            self.inventory.run()
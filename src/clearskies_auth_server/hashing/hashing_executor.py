@@ -0,0 +1,238 @@
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from passlib.context import CryptContext
+from .hashing_overloaded import HashingOverloaded
+
+# crypt contexts for the worker processes, by their configuration string
+_process_crypt_contexts = {}
+
+
+def _run_in_process(crypt_context_string, method, args):
+    if crypt_context_string not in _process_crypt_contexts:
+        _process_crypt_contexts[crypt_context_string] = CryptContext.from_string(crypt_context_string)
+    return getattr(_process_crypt_contexts[crypt_context_string], method)(*args)
+
+
+class HashingExecutor:
+    """
+    Runs password hashes (and verifications) with a cap on how many happen at once.
+
+    Argon2 is deliberately expensive in both CPU and memory, so if every request thread is allowed to hash at the
+    same time then a burst of login attempts can eat the whole server.  Instead, password columns with
+    `use_hashing_executor` turned on send their hashes through here, and we only let `max_concurrency` of them
+    (the number of CPUs by default) run at once.  If you set a `memory_budget` (in bytes) then we also keep the
+    total argon2 `memory_cost` of the running hashes under it.  Everyone else waits in line, but only up to
+    `max_queue` callers can wait, and only for `queue_timeout` seconds: past that we shed load by raising
+    HashingOverloaded, which the handlers turn into a quick 503 (or whatever `overloaded_status_code` says, e.g.
+    429) with a `Retry-After` header.
+
+    The `mode` decides where the hashes actually run:
+
+     1. `inline`: in the request thread (after waiting for a slot).
+     2. `thread`: in a thread pool.  argon2 releases the GIL, so this is usually all you need.
+     3. `process`: in a process pool, for hashes that hold on to the GIL.  Only the configuration string of the
+        crypt context is sent to the workers, so it must be possible to rebuild the context from it.
+
+    This is built via the dependency injection container (`di.build(HashingExecutor, cache=True)`), so there is one
+    per application.  To change the settings, configure your own and bind it to `hashing_executor`.
+    """
+
+    mode = "inline"
+    max_concurrency = None
+    memory_budget = None
+    max_queue = 100
+    queue_timeout = 5.0
+    overloaded_status_code = 503
+    retry_after = 1
+
+    modes = ["inline", "thread", "process"]
+
+    _condition = None
+    _pool = None
+    _active = 0
+    _active_memory = 0
+    _queued = 0
+    _counters = None
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pool = None
+        self._active = 0
+        self._active_memory = 0
+        self._queued = 0
+        self._counters = {
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "queue_high_water": 0,
+            "hash_seconds": 0.0,
+            "wait_seconds": 0.0,
+        }
+
+    def configure(
+        self,
+        mode=None,
+        max_concurrency=None,
+        memory_budget=None,
+        max_queue=None,
+        queue_timeout=None,
+        overloaded_status_code=None,
+        retry_after=None,
+    ):
+        if mode is not None:
+            if mode not in self.modes:
+                raise ValueError(
+                    "The hashing executor mode must be one of '" + "', '".join(self.modes) + f"', but it is '{mode}'"
+                )
+            self.mode = mode
+        if max_concurrency is not None:
+            if max_concurrency < 1:
+                raise ValueError("The hashing executor 'max_concurrency' must be at least 1")
+            self.max_concurrency = max_concurrency
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if queue_timeout is not None:
+            self.queue_timeout = queue_timeout
+        if overloaded_status_code is not None:
+            if overloaded_status_code not in [429, 503]:
+                raise ValueError("The hashing executor 'overloaded_status_code' must be either 429 or 503")
+            self.overloaded_status_code = overloaded_status_code
+        if retry_after is not None:
+            self.retry_after = retry_after
+        return self
+
+    def hash(self, crypt_context, password):
+        return self.run(crypt_context, "hash", password, memory=self.memory_cost(crypt_context))
+
+    def verify(self, crypt_context, password, hashed_password):
+        return self.run(
+            crypt_context, "verify", password, hashed_password, memory=self.memory_cost(crypt_context, hashed_password)
+        )
+
+    def verify_and_update(self, crypt_context, password, hashed_password):
+        # this may hash with the current settings after verifying with the old ones, but never both at once
+        memory = max(self.memory_cost(crypt_context), self.memory_cost(crypt_context, hashed_password))
+        return self.run(crypt_context, "verify_and_update", password, hashed_password, memory=memory)
+
+    def run(self, crypt_context, method, *args, memory=0):
+        """
+        Calls `crypt_context.{method}(*args)` once there's room, and returns the result.
+
+        `memory` is how many bytes the call will use, which only matters if there's a memory budget.
+        """
+        self._admit(memory)
+        started_at = time.monotonic()
+        succeeded = False
+        try:
+            result = self._execute(crypt_context, method, args)
+            succeeded = True
+            return result
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._active_memory -= memory
+                self._counters["completed" if succeeded else "failed"] += 1
+                self._counters["hash_seconds"] += time.monotonic() - started_at
+                self._condition.notify_all()
+
+    def memory_cost(self, crypt_context, hashed_password=None):
+        """
+        Returns how many bytes it takes to hash with the crypt context (or verify the given hash).
+
+        Only argon2 uses enough memory to count, and it tells us how much in KiB.
+        """
+        if hashed_password:
+            handler = crypt_context.identify(hashed_password, resolve=True, required=False)
+        else:
+            handler = crypt_context.handler()
+        if not handler or handler.name != "argon2":
+            return 0
+        if hashed_password:
+            try:
+                return handler.from_string(hashed_password).memory_cost * 1024
+            except ValueError:
+                return 0
+        return handler.memory_cost * 1024
+
+    def concurrency(self):
+        return self.max_concurrency if self.max_concurrency is not None else (os.cpu_count() or 1)
+
+    def stats(self):
+        with self._condition:
+            return {
+                **self._counters,
+                "active": self._active,
+                "active_memory": self._active_memory,
+                "queued": self._queued,
+            }
+
+    def close(self):
+        with self._condition:
+            pool = self._pool
+            self._pool = None
+        if pool:
+            pool.shutdown(wait=True)
+
+    def _admit(self, memory):
+        with self._condition:
+            if self._has_room(memory):
+                self._start(memory)
+                return
+            if self._queued >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise self._overloaded("There are too many password checks in progress.  Please try again shortly.")
+
+            self._queued += 1
+            self._counters["queue_high_water"] = max(self._counters["queue_high_water"], self._queued)
+            queued_at = time.monotonic()
+            try:
+                while not self._has_room(memory):
+                    remaining = queued_at + self.queue_timeout - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["rejected"] += 1
+                        raise self._overloaded(
+                            "Timed out waiting for a password check to finish.  Please try again shortly."
+                        )
+                    self._condition.wait(remaining)
+            finally:
+                self._queued -= 1
+                self._counters["wait_seconds"] += time.monotonic() - queued_at
+            self._start(memory)
+
+    def _has_room(self, memory):
+        # the condition must be held when calling this
+        if self._active >= self.concurrency():
+            return False
+        # a single hash that's bigger than the whole budget still gets to run, just on its own
+        if self.memory_budget is not None and self._active:
+            return self._active_memory + memory <= self.memory_budget
+        return True
+
+    def _start(self, memory):
+        # the condition must be held when calling this
+        self._active += 1
+        self._active_memory += memory
+
+    def _overloaded(self, message):
+        return HashingOverloaded(message, status_code=self.overloaded_status_code, retry_after=self.retry_after)
+
+    def _execute(self, crypt_context, method, args):
+        if self.mode == "inline":
+            return getattr(crypt_context, method)(*args)
+        if self.mode == "thread":
+            return self._get_pool().submit(getattr(crypt_context, method), *args).result()
+        return self._get_pool().submit(_run_in_process, crypt_context.to_string(), method, args).result()
+
+    def _get_pool(self):
+        with self._condition:
+            if self._pool is None:
+                # admission control already limits how many jobs we hand over, so the pool never has a backlog
+                pool_class = ThreadPoolExecutor if self.mode == "thread" else ProcessPoolExecutor
+                self._pool = pool_class(max_workers=self.concurrency())
+                atexit.register(self.close)
+            return self._pool
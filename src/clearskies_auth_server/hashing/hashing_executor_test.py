@@ -0,0 +1,125 @@
+import threading
+import unittest
+from passlib.context import CryptContext
+from .hashing_executor import HashingExecutor
+from .hashing_overloaded import HashingOverloaded
+
+
+class BlockingCryptContext:
+    """
+    Stands in for a crypt context, but `hash` doesn't finish until we say so.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.finish = threading.Event()
+
+    def hash(self, password):
+        self.started.set()
+        self.finish.wait(5)
+        return "hashed-" + password
+
+
+class HashingExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.crypt_context = CryptContext(schemes=["argon2"], argon2__rounds=1, argon2__memory_cost=1024)
+        self.hashing_executor = HashingExecutor()
+
+    def tearDown(self):
+        self.hashing_executor.close()
+
+    def hold_a_slot(self):
+        """
+        Starts a hash in another thread that keeps its slot until we release it.
+        """
+        blocking = BlockingCryptContext()
+        thread = threading.Thread(target=self.hashing_executor.run, args=(blocking, "hash", "password"))
+        thread.start()
+        blocking.started.wait(5)
+        return [blocking, thread]
+
+    def test_modes(self):
+        for mode in ["inline", "thread", "process"]:
+            hashing_executor = HashingExecutor().configure(mode=mode, max_concurrency=2)
+            hashed = hashing_executor.hash(self.crypt_context, "my-password")
+            self.assertTrue(self.crypt_context.verify("my-password", hashed))
+            self.assertTrue(hashing_executor.verify(self.crypt_context, "my-password", hashed))
+            self.assertFalse(hashing_executor.verify(self.crypt_context, "not-my-password", hashed))
+            stats = hashing_executor.stats()
+            self.assertEqual(3, stats["completed"])
+            self.assertEqual(0, stats["active"])
+            self.assertGreater(stats["hash_seconds"], 0)
+            hashing_executor.close()
+
+    def test_memory_cost(self):
+        self.assertEqual(1024 * 1024, self.hashing_executor.memory_cost(self.crypt_context))
+        bigger = CryptContext(schemes=["argon2"], argon2__rounds=1, argon2__memory_cost=2048).hash("password")
+        self.assertEqual(2048 * 1024, self.hashing_executor.memory_cost(self.crypt_context, bigger))
+        self.assertEqual(0, self.hashing_executor.memory_cost(CryptContext(schemes=["sha256_crypt"])))
+        self.assertEqual(0, self.hashing_executor.memory_cost(self.crypt_context, "not-a-hash"))
+
+    def test_shed_when_queue_full(self):
+        self.hashing_executor.configure(max_concurrency=1, max_queue=0, overloaded_status_code=429, retry_after=3)
+        [blocking, thread] = self.hold_a_slot()
+        with self.assertRaises(HashingOverloaded) as context:
+            self.hashing_executor.hash(self.crypt_context, "password")
+        self.assertEqual(429, context.exception.status_code)
+        self.assertEqual(3, context.exception.retry_after)
+        blocking.finish.set()
+        thread.join()
+
+        self.hashing_executor.hash(self.crypt_context, "password")
+        stats = self.hashing_executor.stats()
+        self.assertEqual(1, stats["rejected"])
+        self.assertEqual(2, stats["completed"])
+
+    def test_shed_after_queue_timeout(self):
+        self.hashing_executor.configure(max_concurrency=1, max_queue=10, queue_timeout=0.05)
+        [blocking, thread] = self.hold_a_slot()
+        with self.assertRaises(HashingOverloaded):
+            self.hashing_executor.hash(self.crypt_context, "password")
+        blocking.finish.set()
+        thread.join()
+        stats = self.hashing_executor.stats()
+        self.assertEqual(1, stats["rejected"])
+        self.assertEqual(1, stats["queue_high_water"])
+        self.assertEqual(0, stats["queued"])
+        self.assertGreater(stats["wait_seconds"], 0)
+
+    def test_queued_until_room(self):
+        self.hashing_executor.configure(max_concurrency=1, max_queue=10, queue_timeout=5)
+        [blocking, thread] = self.hold_a_slot()
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.hashing_executor.hash(self.crypt_context, "pw")))
+        waiter.start()
+        waiter.join(0.05)
+        self.assertEqual(1, self.hashing_executor.stats()["queued"])
+        blocking.finish.set()
+        waiter.join()
+        thread.join()
+        self.assertTrue(self.crypt_context.verify("pw", results[0]))
+
+    def test_memory_budget(self):
+        # room for four concurrent hashes, but only enough memory for one argon2 hash at a time
+        self.hashing_executor.configure(max_concurrency=4, memory_budget=1024 * 1024, max_queue=0)
+        blocking = BlockingCryptContext()
+        thread = threading.Thread(
+            target=self.hashing_executor.run, args=(blocking, "hash", "password"), kwargs={"memory": 1024 * 1024}
+        )
+        thread.start()
+        blocking.started.wait(5)
+        self.assertEqual(1024 * 1024, self.hashing_executor.stats()["active_memory"])
+        with self.assertRaises(HashingOverloaded):
+            self.hashing_executor.hash(self.crypt_context, "password")
+        # something that doesn't use memory can still run
+        self.hashing_executor.hash(CryptContext(schemes=["sha256_crypt"], sha256_crypt__rounds=1000), "password")
+        blocking.finish.set()
+        thread.join()
+
+    def test_configure_checks(self):
+        with self.assertRaises(ValueError):
+            self.hashing_executor.configure(mode="sideways")
+        with self.assertRaises(ValueError):
+            self.hashing_executor.configure(max_concurrency=0)
+        with self.assertRaises(ValueError):
+            self.hashing_executor.configure(overloaded_status_code=500)
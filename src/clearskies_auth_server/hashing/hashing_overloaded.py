@@ -0,0 +1,15 @@
+class HashingOverloaded(Exception):
+    """
+    Raised when the hashing executor is too busy to take on another password hash.
+
+    The handlers turn this into an error response with the given status code (a 503 by default) and a
+    `Retry-After` header, so clients back off instead of piling on.
+    """
+
+    status_code = None
+    retry_after = None
+
+    def __init__(self, message, status_code=503, retry_after=1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
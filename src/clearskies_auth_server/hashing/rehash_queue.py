@@ -0,0 +1,156 @@
+import atexit
+import threading
+from collections import OrderedDict
+
+
+class RehashQueue:
+    """
+    Upgrades password hashes in the background, after a successful login.
+
+    When the hashing settings change, the stored hash of each user needs to be upgraded, and the only time we can
+    do that is when they log in, since that's when we have their password.  Normally the password column does this
+    right away, but that means the first login after a settings change costs an extra hash plus a write.  Password
+    columns with `rehash_mode` set to `deferred` hand the job to this queue instead, and a background thread
+    calculates the new hash.
+
+    The background thread never touches the backend, since models and their backends (e.g. a database cursor) aren't
+    safe to share between threads.  Instead, finished hashes wait in the queue until the next login for a user in the
+    same model, and that request saves them (via `write_completed`).  Before saving, we re-load the user and make sure
+    the stored hash is still the one that we verified against, so if the password changed in the meantime then the
+    job is skipped (and counted as stale).
+
+    There's only one job per user in the queue at a time, and at most `max_pending` jobs in total: beyond that, jobs
+    are dropped (and counted), which is harmless since the hash will be upgraded on a later login.  Note that the
+    queue holds plain text passwords until the new hash is calculated.  Whatever is still in the queue when the
+    process exits (or when you call `close()`) is dropped.
+
+    This is built via the dependency injection container (`di.build(RehashQueue, cache=True)`), so there is one per
+    application.  To change the settings, configure your own and bind it to `rehash_queue`.
+    """
+
+    max_pending = 1000
+
+    _jobs = None
+    _completed = None
+    _condition = None
+    _thread = None
+    _closed = False
+    _counters = None
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._completed = OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._counters = {"rehashed": 0, "stale": 0, "dropped": 0, "failed": 0}
+
+    def configure(self, max_pending=None):
+        if max_pending is not None:
+            self.max_pending = max_pending
+        return self
+
+    def submit(self, password_column, user, password, hashed_password):
+        """
+        Queues up a job to re-hash the password for the user.  Returns False if the job had to be dropped.
+        """
+        job_key = (user.table_name(), str(user.get(user.id_column_name)), password_column.name)
+        with self._condition:
+            if self._closed:
+                raise ValueError("Cannot queue up password upgrades after the rehash queue has been closed")
+            self._completed.pop(job_key, None)
+            if job_key not in self._jobs and len(self._jobs) + len(self._completed) >= self.max_pending:
+                self._counters["dropped"] += 1
+                return False
+            self._jobs[job_key] = (password_column, password, hashed_password)
+            self._start()
+            self._condition.notify_all()
+        return True
+
+    def write_completed(self, password_column, users):
+        """
+        Saves the finished hashes for the given password column, through the given model (in the calling thread).
+        """
+        table_name = users.table_name()
+        with self._condition:
+            if not self._completed:
+                return
+            job_keys = [
+                job_key
+                for job_key in self._completed
+                if job_key[0] == table_name and job_key[2] == password_column.name
+            ]
+            jobs = [(job_key[1], *self._completed.pop(job_key)) for job_key in job_keys]
+        for user_id, hashed_password, new_hashed_password in jobs:
+            try:
+                is_rehashed = password_column.rehash(users, user_id, hashed_password, new_hashed_password)
+                counter = "rehashed" if is_rehashed else "stale"
+            except Exception:
+                # this is just an optimization, so if it fails we can try again the next time they log in
+                counter = "failed"
+            with self._condition:
+                self._counters[counter] += 1
+
+    def flush(self):
+        """
+        Calculates the new hash for everything in the queue right now (in the calling thread).
+
+        The hashes still need to be saved with `write_completed`.
+        """
+        while True:
+            job = self._take_job()
+            if not job:
+                return
+            self._run_job(*job)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._counters["dropped"] += len(self._jobs) + len(self._completed)
+            self._jobs.clear()
+            self._completed.clear()
+            self._condition.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def stats(self):
+        with self._condition:
+            return {**self._counters, "pending": len(self._jobs) + len(self._completed)}
+
+    def _start(self):
+        # the condition must be held when calling this
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._jobs:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            job = self._take_job()
+            if job:
+                self._run_job(*job)
+
+    def _take_job(self):
+        with self._condition:
+            if not self._jobs:
+                return None
+            return self._jobs.popitem(last=False)
+
+    def _run_job(self, job_key, job):
+        (password_column, password, hashed_password) = job
+        try:
+            new_hashed_password = password_column.hash(password)
+        except Exception:
+            with self._condition:
+                self._counters["failed"] += 1
+            return
+        with self._condition:
+            # if the user logged in again in the meantime, the newer job wins
+            if job_key not in self._jobs and not self._closed:
+                self._completed[job_key] = (hashed_password, new_hashed_password)
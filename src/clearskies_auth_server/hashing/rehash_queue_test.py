@@ -0,0 +1,117 @@
+import time
+import unittest
+from collections import OrderedDict
+import clearskies
+from clearskies.contexts import test
+from passlib.context import CryptContext
+from ..column_types import password
+from .rehash_queue import RehashQueue
+
+old_crypt_context = CryptContext(schemes=["sha256_crypt"], sha256_crypt__rounds=1000)
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                password(
+                    "password",
+                    require_repeat_password=False,
+                    crypt_context={
+                        "schemes": ["argon2", "sha256_crypt"],
+                        "deprecated": ["sha256_crypt"],
+                        "argon2__rounds": 1,
+                        "argon2__memory_cost": 1024,
+                    },
+                    rehash_mode="deferred",
+                ),
+            ]
+        )
+
+
+class RehashQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.rehash_queue = RehashQueue()
+        self.context = test(lambda: None, bindings={"rehash_queue": self.rehash_queue}, binding_classes=[User])
+        self.users = self.context.build(User)
+        self.password_column = self.users.columns()["password"]
+        # we need a user with an old style hash, which means going around the password column
+        self.user = self.users.create({"password": "my-password"})
+        self.old_hash = old_crypt_context.hash("my-password")
+        self.password_column.save_hashed_password(self.user, self.old_hash)
+
+    def tearDown(self):
+        self.rehash_queue.close()
+
+    def stored_hash(self):
+        return self.users.find(f"id={self.user.id}").get("password")
+
+    def wait_for(self, check):
+        deadline = time.monotonic() + 5
+        while not check() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_deferred_upgrade(self):
+        self.assertEqual(self.old_hash, self.stored_hash())
+        self.assertTrue(self.password_column.validate_password(self.user, "my-password"))
+        self.wait_for(lambda: self.rehash_queue._completed)
+
+        # the background thread only calculates the hash: the next login saves it
+        self.assertEqual(self.old_hash, self.stored_hash())
+        self.assertEqual(
+            {"rehashed": 0, "stale": 0, "dropped": 0, "failed": 0, "pending": 1}, self.rehash_queue.stats()
+        )
+        other_user = self.users.create({"password": "other-password"})
+        self.assertTrue(self.password_column.validate_password(other_user, "other-password"))
+        new_hash = self.stored_hash()
+        self.assertTrue(new_hash.startswith("$argon2"))
+        self.assertTrue(self.password_column.validate_password(self.users.find(f"id={self.user.id}"), "my-password"))
+        self.assertEqual(
+            {"rehashed": 1, "stale": 0, "dropped": 0, "failed": 0, "pending": 0}, self.rehash_queue.stats()
+        )
+
+    def test_stale(self):
+        self.rehash_queue.close()
+        self.rehash_queue = RehashQueue()
+        # the password changes after the login but before the upgrade runs
+        # keep the background thread from picking up the job, so we control when it runs
+        self.rehash_queue._start = lambda: None
+        self.rehash_queue.submit(self.password_column, self.user, "my-password", self.old_hash)
+        self.user.save({"password": "new-password"})
+        changed_hash = self.stored_hash()
+        self.rehash_queue.flush()
+        self.rehash_queue.write_completed(self.password_column, self.users)
+        self.assertEqual(changed_hash, self.stored_hash())
+        self.assertEqual(1, self.rehash_queue.stats()["stale"])
+
+    def test_one_job_per_user_and_max_pending(self):
+        self.rehash_queue.configure(max_pending=1)
+        self.rehash_queue._start = lambda: None
+        other_user = self.users.create({"password": "other-password"})
+        self.assertTrue(self.rehash_queue.submit(self.password_column, self.user, "my-password", self.old_hash))
+        self.assertTrue(self.rehash_queue.submit(self.password_column, self.user, "my-password", self.old_hash))
+        self.assertFalse(
+            self.rehash_queue.submit(self.password_column, other_user, "other-password", other_user.get("password"))
+        )
+        self.assertEqual(
+            {"rehashed": 0, "stale": 0, "dropped": 1, "failed": 0, "pending": 1}, self.rehash_queue.stats()
+        )
+        # a finished hash still counts against the limit until it's saved
+        self.rehash_queue.flush()
+        self.assertFalse(
+            self.rehash_queue.submit(self.password_column, other_user, "other-password", other_user.get("password"))
+        )
+        self.rehash_queue.write_completed(self.password_column, self.users)
+        self.assertEqual(1, self.rehash_queue.stats()["rehashed"])
+
+        # anything left over when the queue closes is dropped, since there's nothing to save it with
+        self.assertTrue(self.rehash_queue.submit(self.password_column, self.user, "my-password", self.old_hash))
+        self.rehash_queue.close()
+        self.assertEqual(
+            {"rehashed": 1, "stale": 0, "dropped": 3, "failed": 0, "pending": 0}, self.rehash_queue.stats()
+        )
+        with self.assertRaises(ValueError):
+            self.rehash_queue.submit(self.password_column, self.user, "my-password", self.old_hash)
@@ -0,0 +1,5 @@
+from .user_import import UserImport
+
+__all__ = [
+    "UserImport",
+]
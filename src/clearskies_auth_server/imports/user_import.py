@@ -0,0 +1,276 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from clearskies.column_types import String
+from passlib.context import CryptContext
+from ..column_types import HashedPassword, TenantId
+
+# crypt contexts for the worker processes, by their configuration string
+_process_crypt_contexts = {}
+
+
+def _hash_passwords(crypt_context_string, passwords):
+    if crypt_context_string not in _process_crypt_contexts:
+        _process_crypt_contexts[crypt_context_string] = CryptContext.from_string(crypt_context_string)
+    crypt_context = _process_crypt_contexts[crypt_context_string]
+    return [crypt_context.hash(password) for password in passwords]
+
+
+class UserImport:
+    """
+    Creates users in bulk from CSV or JSON Lines, hashing the passwords across all the CPUs.
+
+    Each row is the data for one user, with the plain text password under the name of the password column.  If
+    you're migrating from another system then you can provide the existing hash under `hashed_password_key`
+    instead, and it's saved as-is (so it has to be something that the password column's crypt context can
+    verify, and it will be upgraded the next time the user logs in).  The rows are read `batch_size` at a time:
+    the passwords in a batch are hashed in a process pool (with `processes` workers, one per CPU by default, or
+    in this process if you set it to 0), and then the users are created through the user model, with the hashes
+    marked as HashedPassword so that the password column doesn't hash them again.
+
+    Every row is checked the same way that a create handler would check it: only writeable columns are allowed,
+    and each column checks its value (e.g. required columns, email addresses, and the input requirements of the
+    password column).  The only exception is a pre-hashed password, which we can't check beyond making sure that
+    the password column can verify it.  There's no `repeat_password` in an import, so it isn't compared.
+
+    If the user model has a TenantId column then you must provide the `tenant_id` to import into, since there's
+    no request to take it from, and every imported user goes into that tenant (so rows can't set it).
+
+    A row that can't be imported (because it's rejected by the checks, or the save fails) doesn't stop the
+    import: it's counted as failed, and the first `max_errors` errors are reported (with their line number).  Clearskies models don't have a bulk insert, so a batch is
+    written one record at a time: override `write_batch` if your backend can do better.
+    """
+
+    max_errors = 100
+
+    _di = None
+    _users = None
+    _password_column = None
+    _password_column_name = None
+    _hashed_password_key = None
+    _tenant_id = None
+    _batch_size = None
+    _processes = None
+    _save_columns = None
+    _writeable_columns = None
+
+    def __init__(self, di):
+        self._di = di
+
+    def configure(
+        self,
+        user_model_class,
+        password_column_name="password",
+        hashed_password_key="hashed_password",
+        tenant_id=None,
+        batch_size=500,
+        processes=None,
+    ):
+        error_prefix = f"Configuration error for {self.__class__.__name__}:"
+        users = self._di.build(user_model_class, cache=False)
+        columns = users.columns()
+        if password_column_name not in columns:
+            raise ValueError(
+                f"{error_prefix} the password column, '{password_column_name}', does not exist in the user model '{user_model_class.__name__}'"
+            )
+        if not hasattr(columns[password_column_name], "crypt_context"):
+            raise ValueError(
+                f"{error_prefix} the password column, '{password_column_name}', in model '{user_model_class.__name__}' is not a password column"
+            )
+        if batch_size < 1:
+            raise ValueError(f"{error_prefix} 'batch_size' must be at least 1")
+
+        # the tenant id (if any) comes from us rather than from the request.
+        save_columns = {}
+        tenant_id_columns = [column for column in columns.values() if isinstance(column, TenantId)]
+        if tenant_id_columns and not tenant_id:
+            raise ValueError(
+                f"{error_prefix} the user model '{user_model_class.__name__}' has a tenant id column, so you must provide the 'tenant_id' to import into"
+            )
+        if tenant_id and not tenant_id_columns:
+            raise ValueError(
+                f"{error_prefix} you provided a 'tenant_id' but the user model '{user_model_class.__name__}' doesn't have a tenant id column"
+            )
+        for tenant_id_column in tenant_id_columns:
+            tenants = tenant_id_column.parent_models
+            if not tenants.find(f"{tenants.id_column_name}={tenant_id}").exists:
+                raise ValueError(f"{error_prefix} the tenant '{tenant_id}' does not exist")
+            save_columns[tenant_id_column.name] = self._plain_column(tenant_id_column.name, user_model_class)
+
+        self._users = users
+        self._password_column = columns[password_column_name]
+        self._password_column_name = password_column_name
+        self._hashed_password_key = hashed_password_key
+        self._tenant_id = tenant_id
+        self._batch_size = batch_size
+        self._processes = processes
+        self._save_columns = save_columns
+        self._writeable_columns = {name: column for (name, column) in columns.items() if column.is_writeable}
+        return self
+
+    def import_csv(self, stream):
+        """
+        Imports users from a CSV file (with a header row).  Empty values are left out.
+        """
+
+        def rows():
+            for index, row in enumerate(csv.DictReader(stream)):
+                # the header is line 1
+                if None in row:
+                    yield (index + 2, ValueError("There are more values than columns in the header"))
+                    continue
+                yield (index + 2, {key: value for (key, value) in row.items() if value != ""})
+
+        return self.run(rows())
+
+    def import_json_lines(self, stream):
+        """
+        Imports users from JSON Lines: one JSON object per line.  Blank lines are skipped.
+        """
+
+        def rows():
+            for index, line in enumerate(stream):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    row = ValueError(f"Invalid JSON: {e}")
+                yield (index + 1, row)
+
+        return self.run(rows())
+
+    def run(self, rows):
+        """
+        Imports users from an iterable of (line number, row) tuples, and returns a report.
+
+        The report has the number of users `imported` and `failed`, how many passwords we `hashed`, how many came
+        `prehashed`, and the (first few) `errors`.
+        """
+        if self._users is None:
+            raise ValueError(f"You must call configure() before running the {self.__class__.__name__}")
+        report = {"imported": 0, "failed": 0, "hashed": 0, "prehashed": 0, "errors": []}
+        processes = self._processes if self._processes is not None else (os.cpu_count() or 1)
+        pool = ProcessPoolExecutor(max_workers=processes) if processes else None
+        try:
+            batch = []
+            for line_number, row in rows:
+                batch.append((line_number, row))
+                if len(batch) >= self._batch_size:
+                    self._import_batch(batch, pool, processes, report)
+                    batch = []
+            if batch:
+                self._import_batch(batch, pool, processes, report)
+        finally:
+            if pool:
+                pool.shutdown()
+        return report
+
+    def write_batch(self, batch):
+        """
+        Creates the users for a batch of (line number, data) tuples, and returns the errors as (line number, message).
+        """
+        errors = []
+        for line_number, data in batch:
+            try:
+                self._users.empty_model().save(data, columns=self._save_columns)
+            except Exception as e:
+                errors.append((line_number, str(e)))
+        return errors
+
+    def _import_batch(self, batch, pool, processes, report):
+        to_write = []
+        to_hash = []
+        for line_number, row in batch:
+            try:
+                (data, password) = self._prepare(row)
+            except ValueError as e:
+                self._error(report, line_number, str(e))
+                continue
+            to_write.append((line_number, data))
+            if password:
+                to_hash.append((data, password))
+            else:
+                report["prehashed"] += 1
+
+        hashes = self._hash([password for (data, password) in to_hash], pool, processes)
+        for (data, password), hashed_password in zip(to_hash, hashes):
+            data[self._password_column_name] = HashedPassword(hashed_password)
+        report["hashed"] += len(hashes)
+
+        errors = self.write_batch(to_write)
+        for line_number, message in errors:
+            self._error(report, line_number, message)
+        report["imported"] += len(to_write) - len(errors)
+
+    def _prepare(self, row):
+        """
+        Checks a row and returns the data to save, along with the password to hash (if it isn't already hashed).
+        """
+        # the readers hand over rows that they couldn't parse as exceptions
+        if isinstance(row, Exception):
+            raise ValueError(str(row))
+        if not isinstance(row, dict):
+            raise ValueError("Each row must be an object")
+        data = {key: value for (key, value) in row.items() if value is not None}
+        password = data.pop(self._password_column_name, None)
+        hashed_password = data.pop(self._hashed_password_key, None)
+        if password and hashed_password:
+            raise ValueError(
+                f"Provide either '{self._password_column_name}' or '{self._hashed_password_key}', but not both"
+            )
+        if not password and not hashed_password:
+            raise ValueError(f"Missing '{self._password_column_name}' (or '{self._hashed_password_key}')")
+        if hashed_password:
+            if not self._password_column.crypt_context.identify(hashed_password, required=False):
+                raise ValueError(f"The '{self._hashed_password_key}' is not a hash that the password column can verify")
+        self._check_input(data, password)
+        if hashed_password:
+            data[self._password_column_name] = HashedPassword(hashed_password)
+        for column_name in self._save_columns:
+            data[column_name] = self._tenant_id
+        return (data, password)
+
+    def _check_input(self, data, password):
+        """
+        Runs the checks of the user model's columns on the row, and raises a ValueError if anything is wrong.
+        """
+        input_errors = {
+            column_name: f"'{column_name}' is not an allowed column"
+            for column_name in data
+            if column_name not in self._writeable_columns
+        }
+        model = self._users.empty_model()
+        for column_name, column in self._writeable_columns.items():
+            if column_name != self._password_column_name:
+                input_errors = {**input_errors, **column.input_errors(model, data)}
+            elif password:
+                # nobody types the password twice for an import, so the only repeat is the password itself
+                input_data = {**data, column_name: password, "repeat_password": password}
+                input_errors = {**input_errors, **column.input_errors(model, input_data)}
+        if input_errors:
+            raise ValueError(", ".join(f"{column_name}: {error}" for (column_name, error) in input_errors.items()))
+
+    def _hash(self, passwords, pool, processes):
+        if not passwords:
+            return []
+        crypt_context = self._password_column.crypt_context
+        if not pool:
+            return [crypt_context.hash(password) for password in passwords]
+        # one chunk per worker, so we only send the crypt context over once per worker per batch
+        chunk_size = -(-len(passwords) // processes)
+        chunks = [passwords[start : start + chunk_size] for start in range(0, len(passwords), chunk_size)]
+        crypt_context_string = crypt_context.to_string()
+        results = pool.map(_hash_passwords, [crypt_context_string] * len(chunks), chunks)
+        return [hashed_password for chunk in results for hashed_password in chunk]
+
+    def _error(self, report, line_number, message):
+        report["failed"] += 1
+        if len(report["errors"]) < self.max_errors:
+            report["errors"].append(f"Line {line_number}: {message}")
+
+    def _plain_column(self, name, model_class):
+        column = self._di.build(String, cache=False)
+        column.configure(name, {}, model_class)
+        return column
@@ -0,0 +1,156 @@
+import io
+import json
+import unittest
+from collections import OrderedDict
+import clearskies
+from clearskies.column_types import email, string
+from clearskies.input_requirements import minimum_length, required
+from clearskies.contexts import test
+from passlib.context import CryptContext
+from ..column_types import password, tenant_id
+from .user_import import UserImport
+
+crypt_context = {"schemes": ["argon2"], "argon2__rounds": 1, "argon2__memory_cost": 1024}
+
+
+class User(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email", input_requirements=[required()]),
+                string("name"),
+                password("password", crypt_context=crypt_context, input_requirements=[minimum_length(8)]),
+            ]
+        )
+
+
+class Tenant(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict([string("name")])
+
+
+class TenantUser(clearskies.Model):
+    def __init__(self, memory_backend, columns):
+        super().__init__(memory_backend, columns)
+
+    def columns_configuration(self):
+        return OrderedDict(
+            [
+                email("email"),
+                password("password", crypt_context=crypt_context),
+                tenant_id("tenant_id", parent_models_class=Tenant, source="routing_data", source_key_name="tenant_id"),
+            ]
+        )
+
+
+class UserImportTest(unittest.TestCase):
+    def setUp(self):
+        self.context = test(lambda: None, binding_classes=[User, Tenant, TenantUser])
+        self.users = self.context.build(User)
+        self.crypt_context = CryptContext(**crypt_context)
+
+    def test_csv(self):
+        prehashed = self.crypt_context.hash("old-password")
+        # pre-hashed passwords can't be checked against the input requirements of the password column
+        short_prehashed = self.crypt_context.hash("short")
+        stream = io.StringIO(
+            "email,name,password,hashed_password\n"
+            + "a@example.com,Alice,alice-password,\n"
+            + f'b@example.com,Bob,,"{prehashed}"\n'
+            + "e@example.com,Eve,eve-password,,extra\n"
+            + "c@example.com,Carol,,\n"
+            + "d@example.com,Dan,dan-password,\n"
+            + "f@example.com,Frank,short,\n"
+            + "not-an-email,Grace,grace-password,\n"
+            + ",Heidi,heidi-password,\n"
+            + f'i@example.com,Ivan,,"{short_prehashed}"\n'
+        )
+        user_import = self.context.build(UserImport).configure(User, batch_size=2, processes=0)
+        report = user_import.import_csv(stream)
+        self.assertEqual(
+            {
+                "imported": 4,
+                "failed": 5,
+                "hashed": 2,
+                "prehashed": 2,
+                "errors": [
+                    "Line 4: There are more values than columns in the header",
+                    "Line 5: Missing 'password' (or 'hashed_password')",
+                    "Line 7: password: 'password' must be at least 8 characters long.",
+                    "Line 8: email: Invalid email address",
+                    "Line 9: email: 'email' is required.",
+                ],
+            },
+            report,
+        )
+        users = {user.email: user for user in self.users}
+        self.assertEqual(["a@example.com", "b@example.com", "d@example.com", "i@example.com"], sorted(users.keys()))
+        self.assertEqual("Alice", users["a@example.com"].name)
+        # the passwords were hashed once, and the pre-hashed password was saved as-is
+        self.assertTrue(self.crypt_context.verify("alice-password", users["a@example.com"].get("password")))
+        self.assertTrue(self.crypt_context.verify("dan-password", users["d@example.com"].get("password")))
+        self.assertEqual(prehashed, users["b@example.com"].get("password"))
+
+    def test_json_lines_with_process_pool(self):
+        lines = [json.dumps({"email": f"user{i}@example.com", "password": f"password{i}"}) for i in range(5)]
+        lines.insert(2, "")
+        lines.append("{not json")
+        lines.append(json.dumps({"email": "z@example.com", "hashed_password": "not-a-hash"}))
+        user_import = self.context.build(UserImport).configure(User, batch_size=3, processes=2)
+        report = user_import.import_json_lines(io.StringIO("\n".join(lines)))
+        self.assertEqual(5, report["imported"])
+        self.assertEqual(5, report["hashed"])
+        self.assertEqual(2, report["failed"])
+        self.assertTrue(report["errors"][0].startswith("Line 7: Invalid JSON"))
+        self.assertEqual(
+            "Line 8: The 'hashed_password' is not a hash that the password column can verify", report["errors"][1]
+        )
+        for user in self.users:
+            number = user.email[4]
+            self.assertTrue(self.crypt_context.verify(f"password{number}", user.get("password")))
+
+    def test_tenant_id(self):
+        tenant = self.context.build(Tenant).create({"name": "Acme"})
+        user_import = self.context.build(UserImport).configure(TenantUser, tenant_id=tenant.id, processes=0)
+        report = user_import.import_json_lines(io.StringIO(json.dumps({"email": "a@example.com", "password": "pw"})))
+        self.assertEqual(1, report["imported"])
+        user = self.context.build(TenantUser).find("email=a@example.com")
+        self.assertEqual(tenant.id, user.tenant_id)
+
+        # rows only get to set writeable columns, so they can't pick their own tenant
+        rows = [
+            json.dumps({"email": "b@example.com", "password": "pw", "tenant_id": "other"}),
+            json.dumps({"email": "c@example.com", "password": "pw", "role": "admin"}),
+        ]
+        report = user_import.import_json_lines(io.StringIO("\n".join(rows)))
+        self.assertEqual(0, report["imported"])
+        self.assertEqual(
+            [
+                "Line 1: tenant_id: 'tenant_id' is not an allowed column",
+                "Line 2: role: 'role' is not an allowed column",
+            ],
+            report["errors"],
+        )
+
+    def test_configure_checks(self):
+        user_import = self.context.build(UserImport)
+        with self.assertRaises(ValueError):
+            user_import.run([])
+        with self.assertRaises(ValueError):
+            user_import.configure(User, password_column_name="secret")
+        with self.assertRaises(ValueError):
+            user_import.configure(User, password_column_name="name")
+        with self.assertRaises(ValueError) as context:
+            user_import.configure(TenantUser)
+        self.assertIn("you must provide the 'tenant_id'", str(context.exception))
+        with self.assertRaises(ValueError) as context:
+            user_import.configure(TenantUser, tenant_id="nope")
+        self.assertIn("does not exist", str(context.exception))
+        with self.assertRaises(ValueError):
+            user_import.configure(User, tenant_id="5")
@@ -0,0 +1,27 @@
+from .algorithms import (
+    build_signer,
+    default_algorithms,
+    jws_algorithm,
+    public_jwk,
+    public_key_fields,
+    signing_algorithms,
+)
+from .key_generator import KeyGenerator
+from .key_store import KeyStore
+from .manifest import build_manifest, is_manifest, key_index, key_path, key_storage_layouts
+
+__all__ = [
+    "build_manifest",
+    "build_signer",
+    "default_algorithms",
+    "is_manifest",
+    "jws_algorithm",
+    "key_index",
+    "key_path",
+    "key_storage_layouts",
+    "KeyGenerator",
+    "KeyStore",
+    "public_jwk",
+    "public_key_fields",
+    "signing_algorithms",
+]
@@ -0,0 +1,96 @@
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, padding
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from jwcrypto.common import base64url_encode, json_encode
+
+# The algorithms that can be configured for key generation, and the kind of key that each one needs.
+# Note that 'RSA256' isn't actually a JWS algorithm name: it's what this package has always stored in the
+# 'alg' field of its RSA keys, so we keep supporting it as an alias for RS256.
+signing_algorithms = {
+    "RSA256": {"key_type": "RSA", "curve": None},
+    "RS256": {"key_type": "RSA", "curve": None},
+    "ES256": {"key_type": "EC", "curve": "P-256"},
+    "EdDSA": {"key_type": "OKP", "curve": "Ed25519"},
+}
+
+# the algorithm we use when only the key type is configured
+default_algorithms = {
+    "RSA": "RSA256",
+    "EC": "ES256",
+    "OKP": "EdDSA",
+}
+
+# the fields (besides kid/use/kty/alg) that make up the public part of each kind of key
+public_key_fields = {
+    "RSA": ["e", "n"],
+    "EC": ["crv", "x", "y"],
+    "OKP": ["crv", "x"],
+}
+
+# what we actually put in the 'alg' header of a JWT signed with each kind of key
+jws_algorithms_by_curve = {
+    "P-256": "ES256",
+    "Ed25519": "EdDSA",
+}
+
+
+def jws_algorithm(key):
+    """
+    Returns the JWS algorithm name (for the JWT header) for the given key.
+
+    The key can be a jwk.JWK or the key data straight out of the secret manager.  We go off of the key type
+    and curve instead of the 'alg' field because older keys have 'RSA256' in there, which isn't a real JWS alg.
+    """
+    key_type = key["kty"]
+    if key_type == "RSA":
+        return "RS256"
+    curve = key.get("crv")
+    if key_type not in public_key_fields or curve not in jws_algorithms_by_curve:
+        raise ValueError(f"Unsupported key for key id '{key.get('kid')}': key type '{key_type}' with curve '{curve}'")
+    return jws_algorithms_by_curve[curve]
+
+
+def public_jwk(key_data):
+    """
+    Returns the public JWK for the given key data, suitable for publishing in a JWKS.
+    """
+    key_type = key_data["kty"]
+    if key_type not in public_key_fields:
+        raise ValueError(f"Unsupported key type for key id '{key_data.get('kid')}': '{key_type}'")
+    return {
+        "kid": key_data["kid"],
+        "use": key_data["use"],
+        **{field: key_data[field] for field in public_key_fields[key_type]},
+        "kty": key_type,
+        "alg": key_data["alg"],
+    }
+
+
+def build_signer(signing_key):
+    """
+    Builds everything needed to sign JWTs with the given jwk.JWK private key.
+
+    Returns a dictionary with the base64url encoded JWT header (as bytes) and a function that accepts the
+    JWS signing input and returns the raw signature.  The signatures are exactly what jwcrypto would
+    generate (including the raw r||s format for ECDSA), so tokens are interchangeable with ones built
+    through jwcrypto directly.
+    """
+    algorithm = jws_algorithm(signing_key)
+    header = {"alg": algorithm, "typ": "JWT", "kid": signing_key["kid"]}
+    encoded_header = base64url_encode(json_encode(header)).encode("utf-8")
+
+    if algorithm == "RS256":
+        private_key = signing_key.get_op_key("sign")
+        sign = lambda signing_input: private_key.sign(signing_input, padding.PKCS1v15(), hashes.SHA256())
+    elif algorithm == "ES256":
+        private_key = signing_key.get_op_key("sign", signing_key["crv"])
+
+        def sign(signing_input):
+            (r, s) = decode_dss_signature(private_key.sign(signing_input, ec.ECDSA(hashes.SHA256())))
+            return r.to_bytes(32, "big") + s.to_bytes(32, "big")
+
+    else:
+        private_key = signing_key.get_op_key("sign")
+        sign = lambda signing_input: private_key.sign(signing_input)
+
+    return {"algorithm": algorithm, "kid": signing_key["kid"], "encoded_header": encoded_header, "sign": sign}
@@ -0,0 +1,153 @@
+import json
+import threading
+from jwcrypto import jwk
+
+
+class KeyGenerator:
+    """
+    Generates signing keys outside of the request that asks for them.
+
+    Generating a large RSA key can take seconds, which is a long time to keep a request waiting, so the
+    CreateKey handler can use this in one of two ways:
+
+     1. `take()` hands out a key from a small pool of keys that were generated ahead of time (and then tops the
+        pool back up in a background thread).
+     2. `submit()` starts a job that generates (and saves) the key in a background thread.  Until it finishes,
+        the job shows up in `pending()`, which is how the ListKeys handler can show keys that are on their way.
+
+    Like the key store, this is built via the dependency injection container (`di.build(KeyGenerator, cache=True)`)
+    so there is one per application, and you can replace it by binding your own object to `key_generator`.  Note
+    that the pool and the jobs live in memory, so they belong to a single process.
+    """
+
+    _pools = None
+    _filling = None
+    _jobs = None
+    _threads = None
+    _lock = None
+    _save_lock = None
+
+    def __init__(self):
+        self._pools = {}
+        self._filling = set()
+        self._jobs = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def generate(self, key_id, key_spec):
+        """
+        Generates a key right now.
+
+        The key spec has everything that `jwk.JWK.generate` needs except the key id (e.g. `kty`, `alg`, and
+        `size` or `crv`).
+        """
+        if not key_id:
+            return jwk.JWK.generate(use="sig", **key_spec)
+        return jwk.JWK.generate(kid=key_id, use="sig", **key_spec)
+
+    def take(self, key_id, key_spec, pool_size):
+        """
+        Returns a key from the pool for the given key spec, generating one now if the pool is empty.
+
+        Either way, the pool is refilled (up to `pool_size` keys) in the background.
+        """
+        pool_name = self._pool_name(key_spec)
+        with self._lock:
+            pool = self._pools.setdefault(pool_name, [])
+            key_data = pool.pop() if pool else None
+        self.fill_pool(key_spec, pool_size)
+        if not key_data:
+            return self.generate(key_id, key_spec)
+        return jwk.JWK(**{**key_data, "kid": key_id})
+
+    def fill_pool(self, key_spec, pool_size):
+        """
+        Starts generating keys in the background until the pool for the key spec has `pool_size` keys in it.
+
+        You can call this when your application starts up so that the pool is ready before the first request.
+        """
+        pool_name = self._pool_name(key_spec)
+        with self._lock:
+            # we only ever run one filler per pool
+            if pool_name in self._filling:
+                return
+            self._pools.setdefault(pool_name, [])
+            self._filling.add(pool_name)
+        self._start(self._fill_pool, pool_name, key_spec, pool_size)
+
+    def pool_size(self, key_spec):
+        with self._lock:
+            return len(self._pools.get(self._pool_name(key_spec), []))
+
+    def submit(self, key_id, key_spec, pool_size, save):
+        """
+        Starts a job to generate a key and then save it by calling `save(key)`.
+
+        Saves are run one at a time, so concurrent jobs can safely read, modify, and write the key sets.
+        """
+        with self._lock:
+            self._jobs[key_id] = {
+                "id": key_id,
+                "algorithm": key_spec["alg"],
+                "status": "pending",
+                "error": None,
+            }
+        self._start(self._run_job, key_id, key_spec, pool_size, save)
+
+    def pending(self):
+        """
+        Returns the jobs that haven't finished yet, along with any that failed.
+        """
+        with self._lock:
+            return [{**job} for job in self._jobs.values()]
+
+    def wait(self, timeout=None):
+        """
+        Waits for all background work to finish (including any work that it starts along the way).
+        """
+        while True:
+            with self._lock:
+                self._threads = [thread for thread in self._threads if thread.is_alive()]
+                threads = [*self._threads]
+            if not threads:
+                return
+            for thread in threads:
+                thread.join(timeout)
+
+    def _start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        with self._lock:
+            self._threads = [running for running in self._threads if running.is_alive()] + [thread]
+        thread.start()
+
+    def _fill_pool(self, pool_name, key_spec, pool_size):
+        try:
+            while True:
+                with self._lock:
+                    # we have to decide that we're done in the same breath that we stop being the filler,
+                    # otherwise a key could be taken in between and nobody would replace it.
+                    if len(self._pools[pool_name]) >= pool_size:
+                        self._filling.discard(pool_name)
+                        return
+                key_data = json.loads(self.generate(None, key_spec).export_private())
+                with self._lock:
+                    self._pools[pool_name].append(key_data)
+        except Exception as e:
+            with self._lock:
+                self._filling.discard(pool_name)
+            raise e
+
+    def _run_job(self, key_id, key_spec, pool_size, save):
+        try:
+            key = self.take(key_id, key_spec, pool_size) if pool_size else self.generate(key_id, key_spec)
+            with self._save_lock:
+                save(key)
+            with self._lock:
+                del self._jobs[key_id]
+        except Exception as e:
+            with self._lock:
+                self._jobs[key_id] = {**self._jobs[key_id], "status": "failed", "error": str(e)}
+
+    def _pool_name(self, key_spec):
+        return json.dumps(key_spec, sort_keys=True)
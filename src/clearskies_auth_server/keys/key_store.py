@@ -0,0 +1,355 @@
+import json
+import threading
+from jwcrypto import jwk
+from .algorithms import build_signer
+from .manifest import build_manifest, is_manifest, key_index, key_path
+
+
+class KeyStore:
+    """
+    Holds the key sets from the secret manager, shared by every handler (and JwksDirect) that needs them.
+
+    This is built via the dependency injection container (`di.build(KeyStore, cache=True)`) so there is one
+    instance per application, and you can replace it by binding your own object to `key_store`.  For each path
+    we keep exactly one copy of the key data, along with the keys we've parsed out of it and anything else that
+    consumers have derived from it (e.g. the JWKS).  That's all thrown away whenever a refresh finds that the
+    raw key data has changed.
+
+    Key sets can be stored in either the single or the per-key layout (see keys.manifest), and we figure out which
+    one we're looking at every time we load it.  With the per-key layout we only fetch the manifest up front,
+    and individual keys are fetched (once) when someone actually needs them.
+
+    It's safe to use from multiple threads.  Refreshes are coalesced: when the cache for a path expires, the
+    first thread fetches the keys from the secret manager and any other threads that need them wait for that
+    fetch instead of making their own.
+
+    Callers can also ask for background refreshes, in which case we start reloading the keys in a separate
+    thread once they are `refresh_ahead_fraction` of the way to expiring, and keep handing out the keys we have
+    in the meantime, so no request has to wait on the secret manager (except the very first one).  That only
+    applies to keys that are getting old, though: once the keys have been invalidated (e.g. because we just saved
+    new ones) the next request reloads them right away, so nobody is handed keys that we know are out of date.
+    Either way, if a refresh fails (the secret manager errors out, or returns garbage or nothing at all) then we
+    keep serving the last good key set and try again after `retry_interval` seconds.
+    """
+
+    refresh_ahead_fraction = 0.8
+    retry_interval = 30
+
+    _secrets = None
+    _datetime = None
+    _entries = None
+    _path_locks = None
+    _lock = None
+    _counters = None
+    _background_refreshes = None
+
+    def __init__(self, secrets, datetime):
+        self._secrets = secrets
+        self._datetime = datetime
+        self._entries = {}
+        self._path_locks = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+        self._background_refreshes = {}
+
+    def get_key_data(self, path, max_age, use_cache=True, background=False):
+        """
+        Returns the key data stored at the given path.
+
+        The key data is shared, so don't modify it: build a new dictionary if you need to change the keys.
+        With the per-key layout this has to fetch every key, so use get_key_index if you don't need the keys.
+        """
+        return self._get_key_data(path, self._get_entry(path, max_age, use_cache=use_cache, background=background))
+
+    def get_key_index(self, path, max_age, use_cache=True, background=False):
+        """
+        Returns the algorithm, key type, and issue date of each key at the path, without fetching the keys themselves.
+        """
+        return self._get_entry(path, max_age, use_cache=use_cache, background=background)["index"]
+
+    def get_youngest_key_id(self, path, max_age, use_cache=True, background=False):
+        return self._get_entry(path, max_age, use_cache=use_cache, background=background)["youngest_key_id"]
+
+    def get_oldest_key_id(self, path, max_age, use_cache=True, background=False):
+        return self._get_entry(path, max_age, use_cache=use_cache, background=background)["oldest_key_id"]
+
+    def get_key(self, path, key_id, max_age, use_cache=True, background=False):
+        return self._get_key(path, self._get_entry(path, max_age, use_cache=use_cache, background=background), key_id)
+
+    def get_parsed_key(self, path, key_id, max_age, use_cache=True, background=False):
+        return self._get_parsed_key(
+            path, self._get_entry(path, max_age, use_cache=use_cache, background=background), key_id
+        )
+
+    def get_signer(self, path, max_age, use_cache=True, background=False):
+        """
+        Returns the signer (see keys.build_signer) for the current signing key (the youngest key) at the path.
+        """
+        entry = self._get_entry(path, max_age, use_cache=use_cache, background=background)
+        key_id = entry["youngest_key_id"]
+        if not key_id:
+            raise ValueError(f"There are no keys stored in '{path}'")
+        return self._from_entry(
+            path, entry, "signers", key_id, lambda: build_signer(self._get_parsed_key(path, entry, key_id))
+        )
+
+    def get_derived(self, path, name, builder, max_age, use_cache=True, background=False):
+        """
+        Returns something built out of the key data, which is only re-built when the key data changes.
+
+        The builder is called with the key data and its result is cached under the given name.
+        """
+        entry = self._get_entry(path, max_age, use_cache=use_cache, background=background)
+        return self._from_entry(path, entry, "derived", name, lambda: builder(self._get_key_data(path, entry)))
+
+    def save(self, path, key_data, layout="single"):
+        """
+        Saves the key data at the path, in the given layout (`single` or `per_key`).
+
+        The key data is always the full key set, regardless of the layout.  If the keys are currently stored in
+        the other layout then this migrates them.  With the per-key layout, only new keys are written out, and
+        keys that are no longer in the key set are blanked out (after the manifest stops referencing them).
+        """
+        # we need to know what's there now.  Our cache may be behind (e.g. another process saved keys since we
+        # loaded them), and building on an old manifest would re-use its version and leave keys behind, so we
+        # always read the manifest from the secret manager.
+        current_data = self._secrets.get(path, silent_if_not_found=True)
+        current_manifest = json.loads(current_data) if current_data else None
+        if not is_manifest(current_manifest):
+            current_manifest = None
+
+        if layout == "per_key":
+            existing_key_ids = set(current_manifest["keys"].keys()) if current_manifest else set()
+            for key_id, key in key_data.items():
+                if key_id not in existing_key_ids:
+                    self._secrets.upsert(key_path(path, key_id), json.dumps(key))
+            version = current_manifest["version"] + 1 if current_manifest else 1
+            self._secrets.upsert(path, json.dumps(build_manifest(key_data, version)))
+        else:
+            self._secrets.upsert(path, json.dumps(key_data))
+
+        if current_manifest:
+            for key_id in current_manifest["keys"]:
+                if layout != "per_key" or key_id not in key_data:
+                    self._secrets.upsert(key_path(path, key_id), "")
+        self.invalidate(path)
+
+    def migrate(self, path, layout):
+        """
+        Re-saves the keys at the path in the given layout.
+        """
+        self.save(path, self.get_key_data(path, 0, use_cache=False), layout=layout)
+
+    def refresh(self, path, min_interval):
+        """
+        Reloads the keys at the path right now, unless they were (re)loaded less than `min_interval` seconds ago.
+
+        This is for when the caller has reason to think that the keys have changed (e.g. it was handed a JWT
+        signed by a key it doesn't know about).  Concurrent calls are coalesced, and the interval stops anyone
+        from hammering the secret manager.  Returns True if the keys were actually reloaded.
+        """
+        entry = self._entries.get(path)
+        if self._checked_since(entry, min_interval):
+            return False
+        with self._get_path_lock(path):
+            current_entry = self._entries.get(path)
+            if self._checked_since(current_entry, min_interval):
+                return False
+            self._refresh(path, current_entry)
+            return True
+
+    def invalidate(self, path):
+        # we hold on to the entry (marked as stale) so that anything that survives a change in the key set
+        # (e.g. keys we've already fetched with the per-key layout) can be carried over to the next one.
+        with self._lock:
+            if path in self._entries:
+                self._entries[path] = {**self._entries[path], "invalidated": True}
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters}
+
+    def get_age(self, path):
+        """
+        Returns the number of seconds since the keys at the path were last loaded successfully (None if never).
+        """
+        entry = self._entries.get(path)
+        if not entry:
+            return None
+        return (self._datetime.datetime.now() - entry["cache_time"]).total_seconds()
+
+    def get_last_error(self, path):
+        """
+        Returns the error from the last refresh for the path, or None if it succeeded.
+        """
+        entry = self._entries.get(path)
+        return entry["last_error"] if entry else None
+
+    def wait_for_background_refreshes(self, timeout=None):
+        with self._lock:
+            threads = list(self._background_refreshes.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def _get_entry(self, path, max_age, use_cache=True, background=False):
+        entry = self._entries.get(path)
+        if use_cache and entry:
+            if self._is_fresh(entry, max_age * self.refresh_ahead_fraction if background else max_age):
+                self._count("hits")
+                return entry
+            # an invalidated entry is known to be out of date, so it has to be reloaded before anyone can use it
+            if background and not entry["invalidated"]:
+                self._start_background_refresh(path, max_age)
+                self._count("hits")
+                return entry
+
+        with self._get_path_lock(path):
+            # someone else may have refreshed the keys while we were waiting for the lock.
+            current_entry = self._entries.get(path)
+            if current_entry is not entry and self._is_fresh(current_entry, max_age):
+                self._count("hits")
+                return current_entry
+
+            return self._refresh(path, current_entry)
+
+    def _refresh(self, path, current_entry):
+        # the path lock must be held when calling this
+        self._count("refreshes" if current_entry else "misses")
+        try:
+            new_entry = self._load(path, current_entry)
+        except Exception as e:
+            # with nothing to fall back on, all we can do is complain.
+            if not current_entry:
+                raise e
+            self._count("refresh_errors")
+            new_entry = {**current_entry, "checked_time": self._datetime.datetime.now(), "last_error": str(e)}
+        with self._lock:
+            self._entries[path] = new_entry
+        return new_entry
+
+    def _start_background_refresh(self, path, max_age):
+        with self._lock:
+            if path in self._background_refreshes:
+                return
+            thread = threading.Thread(target=self._background_refresh, args=(path, max_age), daemon=True)
+            self._background_refreshes[path] = thread
+        thread.start()
+
+    def _background_refresh(self, path, max_age):
+        try:
+            with self._get_path_lock(path):
+                current_entry = self._entries.get(path)
+                if not self._is_fresh(current_entry, max_age * self.refresh_ahead_fraction):
+                    self._refresh(path, current_entry)
+        finally:
+            with self._lock:
+                del self._background_refreshes[path]
+
+    def _is_fresh(self, entry, max_age):
+        if not entry or entry["invalidated"]:
+            return False
+        now = self._datetime.datetime.now()
+        if entry["last_error"]:
+            retry_interval = min(max_age, self.retry_interval)
+            return entry["checked_time"] > now - self._datetime.timedelta(seconds=retry_interval)
+        return entry["cache_time"] > now - self._datetime.timedelta(seconds=max_age)
+
+    def _checked_since(self, entry, seconds):
+        if not entry or entry["invalidated"]:
+            return False
+        return entry["checked_time"] > self._datetime.datetime.now() - self._datetime.timedelta(seconds=seconds)
+
+    def _load(self, path, previous_entry):
+        raw_data = self._secrets.get(path, silent_if_not_found=True)
+        now = self._datetime.datetime.now()
+        # if nothing changed then we can keep everything we've already parsed.
+        if previous_entry and previous_entry["raw_data"] == raw_data:
+            return {**previous_entry, "cache_time": now, "checked_time": now, "last_error": None, "invalidated": False}
+        if previous_entry and previous_entry["index"] and not raw_data:
+            raise ValueError(f"The key data in '{path}' has gone missing")
+
+        key_data = self._check_key_data(path, raw_data) if raw_data else {}
+        manifest = None
+        if is_manifest(key_data):
+            manifest = key_data
+            index = key_data["keys"]
+            youngest_key_id = key_data["active_key_id"]
+            # keys never change once they're created, so we can hold on to any that we've already fetched
+            previous_keys = previous_entry["fetched"] if previous_entry else {}
+            fetched = {key_id: key for (key_id, key) in previous_keys.items() if key_id in index}
+            key_data = None
+        else:
+            index = key_index(key_data)
+            youngest_key_id = max(index, key=lambda key_id: index[key_id]["issue_date"]) if index else None
+            fetched = key_data
+        return {
+            "raw_data": raw_data,
+            "key_data": key_data,
+            "index": index,
+            "manifest": manifest,
+            "fetched": fetched,
+            "cache_time": now,
+            "checked_time": now,
+            "last_error": None,
+            "invalidated": False,
+            "youngest_key_id": youngest_key_id,
+            "oldest_key_id": min(index, key=lambda key_id: index[key_id]["issue_date"]) if index else None,
+            "keys": {},
+            "signers": {},
+            "derived": {},
+        }
+
+    def _check_key_data(self, path, raw_data):
+        try:
+            key_data = json.loads(raw_data)
+        except json.JSONDecodeError as e:
+            raise ValueError(
+                f"I fetched the key data from '{path}'.  It should have been a JSON encoded object but it isn't JSON.  Sorry :("
+            )
+
+        actual_type = type(key_data)
+        if actual_type != dict:
+            raise ValueError(
+                f"The key data stored in '{path}' should have been a dictionary but instead was a '{actual_type.__name__}'"
+            )
+        return key_data
+
+    def _get_parsed_key(self, path, entry, key_id):
+        return self._from_entry(path, entry, "keys", key_id, lambda: jwk.JWK(**self._get_key(path, entry, key_id)))
+
+    def _get_key(self, path, entry, key_id):
+        if key_id not in entry["index"]:
+            raise KeyError(f"Key '{key_id}' was not found in the key data stored in '{path}'")
+        return self._from_entry(path, entry, "fetched", key_id, lambda: self._fetch_key(path, key_id))
+
+    def _fetch_key(self, path, key_id):
+        raw_data = self._secrets.get(key_path(path, key_id), silent_if_not_found=True)
+        if not raw_data:
+            raise ValueError(f"The manifest in '{path}' lists the key '{key_id}', but that key is missing")
+        return self._check_key_data(key_path(path, key_id), raw_data)
+
+    def _get_key_data(self, path, entry):
+        if entry["key_data"] is None:
+            with self._get_path_lock(path):
+                if entry["key_data"] is None:
+                    entry["key_data"] = {key_id: self._get_key(path, entry, key_id) for key_id in entry["index"]}
+        return entry["key_data"]
+
+    def _from_entry(self, path, entry, cache_name, key, build):
+        cache = entry[cache_name]
+        if key not in cache:
+            # building things twice wouldn't be wrong, just wasteful, so this is all we need to lock for.
+            with self._get_path_lock(path):
+                if key not in cache:
+                    cache[key] = build()
+        return cache[key]
+
+    def _get_path_lock(self, path):
+        with self._lock:
+            if path not in self._path_locks:
+                self._path_locks[path] = threading.RLock()
+            return self._path_locks[path]
+
+    def _count(self, counter_name):
+        with self._lock:
+            self._counters[counter_name] += 1
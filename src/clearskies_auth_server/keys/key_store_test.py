@@ -0,0 +1,252 @@
+import datetime
+import json
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+from jwcrypto import jwk
+import clearskies
+from .key_store import KeyStore
+from ..handlers import Jwks, ListKeys
+
+
+class KeyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="my_test_key_1", alg="EdDSA", use="sig")
+        self.keys = {"my_test_key_1": {**json.loads(self.key.export_private()), "issue_date": "1"}}
+        self.secrets = SimpleNamespace(get=MagicMock(return_value=json.dumps(self.keys)), upsert=MagicMock())
+        self.now = datetime.datetime(2024, 1, 1, 12, 0, 0)
+        self.clock = SimpleNamespace(
+            datetime=SimpleNamespace(now=lambda: self.now),
+            timedelta=datetime.timedelta,
+        )
+
+    def tick(self, seconds):
+        self.now = self.now + datetime.timedelta(seconds=seconds)
+
+    def test_cache_and_counters(self):
+        key_store = KeyStore(self.secrets, datetime)
+        self.assertEqual(self.keys, key_store.get_key_data("/path/to/keys", 60))
+        self.assertEqual(self.keys, key_store.get_key_data("/path/to/keys", 60))
+        self.assertEqual(self.keys, key_store.get_key_data("/path/to/keys", 0))
+        self.assertEqual({"hits": 1, "misses": 1, "refreshes": 1, "refresh_errors": 0}, key_store.stats())
+        self.assertEqual(2, self.secrets.get.call_count)
+
+    def test_parsed_keys_survive_unchanged_refresh(self):
+        key_store = KeyStore(self.secrets, datetime)
+        parsed_key = key_store.get_parsed_key("/path/to/keys", "my_test_key_1", 60)
+        self.assertIs(parsed_key, key_store.get_parsed_key("/path/to/keys", "my_test_key_1", 60, use_cache=False))
+
+        self.secrets.get.return_value = json.dumps({"my_test_key_1": {**self.keys["my_test_key_1"], "issue_date": "2"}})
+        self.assertIsNot(parsed_key, key_store.get_parsed_key("/path/to/keys", "my_test_key_1", 60, use_cache=False))
+
+    def test_concurrent_refreshes_are_coalesced(self):
+        def slow_get(path, silent_if_not_found=False):
+            time.sleep(0.2)
+            return json.dumps(self.keys)
+
+        secrets = SimpleNamespace(get=MagicMock(side_effect=slow_get))
+        key_store = KeyStore(secrets, datetime)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(key_store.get_key_data("/path/to/keys", 60)))
+            for i in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, secrets.get.call_count)
+        self.assertEqual([self.keys] * 10, results)
+        self.assertEqual({"hits": 9, "misses": 1, "refreshes": 0, "refresh_errors": 0}, key_store.stats())
+
+    def test_shared_between_handlers(self):
+        di = clearskies.di.StandardDependencies(bindings={"secrets": self.secrets})
+        handlers = [di.build(Jwks), di.build(ListKeys)]
+        for handler in handlers:
+            handler.configure(
+                {
+                    "path_to_private_keys": "/path/to/private",
+                    "path_to_public_keys": "/path/to/keys",
+                    "authentication": clearskies.authentication.public(),
+                }
+            )
+            handler.fetch_and_check_keys("/path/to/keys")
+
+        self.assertIs(handlers[0].key_store, handlers[1].key_store)
+        self.assertEqual(1, self.secrets.get.call_count)
+
+    def test_save_invalidates(self):
+        key_store = KeyStore(self.secrets, datetime)
+        key_store.get_key_data("/path/to/keys", 60)
+        key_store.save("/path/to/keys", {})
+        key_store.get_key_data("/path/to/keys", 60)
+
+        self.secrets.upsert.assert_called_once_with("/path/to/keys", "{}")
+        # one load before the save, one read of what's there during the save, and one load after
+        self.assertEqual(3, self.secrets.get.call_count)
+
+    def test_failed_refresh_serves_last_good_keys(self):
+        key_store = KeyStore(self.secrets, self.clock)
+        key_store.get_key_data("/path/to/keys", 60)
+        self.secrets.get.side_effect = ConnectionError("secret manager is down")
+        self.tick(61)
+        self.assertEqual(self.keys, key_store.get_key_data("/path/to/keys", 60))
+        self.assertEqual("secret manager is down", key_store.get_last_error("/path/to/keys"))
+        self.assertEqual(61, key_store.get_age("/path/to/keys"))
+
+        # we wait a bit before trying again
+        self.tick(10)
+        key_store.get_key_data("/path/to/keys", 60)
+        self.assertEqual(2, self.secrets.get.call_count)
+
+        self.secrets.get.side_effect = None
+        self.tick(30)
+        self.assertEqual(self.keys, key_store.get_key_data("/path/to/keys", 60))
+        self.assertEqual(3, self.secrets.get.call_count)
+        self.assertEqual(None, key_store.get_last_error("/path/to/keys"))
+        self.assertEqual(0, key_store.get_age("/path/to/keys"))
+        self.assertEqual({"hits": 1, "misses": 1, "refreshes": 2, "refresh_errors": 1}, key_store.stats())
+
+    def test_missing_keys_serve_last_good_keys(self):
+        key_store = KeyStore(self.secrets, self.clock)
+        key_store.get_key_data("/path/to/keys", 60)
+        self.secrets.get.return_value = None
+        self.tick(61)
+        self.assertEqual("my_test_key_1", key_store.get_youngest_key_id("/path/to/keys", 60))
+        self.assertEqual("The key data in '/path/to/keys' has gone missing", key_store.get_last_error("/path/to/keys"))
+
+    def test_first_load_failure_raises(self):
+        self.secrets.get.return_value = "not json"
+        key_store = KeyStore(self.secrets, self.clock)
+        with self.assertRaises(ValueError):
+            key_store.get_key_data("/path/to/keys", 60)
+
+    def test_background_refresh(self):
+        key_store = KeyStore(self.secrets, self.clock)
+        key_store.get_key_data("/path/to/keys", 60, background=True)
+
+        # not quite time to refresh
+        self.tick(47)
+        key_store.get_key_data("/path/to/keys", 60, background=True)
+        self.assertEqual(1, self.secrets.get.call_count)
+
+        # now the refresh starts, but we don't wait for it
+        new_keys = {"my_test_key_2": {**self.keys["my_test_key_1"], "kid": "my_test_key_2", "issue_date": "2"}}
+        secret_manager_ready = threading.Event()
+
+        def slow_get(path, silent_if_not_found=False):
+            secret_manager_ready.wait()
+            return json.dumps(new_keys)
+
+        self.secrets.get.side_effect = slow_get
+        self.tick(2)
+        self.assertEqual(self.keys, key_store.get_key_data("/path/to/keys", 60, background=True))
+        self.assertEqual(self.keys, key_store.get_key_data("/path/to/keys", 60, background=True))
+
+        secret_manager_ready.set()
+        key_store.wait_for_background_refreshes(timeout=5)
+        self.assertEqual(new_keys, key_store.get_key_data("/path/to/keys", 60, background=True))
+        self.assertEqual(2, self.secrets.get.call_count)
+
+    def test_background_refresh_after_invalidate(self):
+        key_store = KeyStore(self.secrets, self.clock)
+        key_store.get_key_data("/path/to/keys", 60, background=True)
+
+        # the keys we saved have to show up on the next request, not after a background refresh
+        new_keys = {"my_test_key_2": {**self.keys["my_test_key_1"], "kid": "my_test_key_2", "issue_date": "2"}}
+        key_store.save("/path/to/keys", new_keys)
+        self.secrets.get.return_value = json.dumps(new_keys)
+        self.assertEqual(new_keys, key_store.get_key_data("/path/to/keys", 60, background=True))
+        self.assertEqual("my_test_key_2", key_store.get_youngest_key_id("/path/to/keys", 60, background=True))
+        # the load after the save happened in this request (the save itself reads the current keys too)
+        self.assertEqual(3, self.secrets.get.call_count)
+
+    def test_save_reads_current_manifest(self):
+        stored = {}
+        (secrets, reads) = self.build_stored_secrets(stored)
+        key_store = KeyStore(secrets, datetime)
+        key_store.save("/path/to/keys", self.keys, layout="per_key")
+        key_store.get_key_index("/path/to/keys", 60)
+
+        # someone else adds a key, so our cached manifest is out of date
+        new_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="my_test_key_2", alg="EdDSA", use="sig")
+        new_keys = {**self.keys, "my_test_key_2": {**json.loads(new_key.export_private()), "issue_date": "2"}}
+        other_key_store = KeyStore(secrets, datetime)
+        other_key_store.save("/path/to/keys", new_keys, layout="per_key")
+
+        # and then we drop the original key
+        key_store.save("/path/to/keys", {"my_test_key_2": new_keys["my_test_key_2"]}, layout="per_key")
+        manifest = json.loads(stored["/path/to/keys"])
+        self.assertEqual(3, manifest["version"])
+        self.assertEqual(["my_test_key_2"], list(manifest["keys"].keys()))
+        self.assertEqual("", stored["/path/to/keys/my_test_key_1"])
+        self.assertEqual(new_keys["my_test_key_2"], json.loads(stored["/path/to/keys/my_test_key_2"]))
+
+    def build_stored_secrets(self, stored):
+        reads = []
+
+        def get(path, silent_if_not_found=False):
+            reads.append(path)
+            return stored.get(path)
+
+        return (SimpleNamespace(get=get, upsert=lambda path, value: stored.update({path: value})), reads)
+
+    def test_per_key_layout(self):
+        old_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="my_test_key_0", alg="EdDSA", use="sig")
+        keys = {**self.keys, "my_test_key_0": {**json.loads(old_key.export_private()), "issue_date": "0"}}
+        stored = {"/path/to/keys": json.dumps(keys)}
+        (secrets, reads) = self.build_stored_secrets(stored)
+
+        # migrate from the single layout
+        KeyStore(secrets, datetime).migrate("/path/to/keys", "per_key")
+        self.assertEqual(
+            {
+                "layout": "per_key",
+                "version": 1,
+                "active_key_id": "my_test_key_1",
+                "keys": {
+                    "my_test_key_1": {"alg": "EdDSA", "kty": "OKP", "issue_date": "1"},
+                    "my_test_key_0": {"alg": "EdDSA", "kty": "OKP", "issue_date": "0"},
+                },
+            },
+            json.loads(stored["/path/to/keys"]),
+        )
+        self.assertEqual(keys["my_test_key_0"], json.loads(stored["/path/to/keys/my_test_key_0"]))
+
+        # signing only needs the manifest and the signing key
+        reads.clear()
+        key_store = KeyStore(secrets, datetime)
+        key_store.get_signer("/path/to/keys", 60)
+        self.assertEqual("my_test_key_0", key_store.get_oldest_key_id("/path/to/keys", 60))
+        self.assertEqual(["/path/to/keys", "/path/to/keys/my_test_key_1"], reads)
+        self.assertEqual(keys, key_store.get_key_data("/path/to/keys", 60))
+
+        # deleting a key bumps the version and blanks out the deleted key
+        key_store.save("/path/to/keys", self.keys, layout="per_key")
+        manifest = json.loads(stored["/path/to/keys"])
+        self.assertEqual(2, manifest["version"])
+        self.assertEqual(["my_test_key_1"], list(manifest["keys"].keys()))
+        self.assertEqual("", stored["/path/to/keys/my_test_key_0"])
+
+        # and we can go back to the single layout
+        key_store.migrate("/path/to/keys", "single")
+        self.assertEqual(self.keys, json.loads(stored["/path/to/keys"]))
+        self.assertEqual("", stored["/path/to/keys/my_test_key_1"])
+
+    def test_per_key_layout_reuses_fetched_keys(self):
+        stored = {}
+        (secrets, reads) = self.build_stored_secrets(stored)
+        key_store = KeyStore(secrets, datetime)
+        key_store.save("/path/to/keys", self.keys, layout="per_key")
+        key_store.get_key_data("/path/to/keys", 60)
+
+        new_key = jwk.JWK.generate(kty="OKP", crv="Ed25519", kid="my_test_key_2", alg="EdDSA", use="sig")
+        new_keys = {**self.keys, "my_test_key_2": {**json.loads(new_key.export_private()), "issue_date": "2"}}
+        key_store.save("/path/to/keys", new_keys, layout="per_key")
+        reads.clear()
+        self.assertEqual(new_keys, key_store.get_key_data("/path/to/keys", 60))
+        # the keys themselves never change, so we only need to fetch the new one
+        self.assertEqual(["/path/to/keys", "/path/to/keys/my_test_key_2"], reads)
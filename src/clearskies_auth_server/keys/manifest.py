@@ -0,0 +1,52 @@
+"""
+The per-key storage layout.
+
+By default a key set is stored as a single secret: a JSON object with one entry per key (the "single" layout).
+With the "per_key" layout, each key is stored in its own secret (at `{path}/{key_id}`) and the secret at the
+path itself holds a small manifest, which looks like this:
+
+    {
+        "layout": "per_key",
+        "version": 3,
+        "active_key_id": "[the id of the youngest key, which is the one we sign with]",
+        "keys": {
+            "[key id]": {"alg": "RSA256", "kty": "RSA", "issue_date": "2024-01-01T12:00:00+00:00"},
+        },
+    }
+
+so you only have to fetch the manifest (plus the keys you actually use) to sign or verify a JWT.
+"""
+
+key_storage_layouts = ["single", "per_key"]
+
+
+def is_manifest(data):
+    return isinstance(data, dict) and data.get("layout") == "per_key" and isinstance(data.get("keys"), dict)
+
+
+def key_path(path, key_id):
+    return f"{path}/{key_id}"
+
+
+def key_index(key_data):
+    """
+    Returns what the manifest knows about each key.
+    """
+    return {
+        key_id: {
+            "alg": key.get("alg"),
+            "kty": key.get("kty"),
+            "issue_date": key["issue_date"],
+        }
+        for (key_id, key) in key_data.items()
+    }
+
+
+def build_manifest(key_data, version):
+    index = key_index(key_data)
+    return {
+        "layout": "per_key",
+        "version": version,
+        "active_key_id": max(index, key=lambda key_id: index[key_id]["issue_date"]) if index else None,
+        "keys": index,
+    }
@@ -0,0 +1,7 @@
+from .lockout_store import LockoutStore
+from .sqlite_lockout_store import SqliteLockoutStore
+
+__all__ = [
+    "LockoutStore",
+    "SqliteLockoutStore",
+]
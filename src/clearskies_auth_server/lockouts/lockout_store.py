@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
+class LockoutStore:
+    """
+    Counts failed logins over a sliding window, so that we can lock accounts without querying the audit table.
+
+    PasswordLogin only uses a lockout store when `account_lockout_source` is set to 'lockout_store': by default, it
+    counts failed logins in the audit table, which every process shares.
+
+    Each key (e.g. a tenant and username) gets a handful of buckets that cover the window between them, and we
+    count failures by adding up the buckets, so recording and counting failures is O(1) no matter how many
+    failures there are.  The price is a little imprecision: failures are forgotten a bucket at a time, so a
+    failure may be counted for up to one bucket (a tenth of the window, by default) longer than the window.
+
+    This one keeps everything in memory, so each process has its own counts (and with N processes, an attacker gets
+    N times the attempts).  It's built via the dependency
+    injection container (`di.build(LockoutStore, cache=True)`) so you can swap in a shared store (e.g.
+    `SqliteLockoutStore`, or anything with the same methods) by binding it to `lockout_store`.
+    """
+
+    buckets_per_window = 10
+    max_keys = 100000
+
+    _datetime = None
+    _counters = None
+    _lock = None
+
+    def __init__(self, datetime):
+        self._datetime = datetime
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_failure(self, key, window_seconds):
+        now = self._now()
+        bucket_start = self._bucket_start(now, window_seconds)
+        with self._lock:
+            buckets = self._get_buckets(key, now, window_seconds)
+            if buckets and buckets[-1][0] == bucket_start:
+                buckets[-1][1] += 1
+            else:
+                buckets.append([bucket_start, 1])
+            self._counters[key] = buckets
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+
+    def count_failures(self, key, window_seconds):
+        with self._lock:
+            return sum(count for (bucket_start, count) in self._get_buckets(key, self._now(), window_seconds))
+
+    def reset(self, key):
+        with self._lock:
+            if key in self._counters:
+                del self._counters[key]
+
+    def _get_buckets(self, key, now, window_seconds):
+        # drop any buckets that have slid out of the window
+        buckets = self._counters.get(key, [])
+        oldest_bucket_start = self._bucket_start(now, window_seconds) - window_seconds
+        while buckets and buckets[0][0] < oldest_bucket_start:
+            buckets.pop(0)
+        if not buckets and key in self._counters:
+            del self._counters[key]
+        return buckets
+
+    def _bucket_start(self, now, window_seconds):
+        bucket_size = window_seconds / self.buckets_per_window
+        return now // bucket_size * bucket_size
+
+    def _now(self):
+        return self._datetime.datetime.now(self._datetime.timezone.utc).timestamp()
@@ -0,0 +1,56 @@
+import datetime
+import threading
+import unittest
+from types import SimpleNamespace
+from .lockout_store import LockoutStore
+
+
+class LockoutStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        self.clock = SimpleNamespace(
+            datetime=SimpleNamespace(now=lambda timezone=None: self.now),
+            timezone=datetime.timezone,
+        )
+
+    def tick(self, seconds):
+        self.now = self.now + datetime.timedelta(seconds=seconds)
+
+    def build_store(self):
+        return LockoutStore(self.clock)
+
+    def test_sliding_window(self):
+        lockout_store = self.build_store()
+        for i in range(3):
+            lockout_store.record_failure("bob", 300)
+            self.tick(60)
+        lockout_store.record_failure("alice", 300)
+        self.assertEqual(3, lockout_store.count_failures("bob", 300))
+        self.assertEqual(1, lockout_store.count_failures("alice", 300))
+        self.assertEqual(0, lockout_store.count_failures("eve", 300))
+
+        # the first failure was 6 minutes ago, the second 5 minutes ago (which is within a bucket of the window)
+        self.tick(180)
+        self.assertEqual(2, lockout_store.count_failures("bob", 300))
+        self.tick(60)
+        self.assertEqual(1, lockout_store.count_failures("bob", 300))
+        self.tick(60)
+        self.assertEqual(0, lockout_store.count_failures("bob", 300))
+
+    def test_reset(self):
+        lockout_store = self.build_store()
+        lockout_store.record_failure("bob", 300)
+        lockout_store.reset("bob")
+        self.assertEqual(0, lockout_store.count_failures("bob", 300))
+
+    def test_threads(self):
+        lockout_store = self.build_store()
+        threads = [
+            threading.Thread(target=lambda: [lockout_store.record_failure("bob", 300) for j in range(100)])
+            for i in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(500, lockout_store.count_failures("bob", 300))
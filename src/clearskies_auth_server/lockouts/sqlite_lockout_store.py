@@ -0,0 +1,64 @@
+import datetime as default_datetime
+import sqlite3
+import threading
+from .lockout_store import LockoutStore
+
+
+class SqliteLockoutStore(LockoutStore):
+    """
+    A lockout store kept in an SQLite database, so that every process on the machine shares the same counts.
+
+    It uses the same buckets as the in-memory store (one row per key and bucket), so checks and updates are
+    still O(1).  It's meant as a stand-in for a proper shared store (redis, etc.), which just needs the same
+    three methods: `record_failure`, `count_failures`, and `reset`.  To use it, bind it to `lockout_store`:
+
+    ```
+    bindings={"lockout_store": SqliteLockoutStore("/var/run/my-app/lockouts.db")}
+    ```
+    """
+
+    _database_path = None
+    _local = None
+
+    def __init__(self, database_path, datetime=None):
+        super().__init__(datetime if datetime else default_datetime)
+        self._database_path = database_path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS failed_logins "
+                + "(key TEXT NOT NULL, bucket_start REAL NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (key, bucket_start))"
+            )
+
+    def record_failure(self, key, window_seconds):
+        now = self._now()
+        bucket_start = self._bucket_start(now, window_seconds)
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO failed_logins (key, bucket_start, count) VALUES (?, ?, 1) "
+                + "ON CONFLICT (key, bucket_start) DO UPDATE SET count=count+1",
+                (key, bucket_start),
+            )
+            connection.execute(
+                "DELETE FROM failed_logins WHERE key=? AND bucket_start<?",
+                (key, bucket_start - window_seconds),
+            )
+
+    def count_failures(self, key, window_seconds):
+        oldest_bucket_start = self._bucket_start(self._now(), window_seconds) - window_seconds
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT SUM(count) FROM failed_logins WHERE key=? AND bucket_start>=?",
+                (key, oldest_bucket_start),
+            ).fetchone()
+        return row[0] or 0
+
+    def reset(self, key):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM failed_logins WHERE key=?", (key,))
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, so every thread gets its own.
+        if not hasattr(self._local, "connection"):
+            self._local.connection = sqlite3.connect(self._database_path, timeout=5)
+        return self._local.connection
@@ -0,0 +1,22 @@
+import os
+import tempfile
+from .lockout_store_test import LockoutStoreTest
+from .sqlite_lockout_store import SqliteLockoutStore
+
+
+class SqliteLockoutStoreTest(LockoutStoreTest):
+    def setUp(self):
+        super().setUp()
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.temporary_directory.name, "lockouts.db")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def build_store(self):
+        return SqliteLockoutStore(self.database_path, datetime=self.clock)
+
+    def test_shared_between_stores(self):
+        self.build_store().record_failure("bob", 300)
+        self.build_store().record_failure("bob", 300)
+        self.assertEqual(2, self.build_store().count_failures("bob", 300))
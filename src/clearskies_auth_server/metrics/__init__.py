@@ -0,0 +1,17 @@
+from . import auth_server_metrics
+from .exposition import merge_snapshots, render_text
+from .metric_types import Counter, Gauge, Histogram, default_buckets
+from .metrics_registry import MetricsRegistry
+from .metrics_timing_sink import MetricsTimingSink
+
+__all__ = [
+    "auth_server_metrics",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "MetricsTimingSink",
+    "default_buckets",
+    "merge_snapshots",
+    "render_text",
+]
@@ -0,0 +1,99 @@
+"""
+The metrics that the handlers record, so that everything that touches a metric agrees on its name and labels.
+
+Each of these returns the metric from the registry (creating it the first time).
+"""
+
+
+def logins(registry):
+    return registry.counter(
+        "auth_server_logins_total", "Login attempts, by handler and outcome.", ("handler", "outcome")
+    )
+
+
+def lockouts(registry):
+    return registry.counter(
+        "auth_server_lockouts_total", "Login attempts refused because the account is locked out.", ("handler",)
+    )
+
+
+def rate_limited(registry):
+    return registry.counter(
+        "auth_server_rate_limited_total",
+        "Login attempts refused by a rate limit, by handler and rate limit.",
+        ("handler", "limit"),
+    )
+
+
+def password_hash_seconds(registry):
+    return registry.histogram(
+        "auth_server_password_hash_seconds",
+        "Time spent hashing and verifying passwords, by operation (hash, verify, or verify_and_update).",
+        ("operation",),
+    )
+
+
+def tokens_minted(registry):
+    return registry.counter("auth_server_tokens_minted_total", "JWTs signed, by key id.", ("kid",))
+
+
+def jwks_requests(registry):
+    return registry.counter("auth_server_jwks_requests_total", "Requests to the JWKS endpoint, by status.", ("status",))
+
+
+def key_cache(registry):
+    return registry.counter(
+        "auth_server_key_cache_total",
+        "Key store lookups by result: hits, misses, refreshes, and refresh_errors.",
+        ("result",),
+    )
+
+
+def audit_records(registry):
+    return registry.counter(
+        "auth_server_audit_records_total",
+        "Buffered audit records by result: flushed, overflowed (written immediately because the queue was full), "
+        + "and failed.",
+        ("result",),
+    )
+
+
+def login_duration_seconds(registry):
+    return registry.histogram(
+        "auth_server_login_duration_seconds", "Time spent per login, by handler and outcome.", ("handler", "outcome")
+    )
+
+
+def login_phase_seconds(registry):
+    return registry.histogram(
+        "auth_server_login_phase_seconds",
+        "Time spent in each phase of a login, by handler and phase.",
+        ("handler", "phase"),
+    )
+
+
+def watch_key_store(registry, key_store):
+    """
+    Copies the cache statistics of the key store into the registry whenever the metrics are collected.
+    """
+    counter = key_cache(registry)
+
+    def collect():
+        for result, count in key_store.stats().items():
+            counter.set_total(count, labels=(result,))
+
+    registry.add_collector("key_store", collect)
+
+
+def watch_audit_writer(registry, audit_writer):
+    """
+    Copies the statistics of the audit writer into the registry whenever the metrics are collected.
+    """
+    counter = audit_records(registry)
+
+    def collect():
+        for result, count in audit_writer.stats().items():
+            if result != "pending":
+                counter.set_total(count, labels=(result,))
+
+    registry.add_collector("audit_writer", collect)
@@ -0,0 +1,92 @@
+import math
+
+
+def merge_snapshots(snapshots):
+    """
+    Combines the metrics from several processes into one set of metrics.
+
+    Each snapshot is a dictionary with the `pid` of the process, whether it is `alive`, and its `metrics` (as
+    returned by MetricsRegistry.snapshot()).  Counters and histograms are added up across every process, including
+    ones that have exited (so totals don't go backwards when a worker is replaced).  Gauges only make sense for
+    running processes, and are combined according to their `aggregate` setting.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot["metrics"].items():
+            if metric["type"] == "gauge" and not snapshot["alive"]:
+                continue
+            if name not in merged:
+                merged[name] = {**metric, "samples": {}}
+            merged_metric = merged[name]
+            if merged_metric["type"] != metric["type"]:
+                continue
+            samples = merged_metric["samples"]
+            for labels, value in metric["samples"]:
+                labels = tuple(labels)
+                if labels not in samples:
+                    samples[labels] = value
+                else:
+                    samples[labels] = _combine(metric, samples[labels], value)
+    for metric in merged.values():
+        metric["samples"] = [[list(labels), value] for (labels, value) in metric["samples"].items()]
+    return merged
+
+
+def _combine(metric, current, value):
+    if metric["type"] == "histogram":
+        return [[a + b for (a, b) in zip(current[0], value[0])], current[1] + value[1]]
+    if metric["type"] == "gauge" and metric.get("aggregate") == "max":
+        return max(current, value)
+    if metric["type"] == "gauge" and metric.get("aggregate") == "min":
+        return min(current, value)
+    return current + value
+
+
+def render_text(metrics):
+    """
+    Renders metrics (in the format returned by MetricsRegistry.snapshot()) in the Prometheus text format.
+    """
+    lines = []
+    for name in sorted(metrics.keys()):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {_escape_help(metric['documentation'])}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        label_names = metric["label_names"]
+        for labels, value in sorted(metric["samples"], key=lambda sample: sample[0]):
+            label_pairs = list(zip(label_names, labels))
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(label_pairs)} {_format_value(value)}")
+                continue
+            (bucket_counts, total) = value
+            cumulative = 0
+            for upper_bound, count in zip([*metric["buckets"], math.inf], bucket_counts):
+                cumulative += count
+                le = ("le", _format_value(float(upper_bound)))
+                lines.append(f"{name}_bucket{_format_labels([*label_pairs, le])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(label_pairs)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(label_pairs)} {cumulative}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _format_labels(label_pairs):
+    if not label_pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for (name, value) in label_pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if math.isnan(value):
+            return "NaN"
+        return repr(value)
+    return str(value)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(documentation):
+    return str(documentation).replace("\\", "\\\\").replace("\n", "\\n")
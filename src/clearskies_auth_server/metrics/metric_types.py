@@ -0,0 +1,145 @@
+from bisect import bisect_left
+
+# the same defaults as the Prometheus client libraries: 5ms to 10s, which covers both a quick login and a slow hash.
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class Metric:
+    """
+    The parts shared by all of the metric types.
+
+    Each metric has a fixed list of label names, and every update passes the values for those labels as a tuple
+    (in the same order).  Values are kept per tuple of label values.  All the metrics in a registry share the
+    registry's lock, so updates are safe from any thread.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, label_names, lock):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = lock
+        self._values = {}
+
+    def snapshot(self):
+        """
+        Returns the metric (and its current values) as a JSON-friendly dictionary.
+        """
+        with self._lock:
+            samples = [[list(labels), self._copy_value(value)] for (labels, value) in self._values.items()]
+        return {
+            "type": self.type_name,
+            "documentation": self.documentation,
+            "label_names": list(self.label_names),
+            "samples": samples,
+        }
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._copy_value(self._values.get(tuple(labels)))
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def _check_labels(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError(
+                f"Metric '{self.name}' has labels {self.label_names}, but was given {len(labels)} label value(s)"
+            )
+
+    def _copy_value(self, value):
+        return value
+
+
+class Counter(Metric):
+    """
+    A number that only goes up (e.g. the number of logins).
+    """
+
+    type_name = "counter"
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            if labels not in self._values:
+                self._check_labels(labels)
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_total(self, value, labels=()):
+        """
+        Sets the counter to a total that is counted somewhere else (e.g. the key store's cache statistics).
+        """
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class Gauge(Metric):
+    """
+    A number that can go up and down (e.g. the size of a queue).
+
+    When combining the gauges of several processes (see MetricsRegistry), `aggregate` decides how: `sum`, `max`,
+    or `min`.  Only processes that are still running are included.
+    """
+
+    type_name = "gauge"
+    aggregates = ("sum", "max", "min")
+
+    def __init__(self, name, documentation, label_names, lock, aggregate="sum"):
+        if aggregate not in self.aggregates:
+            raise ValueError(f"Invalid aggregate for gauge '{name}': '{aggregate}'.  It must be one of sum, max, min")
+        super().__init__(name, documentation, label_names, lock)
+        self.aggregate = aggregate
+
+    def snapshot(self):
+        return {**super().snapshot(), "aggregate": self.aggregate}
+
+    def set(self, value, labels=()):
+        self._check_labels(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            if labels not in self._values:
+                self._check_labels(labels)
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels=labels)
+
+
+class Histogram(Metric):
+    """
+    Counts observations (e.g. how long a request took) in a fixed set of buckets.
+
+    The buckets are the upper bounds (inclusive) of each bucket, and there's always one more for everything
+    larger.  For each set of labels we keep the count in each bucket (not cumulative: that's worked out when
+    rendering) and the sum of all observations.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, label_names, lock, buckets=default_buckets):
+        buckets = tuple(float(bucket) for bucket in buckets)
+        if not buckets or list(buckets) != sorted(set(buckets)):
+            raise ValueError(f"The buckets for histogram '{name}' must be a non-empty list of increasing numbers")
+        super().__init__(name, documentation, label_names, lock)
+        self.buckets = buckets
+
+    def snapshot(self):
+        return {**super().snapshot(), "buckets": list(self.buckets)}
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                self._check_labels(labels)
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def _copy_value(self, value):
+        return None if value is None else [[*value[0]], value[1]]
@@ -0,0 +1,207 @@
+import atexit
+import json
+import os
+import threading
+import weakref
+from .exposition import merge_snapshots, render_text
+from .metric_types import Counter, Gauge, Histogram, default_buckets
+
+
+class MetricsRegistry:
+    """
+    Holds the counters, gauges, and histograms that the handlers update, and renders them for Prometheus.
+
+    This is built via the dependency injection container (`di.build(MetricsRegistry, cache=True)`), so there is one
+    per application, and the Metrics handler serves whatever is in it.  You can replace it by binding your own
+    object to `metrics_registry` (which you'll need to do if you also want to hand it to a MetricsTimingSink).
+
+    Metrics live in memory, so each process counts on its own.  If you run several worker processes (e.g. forked
+    by gunicorn) then whichever one handles the scrape only knows about its own requests.  To report the totals
+    for all of them, `configure(shared_directory=...)` with a directory that every worker can write to: each
+    process then writes its metrics to `{pid}.json` in that directory every `flush_interval` seconds (from a
+    background thread), and `render()` adds up the files.  Clear out the directory when the server starts, since
+    counters from processes that have exited are still included (otherwise totals would go down whenever a worker
+    is replaced).  Gauges are only included for processes that are still running.
+
+    Things that are counted elsewhere (e.g. the key store's cache statistics) can be copied into the registry
+    right before it's rendered by adding a collector (see `add_collector`).
+    """
+
+    shared_directory = None
+    flush_interval = 5.0
+
+    _lock = None
+    _metrics = None
+    _collectors = None
+    _condition = None
+    _thread = None
+    _closed = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+        # after a fork, the child starts from a clean slate: the parent's counts are already in the parent's file
+        registry = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: registry() and registry()._after_fork())
+
+    def configure(self, shared_directory=None, flush_interval=None):
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if shared_directory is not None:
+            self.shared_directory = shared_directory
+            os.makedirs(shared_directory, exist_ok=True)
+            self._start()
+        return self
+
+    def counter(self, name, documentation, label_names=()):
+        """
+        Returns the counter with the given name, creating it if it doesn't exist yet.
+        """
+        return self._get_or_create(Counter, name, documentation, label_names)
+
+    def gauge(self, name, documentation, label_names=(), aggregate="sum"):
+        return self._get_or_create(Gauge, name, documentation, label_names, aggregate=aggregate)
+
+    def histogram(self, name, documentation, label_names=(), buckets=default_buckets):
+        return self._get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def add_collector(self, name, collector):
+        """
+        Adds a callable that is called (with no arguments) before the metrics are rendered or written out.
+
+        Collectors are stored by name, so adding one with the same name replaces the old one.
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def collect(self):
+        with self._lock:
+            collectors = list(self._collectors.values())
+        for collector in collectors:
+            collector()
+
+    def snapshot(self):
+        """
+        Returns the current value of every metric in this process, as a JSON-friendly dictionary.
+        """
+        self.collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format.
+
+        With a shared directory, this covers every process that has written its metrics there.
+        """
+        metrics = self.snapshot()
+        if not self.shared_directory:
+            return render_text(metrics)
+        self._write(metrics)
+        return render_text(merge_snapshots(self._read_shared_snapshots()))
+
+    def flush(self):
+        """
+        Writes the metrics for this process to the shared directory (if there is one) right now.
+        """
+        if self.shared_directory:
+            self._write(self.snapshot())
+
+    def reset(self):
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def _get_or_create(self, metric_class, name, documentation, label_names, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = metric_class(name, documentation, label_names, self._lock, **kwargs)
+                    self._metrics[name] = metric
+        if type(metric) is not metric_class:
+            raise ValueError(f"Metric '{name}' is already registered as a {metric.type_name}")
+        return metric
+
+    def _file_path(self, pid):
+        return os.path.join(self.shared_directory, f"{pid}.json")
+
+    def _write(self, metrics):
+        pid = os.getpid()
+        temporary_path = self._file_path(pid) + ".tmp"
+        with open(temporary_path, "w") as temporary_file:
+            json.dump({"pid": pid, "metrics": metrics}, temporary_file)
+        # so that readers never see a half-written file
+        os.replace(temporary_path, self._file_path(pid))
+
+    def _read_shared_snapshots(self):
+        snapshots = []
+        for file_name in sorted(os.listdir(self.shared_directory)):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.shared_directory, file_name)) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                # the process may have just cleaned up after itself, and it's not worth breaking the scrape
+                continue
+            snapshots.append({**snapshot, "alive": self._is_alive(snapshot["pid"])})
+        return snapshots
+
+    def _is_alive(self, pid):
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _start(self):
+        with self._condition:
+            if self._thread is not None or self._closed:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # metrics are best-effort, so a full disk shouldn't take the flusher down with it
+                pass
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._thread = None
+        for metric in self._metrics.values():
+            metric._lock = self._lock
+            metric._values = {}
+        if self.shared_directory and not self._closed:
+            self._start()
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from .metrics_registry import MetricsRegistry
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics_registry = MetricsRegistry()
+
+    def tearDown(self):
+        self.metrics_registry.close()
+
+    def test_counter(self):
+        logins = self.metrics_registry.counter("logins_total", "Logins.", ("outcome",))
+        logins.inc(labels=("success",))
+        logins.inc(2, labels=("success",))
+        logins.inc(labels=("invalid_password",))
+        self.assertEqual(3, logins.value(("success",)))
+        self.assertEqual(1, logins.value(("invalid_password",)))
+
+        # asking for it again gives back the same counter
+        self.assertIs(logins, self.metrics_registry.counter("logins_total", "Logins.", ("outcome",)))
+        with self.assertRaises(ValueError):
+            self.metrics_registry.gauge("logins_total", "Logins.")
+        with self.assertRaises(ValueError):
+            logins.inc(labels=("success", "extra"))
+
+    def test_render(self):
+        self.metrics_registry.counter("logins_total", "Logins.", ("outcome",)).inc(labels=("success",))
+        self.metrics_registry.gauge("pending", "Queued up.").set(4)
+        hash_seconds = self.metrics_registry.histogram("hash_seconds", "Hashing.", buckets=(0.1, 1))
+        hash_seconds.observe(0.05)
+        hash_seconds.observe(0.1)
+        hash_seconds.observe(0.5)
+        hash_seconds.observe(3)
+        self.metrics_registry.counter("escaped_total", "Escaped.", ("name",)).inc(labels=('a "quoted"\\name',))
+
+        self.assertEqual(
+            "\n".join(
+                [
+                    "# HELP escaped_total Escaped.",
+                    "# TYPE escaped_total counter",
+                    'escaped_total{name="a \\"quoted\\"\\\\name"} 1',
+                    "# HELP hash_seconds Hashing.",
+                    "# TYPE hash_seconds histogram",
+                    'hash_seconds_bucket{le="0.1"} 2',
+                    'hash_seconds_bucket{le="1.0"} 3',
+                    'hash_seconds_bucket{le="+Inf"} 4',
+                    "hash_seconds_sum 3.65",
+                    "hash_seconds_count 4",
+                    "# HELP logins_total Logins.",
+                    "# TYPE logins_total counter",
+                    'logins_total{outcome="success"} 1',
+                    "# HELP pending Queued up.",
+                    "# TYPE pending gauge",
+                    "pending 4",
+                    "",
+                ]
+            ),
+            self.metrics_registry.render(),
+        )
+
+    def test_collector(self):
+        stats = {"hits": 0}
+        counter = self.metrics_registry.counter("hits_total", "Hits.")
+        self.metrics_registry.add_collector("stats", lambda: counter.set_total(stats["hits"]))
+        stats["hits"] = 5
+        self.assertIn("hits_total 5\n", self.metrics_registry.render())
+
+    def test_shared_directory(self):
+        with tempfile.TemporaryDirectory() as shared_directory:
+            self.metrics_registry.configure(shared_directory=shared_directory, flush_interval=60)
+            logins = self.metrics_registry.counter("logins_total", "Logins.", ("outcome",))
+            workers = self.metrics_registry.gauge("workers", "Workers.")
+            logins.inc(labels=("success",))
+            workers.set(1)
+
+            # a forked worker starts from zero and reports its own counts
+            (ready_read, ready_write) = os.pipe()
+            (exit_read, exit_write) = os.pipe()
+            pid = os.fork()
+            if not pid:
+                # whatever happens, the child must not go on to run the rest of the tests
+                try:
+                    logins.inc(labels=("success",))
+                    logins.inc(labels=("invalid_password",))
+                    workers.set(1)
+                    self.metrics_registry.flush()
+                    os.write(ready_write, b"x")
+                    os.read(exit_read, 1)
+                finally:
+                    os._exit(0)
+            os.close(ready_write)
+            os.close(exit_read)
+            self.assertEqual(b"x", os.read(ready_read, 1))
+
+            rendered = self.metrics_registry.render()
+            self.assertIn('logins_total{outcome="success"} 2\n', rendered)
+            self.assertIn('logins_total{outcome="invalid_password"} 1\n', rendered)
+            self.assertIn("workers 2\n", rendered)
+            self.assertEqual(1, logins.value(("success",)))
+
+            # once the worker has exited, its gauge no longer counts, but its counters do
+            os.write(exit_write, b"x")
+            os.waitpid(pid, 0)
+            rendered = self.metrics_registry.render()
+            self.assertIn('logins_total{outcome="success"} 2\n', rendered)
+            self.assertIn("workers 1\n", rendered)
+            os.close(ready_read)
+            os.close(exit_write)
+            self.metrics_registry.close()
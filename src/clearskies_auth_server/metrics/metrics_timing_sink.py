@@ -0,0 +1,29 @@
+from .auth_server_metrics import login_duration_seconds, login_phase_seconds
+
+
+class MetricsTimingSink:
+    """
+    A timing sink (see the timings module) that records the timings of each login in histograms.
+
+    The total goes in `auth_server_login_duration_seconds` (by handler and outcome) and each phase goes in
+    `auth_server_login_phase_seconds` (by handler and phase).  Give it the same registry that the Metrics handler
+    serves, e.g.:
+
+    ```
+    metrics_registry = MetricsRegistry()
+    bindings = {"metrics_registry": metrics_registry}
+    ...
+    "timing_sink": MetricsTimingSink(metrics_registry),
+    ```
+    """
+
+    def __init__(self, metrics_registry):
+        self.metrics_registry = metrics_registry
+        self._durations = login_duration_seconds(metrics_registry)
+        self._phases = login_phase_seconds(metrics_registry)
+
+    def __call__(self, timings):
+        handler = timings.handler
+        self._durations.observe(timings.total, labels=(handler, timings.outcome))
+        for phase, seconds in timings.phases.items():
+            self._phases.observe(seconds, labels=(handler, phase))
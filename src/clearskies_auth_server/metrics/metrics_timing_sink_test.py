@@ -0,0 +1,27 @@
+import unittest
+from types import SimpleNamespace
+from .metrics_registry import MetricsRegistry
+from .metrics_timing_sink import MetricsTimingSink
+
+
+class MetricsTimingSinkTest(unittest.TestCase):
+    def test_observe(self):
+        metrics_registry = MetricsRegistry()
+        sink = MetricsTimingSink(metrics_registry)
+        sink(SimpleNamespace(handler="PasswordLogin", outcome="success", total=0.3, phases={"password_verify": 0.2}))
+        sink(
+            SimpleNamespace(handler="PasswordLogin", outcome="success", total=0.004, phases={"password_verify": 0.003})
+        )
+
+        durations = metrics_registry.histogram("auth_server_login_duration_seconds", "", ("handler", "outcome"))
+        [bucket_counts, total] = durations.value(("PasswordLogin", "success"))
+        self.assertEqual(2, sum(bucket_counts))
+        self.assertAlmostEqual(0.304, total)
+        phases = metrics_registry.histogram("auth_server_login_phase_seconds", "", ("handler", "phase"))
+        [bucket_counts, total] = phases.value(("PasswordLogin", "password_verify"))
+        self.assertEqual(2, sum(bucket_counts))
+        self.assertAlmostEqual(0.203, total)
+        self.assertIn(
+            'auth_server_login_phase_seconds_bucket{handler="PasswordLogin",phase="password_verify",le="0.005"} 1\n',
+            metrics_registry.render(),
+        )
@@ -0,0 +1,7 @@
+from .rate_limiter import RateLimiter
+from .sqlite_rate_limiter import SqliteRateLimiter
+
+__all__ = [
+    "RateLimiter",
+    "SqliteRateLimiter",
+]
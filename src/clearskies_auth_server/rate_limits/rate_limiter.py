@@ -0,0 +1,73 @@
+import threading
+import zlib
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    Token buckets for rate limiting, checked before any expensive work is done for a request.
+
+    Each key (e.g. a client IP address) gets a bucket that holds up to `capacity` tokens and refills at
+    `refill_per_second` tokens per second.  Every request takes a token, and once the bucket is empty requests are
+    refused until it refills.  A bucket is just the number of tokens and when we last looked at it (the refill is
+    worked out from the elapsed time), so checks are O(1) and there's no background work.
+
+    Buckets are spread across `shard_count` shards, each with its own lock, so that concurrent requests for
+    different keys rarely wait on each other.  Each shard keeps at most `max_keys / shard_count` buckets, and the
+    least recently used are forgotten first (a forgotten bucket starts out full again, which is what it would have
+    refilled to anyway unless it was in use).
+
+    This one keeps everything in memory, so each process has its own buckets.  It's built via the dependency
+    injection container (`di.build(RateLimiter, cache=True)`) so you can swap in a shared backend (e.g.
+    `SqliteRateLimiter`, or anything with the same `take` method) by binding it to `rate_limiter`.  Since it's
+    `per_process`, PasswordLogin won't use it unless `rate_limits_per_process` is set.
+    """
+
+    # whether each process has its own buckets
+    per_process = True
+
+    shard_count = 16
+    max_keys = 100000
+
+    _datetime = None
+    _shards = None
+
+    def __init__(self, datetime):
+        self._datetime = datetime
+        self._shards = [(threading.Lock(), OrderedDict()) for i in range(self.shard_count)]
+
+    def take(self, key, capacity, refill_per_second):
+        """
+        Takes a token from the bucket for the key.
+
+        Returns a tuple with whether or not there was a token to take, and (if not) how many seconds until there is.
+        """
+        now = self._now()
+        (lock, buckets) = self._shards[zlib.crc32(key.encode("utf-8")) % self.shard_count]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = [capacity, now]
+                while len(buckets) > self.max_keys // self.shard_count:
+                    buckets.popitem(last=False)
+            else:
+                buckets.move_to_end(key)
+            (allowed, tokens) = self._take_token(bucket[0], bucket[1], now, capacity, refill_per_second)
+            bucket[0] = tokens
+            bucket[1] = now
+        return (allowed, 0 if allowed else (1 - tokens) / refill_per_second)
+
+    def reset(self, key):
+        (lock, buckets) = self._shards[zlib.crc32(key.encode("utf-8")) % self.shard_count]
+        with lock:
+            if key in buckets:
+                del buckets[key]
+
+    def _take_token(self, tokens, updated_at, now, capacity, refill_per_second):
+        tokens = min(capacity, tokens + max(0, now - updated_at) * refill_per_second)
+        if tokens >= 1:
+            return (True, tokens - 1)
+        return (False, tokens)
+
+    def _now(self):
+        return self._datetime.datetime.now(self._datetime.timezone.utc).timestamp()
@@ -0,0 +1,65 @@
+import datetime
+import threading
+import unittest
+from types import SimpleNamespace
+from .rate_limiter import RateLimiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        self.clock = SimpleNamespace(
+            datetime=SimpleNamespace(now=lambda timezone=None: self.now),
+            timezone=datetime.timezone,
+        )
+
+    def tick(self, seconds):
+        self.now = self.now + datetime.timedelta(seconds=seconds)
+
+    def build_rate_limiter(self):
+        return RateLimiter(self.clock)
+
+    def test_token_bucket(self):
+        rate_limiter = self.build_rate_limiter()
+        # 3 at once, and then one every 10 seconds
+        for i in range(3):
+            self.assertEqual((True, 0), rate_limiter.take("bob", 3, 0.1))
+        (allowed, retry_after) = rate_limiter.take("bob", 3, 0.1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(10, retry_after)
+        self.assertEqual((True, 0), rate_limiter.take("alice", 3, 0.1))
+
+        self.tick(4)
+        (allowed, retry_after) = rate_limiter.take("bob", 3, 0.1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(6, retry_after)
+        self.tick(6)
+        self.assertTrue(rate_limiter.take("bob", 3, 0.1)[0])
+        self.assertFalse(rate_limiter.take("bob", 3, 0.1)[0])
+
+        # it never fills past the capacity
+        self.tick(3600)
+        for i in range(3):
+            self.assertTrue(rate_limiter.take("bob", 3, 0.1)[0])
+        self.assertFalse(rate_limiter.take("bob", 3, 0.1)[0])
+
+    def test_reset(self):
+        rate_limiter = self.build_rate_limiter()
+        rate_limiter.take("bob", 1, 0.1)
+        self.assertFalse(rate_limiter.take("bob", 1, 0.1)[0])
+        rate_limiter.reset("bob")
+        self.assertTrue(rate_limiter.take("bob", 1, 0.1)[0])
+
+    def test_threads(self):
+        rate_limiter = self.build_rate_limiter()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.extend(rate_limiter.take("bob", 250, 0.1)[0] for j in range(100)))
+            for i in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(250, results.count(True))
+        self.assertEqual(250, results.count(False))
@@ -0,0 +1,67 @@
+import datetime as default_datetime
+import sqlite3
+import threading
+from .rate_limiter import RateLimiter
+
+
+class SqliteRateLimiter(RateLimiter):
+    """
+    A rate limiter kept in an SQLite database, so that every process on the machine shares the same buckets.
+
+    Each bucket is one row, and taking a token is a single upsert, so concurrent requests can't both take the last
+    token.  Buckets that haven't been used in `max_idle_seconds` are deleted (every `prune_interval` calls), so
+    make sure that's long enough for any bucket to refill.  Like the SqliteLockoutStore, it's meant as a stand-in
+    for a proper shared backend (redis, etc.), which just needs the same `take` method.  To use it, bind it to
+    `rate_limiter`:
+
+    ```
+    bindings={"rate_limiter": SqliteRateLimiter("/var/run/my-app/rate_limits.db")}
+    ```
+    """
+
+    per_process = False
+
+    max_idle_seconds = 3600
+    prune_interval = 1000
+
+    _database_path = None
+    _local = None
+    _calls = 0
+
+    def __init__(self, database_path, datetime=None):
+        super().__init__(datetime if datetime else default_datetime)
+        self._database_path = database_path
+        self._local = threading.local()
+        self._calls = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+                + "(key TEXT NOT NULL PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, allowed INTEGER NOT NULL)"
+            )
+
+    def take(self, key, capacity, refill_per_second):
+        now = self._now()
+        self._calls += 1
+        with self._connection() as connection:
+            if self._calls % self.prune_interval == 0:
+                connection.execute("DELETE FROM rate_limit_buckets WHERE updated_at<?", (now - self.max_idle_seconds,))
+            # the same arithmetic as RateLimiter._take_token.  In the update, every column refers to the old row.
+            refilled = "MIN(:capacity, tokens + MAX(0, :now - updated_at) * :refill_per_second)"
+            (allowed, tokens) = connection.execute(
+                "INSERT INTO rate_limit_buckets (key, tokens, updated_at, allowed) VALUES (:key, :capacity - 1, :now, 1) "
+                + f"ON CONFLICT (key) DO UPDATE SET allowed=({refilled} >= 1), "
+                + f"tokens={refilled} - ({refilled} >= 1), updated_at=:now "
+                + "RETURNING allowed, tokens",
+                {"key": key, "capacity": capacity, "now": now, "refill_per_second": refill_per_second},
+            ).fetchone()
+        return (bool(allowed), 0 if allowed else (1 - tokens) / refill_per_second)
+
+    def reset(self, key):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM rate_limit_buckets WHERE key=?", (key,))
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, so every thread gets its own.
+        if not hasattr(self._local, "connection"):
+            self._local.connection = sqlite3.connect(self._database_path, timeout=5)
+        return self._local.connection
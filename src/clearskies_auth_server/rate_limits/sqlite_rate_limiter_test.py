@@ -0,0 +1,32 @@
+import os
+import tempfile
+from .rate_limiter_test import RateLimiterTest
+from .sqlite_rate_limiter import SqliteRateLimiter
+
+
+class SqliteRateLimiterTest(RateLimiterTest):
+    def setUp(self):
+        super().setUp()
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.temporary_directory.name, "rate_limits.db")
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def build_rate_limiter(self):
+        return SqliteRateLimiter(self.database_path, datetime=self.clock)
+
+    def test_shared_between_rate_limiters(self):
+        self.assertTrue(self.build_rate_limiter().take("bob", 2, 0.1)[0])
+        self.assertTrue(self.build_rate_limiter().take("bob", 2, 0.1)[0])
+        self.assertFalse(self.build_rate_limiter().take("bob", 2, 0.1)[0])
+
+    def test_prune(self):
+        rate_limiter = self.build_rate_limiter()
+        rate_limiter.prune_interval = 2
+        rate_limiter.take("bob", 2, 0.1)
+        self.tick(rate_limiter.max_idle_seconds + 1)
+        rate_limiter.take("alice", 2, 0.1)
+        with rate_limiter._connection() as connection:
+            keys = [row[0] for row in connection.execute("SELECT key FROM rate_limit_buckets")]
+        self.assertEqual(["alice"], keys)
@@ -0,0 +1,5 @@
+from .refresh_token_store import RefreshTokenStore
+
+__all__ = [
+    "RefreshTokenStore",
+]
@@ -0,0 +1,151 @@
+import hashlib
+import inspect
+import secrets
+import threading
+import uuid
+
+
+class RefreshTokenStore:
+    """
+    Issues, looks up, and revokes refresh tokens, which are kept in a clearskies model of your choosing.
+
+    Refresh tokens are random strings, and we only store their SHA-256 hash (in the `token_hash` column), so a leak
+    of the table doesn't leak usable tokens.  The tokens have far too much entropy to guess, so a plain hash is
+    enough (there's no need for a slow password hash) and a token is found with a single lookup by its hash: put
+    an index (ideally a unique one) on `token_hash`.
+
+    Tokens are rotated: every time a refresh token is exchanged, it's marked as used and a new one is issued in its
+    place, in the same family (`family_id`).  A family starts with a login, so it tracks one session.  If a used token
+    ever comes back, then either the client or an attacker has a stale copy, and since we can't tell which, the
+    whole family is revoked.
+
+    The model needs these columns:
+
+     1. `token_hash`: a string column
+     2. `user_id`: a string column with the id of the user
+     3. `family_id`: a string column
+     4. `expires_at`: a datetime column
+     5. `used_at`: a datetime column, empty until the token is exchanged
+     6. `revoked_at`: a datetime column, empty until the token is revoked
+
+    To revoke every refresh token a user has (e.g. after a password change), call `revoke_user(user_id)`.
+
+    Exchanging a token has to claim it atomically, or two requests with the same token could both get a new one.  For
+    models with a cursor backend, `claim` is a single conditional update (`... WHERE used_at IS NULL`).  Otherwise,
+    it's a compare-and-set under a lock, which is only atomic within the process (fine for the memory backend).  For
+    any other shared backend, extend this class and override `claim`.
+    """
+
+    column_names = ["token_hash", "user_id", "family_id", "expires_at", "used_at", "revoked_at"]
+
+    # shared by every store in the process, for the compare-and-set in `claim`
+    _claim_lock = threading.Lock()
+
+    def __init__(self, refresh_tokens, datetime, di):
+        self._refresh_tokens = refresh_tokens
+        self._datetime = datetime
+        self._di = di
+
+    @staticmethod
+    def hash_token(raw_token):
+        return hashlib.sha256(raw_token.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def missing_column_names(cls, model_class, di):
+        """
+        Returns the names of the columns that the refresh token model is missing.
+        """
+        columns = di.build(model_class).columns()
+        return [column_name for column_name in cls.column_names if column_name not in columns]
+
+    def issue(self, user_id, lifetime_seconds, family_id=None, family_expires_at=None):
+        """
+        Creates a new refresh token for the user, returning the token itself and when it expires.
+
+        Leave out the family id to start a new family (i.e. for a new login).  When rotating, pass along the expiration
+        of the token being exchanged as `family_expires_at`: the new token never outlives it, so the session ends
+        `lifetime_seconds` after the login no matter how often it's refreshed.
+        """
+        raw_token = secrets.token_urlsafe(32)
+        expires_at = self._now() + self._datetime.timedelta(seconds=lifetime_seconds)
+        if family_expires_at:
+            expires_at = min(expires_at, self._as_utc(family_expires_at))
+        self._refresh_tokens.create(
+            {
+                "token_hash": self.hash_token(raw_token),
+                "user_id": str(user_id),
+                "family_id": family_id if family_id else uuid.uuid4().hex,
+                "expires_at": expires_at,
+            }
+        )
+        return (raw_token, expires_at)
+
+    def find(self, raw_token):
+        """
+        Returns the refresh token model for the given token (which won't exist if there's no such token).
+        """
+        return self._refresh_tokens.find(f"token_hash={self.hash_token(raw_token)}")
+
+    def is_expired(self, refresh_token):
+        expires_at = refresh_token.get("expires_at")
+        if not expires_at:
+            return True
+        return self._as_utc(expires_at) <= self._now()
+
+    def claim(self, refresh_token):
+        """
+        Marks the token as used, returning False if something else got to it first.
+        """
+        if self._has_cursor_backend():
+            return self._claim_with_cursor(refresh_token)
+
+        with self._claim_lock:
+            current = self._refresh_tokens.find(f"token_hash={refresh_token.get('token_hash')}")
+            if not current.exists or current.get("used_at"):
+                return False
+            current.save({"used_at": self._now()})
+            return True
+
+    def _has_cursor_backend(self):
+        # clearskies models ask for their backend by name
+        return "cursor_backend" in inspect.signature(type(self._refresh_tokens)).parameters
+
+    def _claim_with_cursor(self, refresh_token):
+        used_at_column = self._refresh_tokens.columns()["used_at"]
+        used_at = used_at_column.to_backend({"used_at": self._now()})["used_at"]
+        table_name = ".".join(f"`{part}`" for part in self._refresh_tokens.table_name().split("."))
+        cursor = self._di.build("cursor", cache=True)
+        cursor.execute(
+            f"UPDATE {table_name} SET `used_at`=%s WHERE `token_hash`=%s AND `used_at` IS NULL",
+            (used_at, refresh_token.get("token_hash")),
+        )
+        return cursor.rowcount == 1
+
+    def revoke_family(self, family_id):
+        """
+        Revokes every token in the family, returning how many were revoked.
+        """
+        return self._revoke(self._refresh_tokens.where(f"family_id={family_id}"))
+
+    def revoke_user(self, user_id):
+        """
+        Revokes every token that the user has, returning how many were revoked.
+        """
+        return self._revoke(self._refresh_tokens.where(f"user_id={user_id}"))
+
+    def _revoke(self, refresh_tokens):
+        now = self._now()
+        revoked = 0
+        for refresh_token in refresh_tokens:
+            if refresh_token.get("revoked_at"):
+                continue
+            refresh_token.save({"revoked_at": now})
+            revoked += 1
+        return revoked
+
+    def _as_utc(self, date):
+        # datetimes from the backend may come back without a timezone
+        return date if date.tzinfo else date.replace(tzinfo=self._datetime.timezone.utc)
+
+    def _now(self):
+        return self._datetime.datetime.now(self._datetime.timezone.utc)
@@ -0,0 +1,98 @@
+import datetime
+import hashlib
+import unittest
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+from .refresh_token_store import RefreshTokenStore
+
+
+class RefreshTokens:
+    def __init__(self, memory_backend, columns):
+        self.create = MagicMock()
+        self.find = MagicMock()
+        self.where = MagicMock()
+
+
+class RefreshTokenStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        self.datetime = SimpleNamespace(
+            datetime=SimpleNamespace(now=lambda tz: self.now),
+            timedelta=datetime.timedelta,
+            timezone=datetime.timezone,
+        )
+        self.refresh_tokens = RefreshTokens(None, None)
+        self.di = SimpleNamespace(build=MagicMock())
+        self.store = RefreshTokenStore(self.refresh_tokens, self.datetime, self.di)
+
+    def test_issue(self):
+        (raw_token, expires_at) = self.store.issue(5, 60)
+        self.assertEqual(self.now + datetime.timedelta(seconds=60), expires_at)
+        stored = self.refresh_tokens.create.call_args.args[0]
+        self.assertEqual(hashlib.sha256(raw_token.encode("utf-8")).hexdigest(), stored["token_hash"])
+        self.assertEqual("5", stored["user_id"])
+        self.assertEqual(32, len(stored["family_id"]))
+
+        self.store.issue(5, 60, family_id="family")
+        self.assertEqual("family", self.refresh_tokens.create.call_args.args[0]["family_id"])
+        self.assertNotEqual(raw_token, self.store.issue(5, 60)[0])
+
+    def test_find(self):
+        self.store.find("asdf")
+        self.refresh_tokens.find.assert_called_once_with("token_hash=" + RefreshTokenStore.hash_token("asdf"))
+
+    def test_is_expired(self):
+        self.assertTrue(self.store.is_expired({"expires_at": None}))
+        self.assertTrue(self.store.is_expired({"expires_at": self.now}))
+        self.assertFalse(self.store.is_expired({"expires_at": self.now + datetime.timedelta(seconds=1)}))
+        # datetimes from the backend may come back without a timezone
+        self.assertFalse(self.store.is_expired({"expires_at": datetime.datetime(2024, 1, 1, 12, 0, 1)}))
+
+    def test_revoke_family(self):
+        revoked = SimpleNamespace(get=lambda key: self.now, save=MagicMock())
+        active = SimpleNamespace(get=lambda key: None, save=MagicMock())
+        self.refresh_tokens.where.return_value = [revoked, active]
+        self.assertEqual(1, self.store.revoke_family("family"))
+        self.refresh_tokens.where.assert_called_once_with("family_id=family")
+        revoked.save.assert_not_called()
+        active.save.assert_called_once_with({"revoked_at": self.now})
+
+    def test_claim(self):
+        unused = SimpleNamespace(exists=True, get=lambda key: None, save=MagicMock())
+        self.refresh_tokens.find.return_value = unused
+        self.assertTrue(self.store.claim({"token_hash": "abc"}))
+        self.refresh_tokens.find.assert_called_once_with("token_hash=abc")
+        unused.save.assert_called_once_with({"used_at": self.now})
+
+        # we check the current record, not the (possibly stale) one we were given
+        used = SimpleNamespace(exists=True, get=lambda key: self.now, save=MagicMock())
+        self.refresh_tokens.find.return_value = used
+        self.assertFalse(self.store.claim({"token_hash": "abc", "used_at": None}))
+        used.save.assert_not_called()
+
+    def test_claim_with_cursor(self):
+        cursor = MagicMock(rowcount=1)
+        self.di.build.return_value = cursor
+        used_at_column = SimpleNamespace(to_backend=lambda data: {"used_at": "2024-01-01 12:00:00"})
+
+        class CursorRefreshTokens:
+            def __init__(self, cursor_backend, columns):
+                pass
+
+            def columns(self):
+                return {"used_at": used_at_column}
+
+            def table_name(self):
+                return "auth.refresh_tokens"
+
+        store = RefreshTokenStore(CursorRefreshTokens(None, None), self.datetime, self.di)
+        self.assertTrue(store.claim({"token_hash": "abc"}))
+        self.di.build.assert_called_once_with("cursor", cache=True)
+        cursor.execute.assert_called_once_with(
+            "UPDATE `auth`.`refresh_tokens` SET `used_at`=%s WHERE `token_hash`=%s AND `used_at` IS NULL",
+            ("2024-01-01 12:00:00", "abc"),
+        )
+
+        # no rows changed means someone else already used it
+        cursor.rowcount = 0
+        self.assertFalse(store.claim({"token_hash": "abc"}))
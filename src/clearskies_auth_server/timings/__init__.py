@@ -0,0 +1,9 @@
+from .log_timing_sink import LogTimingSink
+from .request_timings import NullTimings, RequestTimings, null_timings
+
+__all__ = [
+    "LogTimingSink",
+    "NullTimings",
+    "RequestTimings",
+    "null_timings",
+]
@@ -0,0 +1,31 @@
+import json
+import logging
+
+
+class LogTimingSink:
+    """
+    A timing sink that writes one log line (a JSON object) per request.
+
+    Times are logged in milliseconds, e.g.:
+
+        {"handler": "PasswordLogin", "outcome": "success", "total_ms": 61.2, "phases": {"user_lookup": 0.4, ...}}
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger("clearskies_auth_server.timings")
+        self.level = level
+
+    def __call__(self, timings):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        self.logger.log(
+            self.level,
+            json.dumps(
+                {
+                    "handler": timings.handler,
+                    "outcome": timings.outcome,
+                    "total_ms": round(timings.total * 1000, 3),
+                    "phases": {phase: round(seconds * 1000, 3) for (phase, seconds) in timings.phases.items()},
+                }
+            ),
+        )
@@ -0,0 +1,30 @@
+import json
+import logging
+import unittest
+from types import SimpleNamespace
+from .log_timing_sink import LogTimingSink
+
+
+class LogTimingSinkTest(unittest.TestCase):
+    def test_log(self):
+        timings = SimpleNamespace(
+            handler="PasswordLogin", outcome="success", total=0.0625, phases={"user_lookup": 0.001, "sign": 0.0025}
+        )
+        logger = logging.getLogger("clearskies_auth_server.timings.test")
+        with self.assertLogs(logger, level="INFO") as logs:
+            LogTimingSink(logger)(timings)
+        self.assertEqual(
+            {
+                "handler": "PasswordLogin",
+                "outcome": "success",
+                "total_ms": 62.5,
+                "phases": {"user_lookup": 1.0, "sign": 2.5},
+            },
+            json.loads(logs.records[0].getMessage()),
+        )
+
+    def test_disabled_level(self):
+        logger = logging.getLogger("clearskies_auth_server.timings.test_disabled")
+        logger.setLevel(logging.WARNING)
+        # nothing is formatted (so the timings aren't even looked at) if the level is off
+        LogTimingSink(logger, level=logging.DEBUG)(None)
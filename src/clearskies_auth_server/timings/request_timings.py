@@ -0,0 +1,65 @@
+import time
+
+
+class RequestTimings:
+    """
+    Records how long each phase of a request takes.
+
+    Phases are measured back to back: `mark(phase)` charges everything since the previous mark (or the start of
+    the request) to the given phase.  A phase that happens more than once in a request (e.g. two audit records)
+    is added up.  Set `outcome` before the request ends (otherwise it's recorded as an `error`), and once it's done,
+    `finish()` hands the timings to the sink, which gets this object with:
+
+     1. `handler`: the name of the handler class
+     2. `outcome`: how the request ended (e.g. `success` or `invalid_password`)
+     3. `phases`: a dictionary with the number of seconds spent in each phase, in the order they happened
+     4. `total`: the number of seconds from start to finish
+    """
+
+    __slots__ = ("handler", "outcome", "phases", "total", "_sink", "_clock", "_start", "_last")
+
+    def __init__(self, handler, sink, clock=time.perf_counter):
+        self.handler = handler
+        self.outcome = "error"
+        self.phases = {}
+        self.total = None
+        self._sink = sink
+        self._clock = clock
+        self._start = self._last = clock()
+
+    def mark(self, phase):
+        now = self._clock()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self._last
+        self._last = now
+
+    def finish(self):
+        self.total = self._clock() - self._start
+        self._sink(self)
+
+    def as_dict(self):
+        return {
+            "handler": self.handler,
+            "outcome": self.outcome,
+            "total": self.total,
+            "phases": {**self.phases},
+        }
+
+
+class NullTimings:
+    """
+    Stands in for RequestTimings when nobody is listening, so that instrumented code doesn't need to check.
+    """
+
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "error"
+
+    def mark(self, phase):
+        pass
+
+    def finish(self):
+        pass
+
+
+null_timings = NullTimings()
@@ -0,0 +1,47 @@
+import unittest
+from .request_timings import RequestTimings, null_timings
+
+
+class RequestTimingsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 10.0
+        self.recorded = []
+
+    def clock(self):
+        return self.now
+
+    def test_phases(self):
+        timings = RequestTimings("PasswordLogin", self.recorded.append, clock=self.clock)
+        self.now = 10.5
+        timings.mark("user_lookup")
+        self.now = 11.0
+        timings.mark("audit")
+        self.now = 13.0
+        timings.mark("password_verify")
+        self.now = 13.25
+        timings.mark("audit")
+        self.now = 14.0
+        self.assertEqual([], self.recorded)
+
+        timings.outcome = "success"
+        timings.finish()
+        self.assertEqual([timings], self.recorded)
+        self.assertEqual(
+            {
+                "handler": "PasswordLogin",
+                "outcome": "success",
+                "total": 4.0,
+                "phases": {"user_lookup": 0.5, "audit": 0.75, "password_verify": 2.0},
+            },
+            timings.as_dict(),
+        )
+        self.assertEqual(["user_lookup", "audit", "password_verify"], list(timings.phases.keys()))
+
+    def test_default_outcome(self):
+        timings = RequestTimings("PasswordLogin", self.recorded.append, clock=self.clock)
+        timings.finish()
+        self.assertEqual("error", self.recorded[0].outcome)
+
+    def test_null_timings(self):
+        null_timings.mark("user_lookup")
+        null_timings.finish()